@@ -0,0 +1,168 @@
+import math
+import os
+import zipfile
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional
+
+from records import TextFile, text_lines
+
+# How the raw evaluation text is written below a student's sheet:
+#   lines    one cell per line (the default)
+#   compact  lines joined into wrapped cells of bounded size; lines shared by many students
+#            are written once to a 'Boilerplate' sheet and linked instead
+#   sidecar  texts go to a zip archive next to the workbook; the sheet links to it
+APPENDIX_MODES = ('lines', 'compact', 'sidecar')
+
+# Excel's limit for the characters of a cell; xlsxwriter silently truncates longer strings
+MAX_CELL_CHARS = 32767
+DEFAULT_CHUNK_CHARS = 4000
+# The appendix spans columns A:H (about 155 characters wide); Excel caps rows at 409 points
+WRAP_WIDTH = 150
+LINE_HEIGHT = 15
+MAX_ROW_HEIGHT = 409
+
+BOILERPLATE_SHEET = 'Boilerplate'
+
+def default_sidecar_path(workbook_path: str | Path) -> Path:
+    """Returns the text archive written next to a workbook in sidecar mode."""
+    workbook_path = Path(workbook_path)
+    return workbook_path.with_name(workbook_path.stem + '.texts.zip')
+
+def split_long_line(line: str, limit: int) -> List[str]:
+    """Cuts a line into pieces of at most limit characters."""
+    if len(line) <= limit:
+        return [line]
+    return [line[start:start + limit] for start in range(0, len(line), limit)]
+
+def wrapped_rows(line: str) -> int:
+    """Estimated number of visual rows a line takes in a wrapped appendix cell."""
+    return max(1, math.ceil(len(line) / WRAP_WIDTH))
+
+def find_boilerplate(texts: Iterable[Any], min_share: float = 0.1, min_students: int = 3, min_length: int = 30) -> List[str]:
+    """Returns the lines that occur in the texts of many students, in order of first appearance.
+
+    texts are strings or TextFiles. A line counts as boilerplate if it has at least min_length
+    characters and occurs in at least min_students texts and min_share of all texts.
+    """
+    counts = Counter()
+    # Order of first appearance, so blocks shared by many texts get consecutive numbers
+    first_seen = {}
+    text_count = 0
+    for text in texts:
+        text_count += 1
+        lines = [line for line in text_lines(text) if len(line.strip()) >= min_length]
+        counts.update(set(lines))
+        for line in lines:
+            first_seen.setdefault(line, len(first_seen))
+    threshold = max(min_students, math.ceil(min_share * text_count))
+    return sorted((line for line, count in counts.items() if count >= threshold), key=first_seen.__getitem__)
+
+class AppendixWriter:
+    """Writes the raw evaluation texts of one workbook in one of the APPENDIX_MODES.
+
+    write() adds a student's appendix to their sheet, finish() adds the Boilerplate sheet
+    (compact) and closes the text archive (sidecar). boilerplate is a find_boilerplate result;
+    without it, compact mode only chunks.
+    """
+
+    def __init__(self, mode: str = 'lines', chunk_chars: int = DEFAULT_CHUNK_CHARS, boilerplate: Optional[List[str]] = None, workbook_path: Optional[str | Path] = None):
+        if mode not in APPENDIX_MODES:
+            raise ValueError(f"Unknown appendix mode '{mode}' (use {', '.join(APPENDIX_MODES)})")
+        if not 1 <= chunk_chars <= MAX_CELL_CHARS:
+            raise ValueError(f"Appendix chunks must have 1 to {MAX_CELL_CHARS} characters")
+        self.mode = mode
+        self.chunk_chars = chunk_chars
+        self.boilerplate = boilerplate if mode == 'compact' and boilerplate else []
+        self._boilerplate_index = {line: index for index, line in enumerate(self.boilerplate)}
+        self.archive_path = None
+        self._archive = None
+        if mode == 'sidecar':
+            if workbook_path is None:
+                raise ValueError("The sidecar appendix needs the workbook path")
+            self.archive_path = default_sidecar_path(workbook_path)
+            self._archive_tmp = self.archive_path.with_name(self.archive_path.name + '.tmp')
+            self._archive = zipfile.ZipFile(self._archive_tmp, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, sheet, row: int, username: str, text, formats: Dict[str, Any]) -> int:
+        """Writes a student's text (string or TextFile) from row on; returns the cells written."""
+        if self.mode == 'sidecar':
+            member = f"{username}.txt"
+            if isinstance(text, TextFile):
+                self._archive.write(text.path, member)
+            else:
+                self._archive.writestr(member, text)
+            sheet.write_url(row, 0, f"external:{self.archive_path.name}", string=f"Full text: {self.archive_path.name}, file {member}")
+            return 1
+        if self.mode == 'lines':
+            cells = 0
+            for line in text_lines(text):
+                for piece in split_long_line(line, MAX_CELL_CHARS):
+                    sheet.write_string(row + cells, 0, piece)
+                    cells += 1
+            return cells
+        return self._write_compact(sheet, row, text, formats)
+
+    def _write_compact(self, sheet, row: int, text, formats: Dict[str, Any]) -> int:
+        first_row = row
+        chunk = []
+        chunk_chars = 0
+        chunk_rows = 0
+        run = None  # (first, last) boilerplate index of the pending reference
+
+        def flush_chunk():
+            nonlocal row, chunk, chunk_chars, chunk_rows
+            if chunk:
+                sheet.merge_range(row, 0, row, 7, "\n".join(chunk), formats['appendix'])
+                sheet.set_row(row, min(MAX_ROW_HEIGHT, chunk_rows * LINE_HEIGHT))
+                row += 1
+                chunk, chunk_chars, chunk_rows = [], 0, 0
+
+        def flush_run():
+            nonlocal row, run
+            if run is not None:
+                first, last = run
+                rows = f"row {first + 2}" if first == last else f"rows {first + 2}-{last + 2}"
+                sheet.write_url(row, 0, f"internal:'{BOILERPLATE_SHEET}'!A{first + 2}", string=f"[Shared text, see {BOILERPLATE_SHEET} {rows}]")
+                row += 1
+                run = None
+
+        for line in text_lines(text):
+            index = self._boilerplate_index.get(line)
+            if index is not None:
+                flush_chunk()
+                if run is not None and index == run[1] + 1:
+                    run = (run[0], index)
+                else:
+                    flush_run()
+                    run = (index, index)
+                continue
+            flush_run()
+            for piece in split_long_line(line, self.chunk_chars):
+                rows = wrapped_rows(piece)
+                if chunk and (chunk_chars + 1 + len(piece) > self.chunk_chars or (chunk_rows + rows) * LINE_HEIGHT > MAX_ROW_HEIGHT):
+                    flush_chunk()
+                chunk.append(piece)
+                chunk_chars += len(piece) + (1 if len(chunk) > 1 else 0)
+                chunk_rows += rows
+        flush_chunk()
+        flush_run()
+        return row - first_row
+
+    def finish(self, workbook, formats: Dict[str, Any]):
+        """Adds the Boilerplate sheet (compact) or completes the text archive (sidecar)."""
+        if self.boilerplate:
+            sheet = workbook.add_worksheet(BOILERPLATE_SHEET)
+            sheet.set_column('A:A', 150, formats['appendix'])
+            sheet.write_string(0, 0, "Text shared by the evaluations of several students", formats['header'])
+            for index, line in enumerate(self.boilerplate, start=1):
+                for piece in split_long_line(line, MAX_CELL_CHARS)[:1]:
+                    sheet.write_string(index, 0, piece)
+        self.close()
+
+    def close(self):
+        """Closes the text archive; it only replaces an existing one once it is complete."""
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+            os.replace(self._archive_tmp, self.archive_path)
@@ -0,0 +1,254 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from instrumentation import RunReport, add_listener, remove_listener
+
+# Runs main.py for several courses from one manifest. All courses share one process pool of
+# --jobs workers, each running one course at a time; a worker imports pandas and xlsxwriter
+# once and keeps them for every further course it runs. The largest input directories are
+# started first so a big course does not finish alone at the end. Parse caches are kept
+# together in --cache-dir, one file per course (ParseCache.save keeps only the entries a run
+# used, so courses sharing one file would evict each other's). A course that fails, or whose
+# options are invalid, is reported as failed without stopping the others.
+#
+#   [defaults]                 # main.py options for every course, by their long names
+#   scheme = "isbpm.toml"
+#   layout = "scores"
+#
+#   [[course]]
+#   name = "bpm-ws25"          # optional, defaults to the input directory's name
+#   input_dir = "ws25/inputs"
+#   output = "ws25/grades.xlsx"
+#   export = ["ws25/grades.csv"]
+
+# Options that are file paths; relative ones are resolved against the manifest's directory
+PATH_OPTIONS = ('input_dir', 'output', 'scheme', 'export', 'import_overrides', 'report', 'cache')
+# Options that never finish (watch, serve) or would start processes beyond --jobs: workers
+# sizes the pools that parse the files and write the shards (--shards/--shard-by), which a
+# batch course always does in its own worker process
+UNSUPPORTED_OPTIONS = ('watch', 'serve', 'workers')
+
+def load_manifest(path: str | Path) -> Dict[str, Any]:
+    """Loads a manifest file (.toml or .json) with optional 'defaults' and a list of 'course' entries.
+
+    Invalid manifests raise ValueError.
+    """
+    path = Path(path)
+    if path.suffix.lower() == '.toml':
+        import tomllib
+        with open(path, 'rb') as f:
+            manifest = tomllib.load(f)
+    elif path.suffix.lower() == '.json':
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    else:
+        raise ValueError(f"Unsupported manifest file: {path} (use .toml or .json)")
+    courses = manifest.get('course')
+    if not isinstance(courses, list) or not courses or not all(isinstance(course, dict) for course in courses):
+        raise ValueError(f"Invalid manifest {path}: expected at least one [[course]] entry")
+    if not isinstance(manifest.get('defaults', {}), dict):
+        raise ValueError(f"Invalid manifest {path}: 'defaults' must be a table")
+    return manifest
+
+def course_argv(options: Dict[str, Any], base_dir: Path) -> List[str]:
+    """Turns a course's manifest options into main.py arguments."""
+    argv = []
+    for key, value in options.items():
+        dest = key.replace('-', '_')
+        values = value if isinstance(value, list) else [value]
+        if dest in PATH_OPTIONS:
+            values = [str(base_dir / str(item)) for item in values]
+        flag = '--' + dest.replace('_', '-')
+        for item in values:
+            if item is True:
+                argv.append(flag)
+            elif item is not False:
+                argv += [flag, str(item)]
+    return argv
+
+def input_size(input_dir: str | Path) -> int:
+    """Total size of the files directly in an input directory (0 if it cannot be read)."""
+    try:
+        with os.scandir(input_dir) as entries:
+            return sum(entry.stat().st_size for entry in entries if entry.is_file())
+    except OSError:
+        return 0
+
+def plan_courses(manifest: Dict[str, Any], base_dir: Path, cache_dir: Optional[Path]) -> List[Dict[str, Any]]:
+    """Builds every course's main.py options, checked like the command line.
+
+    Courses with invalid options get an 'error' and no 'args'.
+    """
+    from main import build_parser, check_args
+    defaults = manifest.get('defaults', {})
+    courses = []
+    names, outputs = set(), set()
+    for position, entry in enumerate(manifest['course'], 1):
+        options = {**defaults, **entry}
+        name = str(options.pop('name', None) or Path(str(options.get('input_dir', f"course-{position}"))).name)
+        course = {'name': name, 'args': None, 'error': None}
+        courses.append(course)
+        unsupported = [key for key in options if key.replace('-', '_') in UNSUPPORTED_OPTIONS]
+        if unsupported:
+            course['error'] = f"Option '{unsupported[0]}' is not supported in a batch"
+            continue
+        parser = build_parser()
+        stderr = io.StringIO()
+        try:
+            with contextlib.redirect_stderr(stderr):
+                args = parser.parse_args(course_argv(options, base_dir))
+                check_args(parser, args)
+        except SystemExit:
+            course['error'] = stderr.getvalue().strip().splitlines()[-1].removeprefix(f"{parser.prog}: error: ")
+            continue
+        output = str(Path(args.output).resolve())
+        if name in names or output in outputs:
+            course['error'] = f"Another course already uses the name '{name}' or the output {args.output}"
+            continue
+        names.add(name)
+        outputs.add(output)
+        if cache_dir is not None and not args.stream and args.cache is None:
+            args.incremental = True
+            args.cache = str(cache_dir / f"{name}.cache.pkl")
+        course['args'] = args
+        course['size'] = input_size(args.input_dir)
+    return courses
+
+def run_course(args) -> Dict[str, Any]:
+    """Runs main.run for one course in a pool worker and returns its status, report and output."""
+    from main import run
+    # One process per course: parse and write the shards sequentially in this worker
+    args.workers = 1
+    report = RunReport()
+    log = io.StringIO()
+    add_listener(report)
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(log):
+            status = run(args)
+        error = None if status == 0 else f"Exit status {status}"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        log.write(traceback.format_exc())
+    finally:
+        remove_listener(report)
+    seconds = time.perf_counter() - start
+    if args.report is not None:
+        report.write(args.report)
+    return {'error': error, 'seconds': seconds, 'report': report.to_dict(), 'log': log.getvalue()}
+
+def run_batch(courses: List[Dict[str, Any]], jobs: int) -> float:
+    """Runs the valid courses in one pool of at most jobs workers and stores each result in its course.
+
+    Returns the wall time in seconds.
+    """
+    runnable = sorted((course for course in courses if course['args'] is not None), key=lambda course: course['size'], reverse=True)
+    start = time.perf_counter()
+    if not runnable:
+        return 0.0
+    # Spawned workers start clean and import the pipeline once for all the courses they run
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(jobs, len(runnable)), mp_context=context) as executor:
+        futures = {executor.submit(run_course, course['args']): course for course in runnable}
+        for future in as_completed(futures):
+            course = futures[future]
+            try:
+                course.update(future.result())
+            except Exception as e:
+                # e.g. a worker killed for running out of memory; the pool then fails the
+                # courses still queued as well, which are reported like this one
+                course['error'] = f"{type(e).__name__}: {e}"
+            status = 'failed' if course['error'] else 'done'
+            print(f"[{time.perf_counter() - start:7.1f}s] {course['name']}: {status}" + (f" ({course['error']})" if course['error'] else ""))
+    return time.perf_counter() - start
+
+def batch_summary(courses: List[Dict[str, Any]], wall_seconds: float, jobs: int) -> Dict[str, Any]:
+    """Returns the combined report: per-course status, timings and counters plus batch totals."""
+    course_seconds = sum(course.get('seconds', 0.0) for course in courses)
+    return {
+        'jobs': jobs,
+        'wall_seconds': wall_seconds,
+        'course_seconds': course_seconds,
+        # Courses running at a time on average; a speedup only while jobs <= CPUs
+        'parallelism': course_seconds / wall_seconds if wall_seconds else None,
+        'failed': sum(1 for course in courses if course['error']),
+        'courses': [
+            {
+                'name': course['name'],
+                'input_dir': course['args'].input_dir if course['args'] is not None else None,
+                'output': course['args'].output if course['args'] is not None else None,
+                'status': 'failed' if course['error'] else 'done',
+                'error': course['error'],
+                'seconds': course.get('seconds'),
+                'report': course.get('report'),
+                'log': course.get('log')
+            }
+            for course in courses
+        ]
+    }
+
+def print_summary(summary: Dict[str, Any]):
+    """Prints one line per course and the batch totals; failed courses also show the end of their log."""
+    print(f"\n{'Course':<24} {'Status':<8} {'Sheets':>7} {'Seconds':>8}  Output")
+    for course in summary['courses']:
+        counters = (course['report'] or {}).get('counters', {})
+        seconds = f"{course['seconds']:.1f}" if course['seconds'] is not None else '-'
+        print(f"{course['name']:<24} {course['status']:<8} {counters.get('sheets_written', 0):>7} {seconds:>8}  {course['output'] or '-'}")
+    for course in summary['courses']:
+        if course['error']:
+            print(f"\n{course['name']}: {course['error']}")
+            for line in (course['log'] or '').splitlines()[-10:]:
+                print(f"  {line}")
+    parallelism = f"{summary['parallelism']:.1f}" if summary['parallelism'] else '-'
+    done = len(summary['courses']) - summary['failed']
+    print(f"\n{len(summary['courses'])} courses ({done} done, {summary['failed']} failed) in {summary['wall_seconds']:.1f} s "
+          f"wall time; {summary['course_seconds']:.1f} s of course time, {parallelism} of {summary['jobs']} workers busy on average.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the grading tool for every course in a manifest, sharing one worker pool")
+    parser.add_argument('manifest', type=str, help="Manifest file (.toml or .json) with [defaults] and one [[course]] entry per input directory and output")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="Courses run at the same time, one per worker process (default: the number of CPUs)")
+    parser.add_argument('--cache-dir', type=str, default=None, help="Directory for the courses' parse caches (default: '<manifest>.cache' next to the manifest)")
+    parser.add_argument('--no-cache', action='store_true', help="Parse every grading file again instead of reusing the parse caches")
+    parser.add_argument('--report', type=str, default=None, help="Write the combined JSON report (per-course status, log, stage timings and counters) to this file")
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.no_cache and args.cache_dir is not None:
+        parser.error("--no-cache cannot be combined with --cache-dir")
+
+    manifest_path = Path(args.manifest)
+    try:
+        manifest = load_manifest(manifest_path)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = Path(args.cache_dir) if args.cache_dir else manifest_path.with_name(manifest_path.stem + '.cache')
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+    courses = plan_courses(manifest, manifest_path.parent, cache_dir)
+    runnable = sum(1 for course in courses if course['args'] is not None)
+    print(f"Running {runnable} of {len(courses)} courses on {min(args.jobs, max(runnable, 1))} workers...")
+    wall_seconds = run_batch(courses, args.jobs)
+    summary = batch_summary(courses, wall_seconds, args.jobs)
+    print_summary(summary)
+    if args.report is not None:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, default=str)
+        print(f"Report written to {args.report}")
+    sys.exit(1 if summary['failed'] else 0)
+
+if __name__ == "__main__":
+    main()
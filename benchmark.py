@@ -0,0 +1,232 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from rubric import FORMALITIES, SOLUTION_REPORT, PRACTICAL_TASK
+
+FIRST_NAMES = ["Anna", "Jonas", "Lea", "Lukas", "Marie", "Felix", "Sophie", "Paul", "Emilia", "Jürgen", "Zoë", "Ömer", "Hannah", "Elias", "Clara"]
+LAST_NAMES = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker", "Schäfer", "Koch", "Brzęczyszczykiewicz", "Groß", "Nguyen", "Öztürk", "Richter"]
+
+TASK_COLUMNS = [
+    'Task', 'practicalTaskCorrect', 'practicalTaskDetails',
+    'approachCorrect', 'approachConvincing', 'approachReferences',
+    'situationalityCorrect', 'situationalityConvincing', 'situationalityReferences',
+    'implicationsCorrect', 'implicationsConvincing', 'implicationsReferences'
+]
+
+def _score(rng: random.Random, max_score: float) -> str:
+    # Mostly half-point steps, occasionally left blank by the grader
+    if rng.random() < 0.01:
+        return ""
+    return f"{rng.randint(0, int(max_score * 2)) / 2:g}"
+
+def _write_other(path: Path, rng: random.Random):
+    rows = ["Category,Item,Score,Notes"]
+    items = [(entry['category'], entry['item'], entry['max']) for entry in FORMALITIES]
+    items += [(sub['category'], sub['item'], sub['max']) for dim in SOLUTION_REPORT for sub in dim['sub']]
+    for category, item, max_score in items:
+        note = rng.choice(["", "Good.", "Missing details, see p. 3", "Well argued, but \"Figure 2\" lacks a caption."])
+        rows.append(f'{category},"{item}",{_score(rng, max_score)},"{note.replace(chr(34), chr(34) * 2)}"')
+    path.write_text("\n".join(rows) + "\n", encoding='utf-8')
+
+def _write_tasks(path: Path, rng: random.Random, task_count: int):
+    rows = [",".join(TASK_COLUMNS)]
+    for task in range(1, task_count + 1):
+        scores = [_score(rng, PRACTICAL_TASK['correct_max']), _score(rng, PRACTICAL_TASK['details_max'])]
+        scores += [_score(rng, max_score) for _ in range(3) for max_score in (2.0, 2.0, 1.0)]
+        rows.append(f"Task {task}," + ",".join(scores))
+    path.write_text("\n".join(rows) + "\n", encoding='utf-8')
+
+def _write_text(path: Path, rng: random.Random, line_count: int):
+    lines = [f"Evaluation of submission {path.stem}", ""]
+    for i in range(line_count):
+        lines.append(f"{i + 1}. " + " ".join(rng.choice(["The", "model", "covers", "the", "process", "correctly", "but", "misses", "an", "exception", "path", "gateway", "event"]) for _ in range(rng.randint(5, 25))))
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+def generate_cohort(out_dir: str | Path, size: int, seed: int = 0, name_files_share: float = 0.3, missing_share: float = 0.05, text_lines: int = 40) -> Path:
+    """Writes a synthetic cohort of `size` students to out_dir and returns the directory.
+
+    Produces a students.csv (plus a few tutor rows that parse_students filters out) and,
+    per student, *-other.csv, *-tasks.csv and .txt files. A name_files_share of students
+    use the {LastName}-{FirstName}-* naming with non-ASCII names; missing_share have no
+    files at all and some have only a tasks file.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+
+    roster = ["Username;First name;Last name;Matriculation number;E-mail;Status"]
+    for i in range(size):
+        first = rng.choice(FIRST_NAMES)
+        # The index keeps the {LastName}-{FirstName} prefix unique within the cohort
+        last = f"{rng.choice(LAST_NAMES)}{i}"
+        username = f"s{i:06d}"
+        roster.append(f"{username};{first};{last};{1000000 + i};{username}@example.org;autor")
+
+        roll = rng.random()
+        if roll < missing_share:
+            continue
+        stem = f"{last}-{first}" if rng.random() < name_files_share else username
+        _write_tasks(out_dir / f"{stem}-tasks.csv", rng, rng.randint(3, 6))
+        if roll < missing_share * 2:
+            continue
+        _write_other(out_dir / f"{stem}-other.csv", rng)
+        _write_text(out_dir / f"{stem}.txt", rng, text_lines)
+    for i in range(max(1, size // 100)):
+        roster.append(f"tutor{i};Tu;Tor{i};0;tutor{i}@example.org;tutor")
+
+    (out_dir / "students.csv").write_text("\n".join(roster) + "\n", encoding='utf-8')
+    return out_dir
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+# Students per cohort whose calculate_grades_batch row is checked against calculate_grades
+CHECK_SAMPLE = 1000
+
+def batch_mismatches(batch, all_other: Dict[str, Any], all_tasks: Dict[str, Any], sample: int = CHECK_SAMPLE) -> List[str]:
+    """Returns the usernames whose calculate_grades_batch row differs from calculate_grades.
+
+    Checks up to sample students spread evenly over batch, compared exactly since the batch
+    promises identical results to the last bit.
+    """
+    from calculator import calculate_grades
+    usernames = list(batch.index)
+    mismatched = []
+    for username in usernames[::max(1, len(usernames) // sample)]:
+        row = batch.loc[username]
+        for name, value in calculate_grades(all_other.get(username), all_tasks.get(username)).items():
+            both_nan = isinstance(value, float) and math.isnan(value) and isinstance(row[name], float) and math.isnan(row[name])
+            if row[name] != value and not both_nan:
+                mismatched.append(username)
+                break
+    return mismatched
+
+def run_pipeline(input_dir: str | Path, output_path: str | Path, workers: int = 1, stream: bool = False) -> Dict[str, Any]:
+    """Runs the main.py pipeline stage by stage and returns wall times, peak RSS and output size.
+
+    Meant to run in a fresh process so the peak RSS belongs to this cohort alone. Outside
+    the timed stages, the batch grades are checked against calculate_grades (see
+    batch_mismatches); the mismatching students are counted under 'batch_mismatches'.
+    """
+    from parser import parse_students, DirectoryIndex
+    from rubric import resolve_rubric
+    from calculator import calculate_grades_batch
+    from excel_generator import write_excel, write_excel_streaming
+    from pipeline import discover_student_files, parse_all_students, iter_streamed_records
+
+    input_dir = Path(input_dir)
+    stages = {}
+    mismatches = []
+
+    def timed(name, func, *args, **kwargs):
+        start = time.perf_counter()
+        # Keep the pipeline's progress messages out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func(*args, **kwargs)
+        stages[name] = time.perf_counter() - start
+        return result
+
+    students_df = timed('load_students', parse_students, input_dir / 'students.csv')
+    index = timed('scan_directory', DirectoryIndex, input_dir)
+    jobs = timed('discover', discover_student_files, students_df.to_dict('records'), index)
+
+    if stream:
+        errors = {}
+        timed('parse_and_write', write_excel_streaming, str(output_path), iter_streamed_records(students_df, jobs, workers, errors))
+    else:
+        parsed, errors = timed('parse', parse_all_students, [(username, files) for username, files in jobs if any(files.values())], workers)
+        all_other = {u: d['other'] for u, d in parsed.items() if d['other'] is not None}
+        all_tasks = {u: d['tasks'] for u, d in parsed.items() if d['tasks'] is not None}
+        all_texts = {u: d['text'] for u, d in parsed.items() if d['text'] is not None}
+        all_rubrics = timed('resolve_rubrics', lambda: {u: resolve_rubric(df) for u, df in all_other.items()})
+        batch = timed('calculate', calculate_grades_batch, all_other, all_tasks)
+        mismatches = batch_mismatches(batch, all_other, all_tasks)
+        timed('write_excel', write_excel, str(output_path), students_df, all_tasks, all_other, all_texts, all_rubrics)
+
+    return {
+        'students': len(students_df),
+        'input_files': len(index.files),
+        'errors': len(errors),
+        'batch_mismatches': len(mismatches),
+        'stages': stages,
+        'total_seconds': sum(stages.values()),
+        'peak_rss_mb': _peak_rss_mb(),
+        'output_bytes': os.path.getsize(output_path)
+    }
+
+def benchmark(sizes: List[int], work_dir: str | Path, workers: int = 1, stream: bool = False, seed: int = 0, text_lines: int = 40) -> List[Dict[str, Any]]:
+    """Generates each cohort size under work_dir and benchmarks it in its own process."""
+    work_dir = Path(work_dir)
+    results = []
+    # A fresh (spawned) process per cohort, so earlier runs do not inflate the peak RSS
+    context = multiprocessing.get_context('spawn')
+    for size in sizes:
+        cohort_dir = work_dir / f"cohort-{size}"
+        start = time.perf_counter()
+        if not (cohort_dir / 'students.csv').exists():
+            generate_cohort(cohort_dir, size, seed=seed, text_lines=text_lines)
+        generate_seconds = time.perf_counter() - start
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_pipeline, cohort_dir, work_dir / f"output-{size}.xlsx", workers, stream).result()
+        result['size'] = size
+        result['generate_seconds'] = generate_seconds
+        results.append(result)
+        print_result(result)
+    return results
+
+def print_result(result: Dict[str, Any]):
+    """Prints one cohort's benchmark result as a short block."""
+    rss = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else "n/a"
+    print(f"Cohort of {result['size']} students: {result['total_seconds']:.2f}s total, peak RSS {rss}, output {result['output_bytes'] / (1024 * 1024):.1f} MB")
+    for name, seconds in result['stages'].items():
+        print(f"  {name:<16} {seconds:8.2f}s")
+    if result.get('batch_mismatches'):
+        print(f"Warning: calculate_grades_batch disagrees with calculate_grades for {result['batch_mismatches']} checked student(s).")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the grading pipeline on synthetic cohorts")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000, 20000], help="Cohort sizes to benchmark")
+    parser.add_argument('--work-dir', type=str, default=None, help="Directory for the generated cohorts and workbooks (default: a temporary directory that is removed afterwards)")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes used to parse the grading files")
+    parser.add_argument('--stream', action='store_true', help="Benchmark the --stream pipeline instead of the default one")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data generator")
+    parser.add_argument('--text-lines', type=int, default=40, help="Lines of raw evaluation text per student")
+    parser.add_argument('--json', type=str, default=None, help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix='grading-bench-'))
+    try:
+        results = benchmark(args.sizes, work_dir, args.workers, args.stream, args.seed, args.text_lines)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
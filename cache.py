@@ -0,0 +1,102 @@
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+from instrumentation import emit
+
+# Bump whenever the parsed representation or the parse results change so stale caches are discarded
+CACHE_VERSION = 3
+
+def default_cache_path(output_path: str | Path) -> Path:
+    """Returns the cache location used for an output workbook (stored next to it)."""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.stem + '.cache.pkl')
+
+def file_digest(filepath: str | Path) -> str:
+    """Returns the SHA-256 hex digest of a file's content."""
+    with open(filepath, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def file_fingerprint(filepath: str | Path, use_hash: bool = False) -> Tuple:
+    """Returns (size, mtime_ns) of a file, plus its SHA-256 digest if use_hash is set."""
+    stat = os.stat(filepath)
+    emit('file_stat', path=str(filepath), hashed=use_hash)
+    if not use_hash:
+        return (stat.st_size, stat.st_mtime_ns)
+    return (stat.st_size, stat.st_mtime_ns, file_digest(filepath))
+
+class ParseCache:
+    """On-disk cache of parsed grading files, keyed by path and validated by size + mtime.
+
+    With use_hash the content digest is checked as well, which also catches edits that
+    preserve size and mtime (e.g. files restored from an archive).
+    """
+
+    def __init__(self, cache_path: str | Path, use_hash: bool = False):
+        self.cache_path = Path(cache_path)
+        self.use_hash = use_hash
+        self.entries: Dict[str, Tuple[Tuple, Any]] = {}
+        self.used: Dict[str, Tuple[Tuple, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> 'ParseCache':
+        """Loads the cache file; a missing, unreadable or outdated cache starts out empty."""
+        try:
+            with open(self.cache_path, 'rb') as f:
+                payload = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return self
+        if isinstance(payload, dict) and payload.get('version') == CACHE_VERSION and payload.get('use_hash') == self.use_hash:
+            self.entries = payload['entries']
+        return self
+
+    def save(self):
+        """Writes the entries used in this run, dropping files that no longer exist."""
+        payload = {'version': CACHE_VERSION, 'use_hash': self.use_hash, 'entries': self.used}
+        tmp_path = self.cache_path.with_name(self.cache_path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.cache_path)
+
+    def get(self, filepath: str | Path) -> Tuple[bool, Any, Tuple]:
+        """Returns (hit, parsed value, fingerprint) for a file."""
+        key = str(filepath)
+        fingerprint = file_fingerprint(filepath, self.use_hash)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            self.used[key] = entry
+            self.hits += 1
+            emit('cache_hit', path=key)
+            return True, entry[1], fingerprint
+        self.misses += 1
+        emit('cache_miss', path=key)
+        return False, None, fingerprint
+
+    def put(self, filepath: str | Path, fingerprint: Tuple, value: Any):
+        """Stores the parsed value of a file under the fingerprint taken before parsing it."""
+        # Also served to later lookups, e.g. by a long-running --watch session
+        self.entries[str(filepath)] = self.used[str(filepath)] = (fingerprint, value)
+
+def split_cached(cache: Optional[ParseCache], found_files: Dict[str, Optional[Path]]) -> Tuple[Dict[str, Any], Dict[str, Path], Dict[str, Tuple]]:
+    """Splits a student's files into cached parsed values and files that still need parsing.
+
+    Returns (cached values by kind, files to parse by kind, fingerprints of the files to parse).
+    """
+    cached = {}
+    to_parse = {}
+    fingerprints = {}
+    for kind, filepath in found_files.items():
+        if filepath is None:
+            continue
+        if cache is None:
+            to_parse[kind] = filepath
+            continue
+        hit, value, fingerprint = cache.get(filepath)
+        if hit:
+            cached[kind] = value
+        else:
+            to_parse[kind] = filepath
+            fingerprints[kind] = fingerprint
+    return cached, to_parse, fingerprints
@@ -1,53 +1,122 @@
+import math
 import pandas as pd
 import numpy as np
-from typing import Dict, Any
-
-def get_german_grade(percentage: float) -> str:
-    """Maps a percentage (0.0 to 1.0) to the German grading scale 1.0 to 5.0"""
-    # Using typical university bounds:
-    # >= 0.95: 1.0
-    # >= 0.90: 1.3
-    # >= 0.85: 1.7
-    # >= 0.80: 2.0
-    # >= 0.75: 2.3
-    # >= 0.70: 2.7
-    # >= 0.65: 3.0
-    # >= 0.60: 3.3
-    # >= 0.55: 3.7
-    # >= 0.50: 4.0
-    # <  0.50: 5.0
-    if percentage >= 0.95: return "1.0"
-    if percentage >= 0.90: return "1.3"
-    if percentage >= 0.85: return "1.7"
-    if percentage >= 0.80: return "2.0"
-    if percentage >= 0.75: return "2.3"
-    if percentage >= 0.70: return "2.7"
-    if percentage >= 0.65: return "3.0"
-    if percentage >= 0.60: return "3.3"
-    if percentage >= 0.55: return "3.7"
-    if percentage >= 0.50: return "4.0"
-    return "5.0"
-
-def calculate_dim_percentage(correctness: float, convincingness: float, references: float) -> float:
-    """Calculates percentage for a Solution Report Dimension (Approach, Context, Implications)"""
-    return (correctness / 2.0) * 0.5 + (convincingness / 2.0) * 0.35 + (references / 1.0) * 0.15
-
-def calculate_grades(other_df: pd.DataFrame, tasks_df: pd.DataFrame) -> Dict[str, Any]:
+from typing import Dict, Any, Optional
+from records import as_frame, stack_other, stack_tasks
+from rubric import RubricScore, resolve_rubric, rubric_score
+from scheme import GradingScheme, default_scheme
+
+def get_german_grade(percentage: float, scheme: Optional[GradingScheme] = None) -> str:
+    """Maps a percentage (0.0 to 1.0) to the German grading scale 1.0 to 5.0 (or the scheme's scale)"""
+    # Using typical university bounds (see DEFAULT_DEFINITION['grade_scale'] in scheme.py):
+    # >= 0.95: 1.0, >= 0.90: 1.3, >= 0.85: 1.7, >= 0.80: 2.0, >= 0.75: 2.3, >= 0.70: 2.7,
+    # >= 0.65: 3.0, >= 0.60: 3.3, >= 0.55: 3.7, >= 0.50: 4.0, < 0.50: 5.0
+    return (scheme or default_scheme()).grade(percentage)
+
+def get_german_grades(percentages, scheme: Optional[GradingScheme] = None) -> np.ndarray:
+    """Vectorized get_german_grade: maps an array of percentages to grade strings."""
+    scheme = scheme or default_scheme()
+    percentages = np.asarray(percentages, dtype=float)
+    labels = np.array(scheme.grade_labels)
+    grades = labels[np.searchsorted(scheme.grade_bounds, percentages, side='right')]
+    # NaN fails every comparison and therefore maps to the lowest grade
+    return np.where(np.isnan(percentages), labels[0], grades)
+
+def calculate_dim_percentage(*scores, dim_key: str = 'approach', scheme: Optional[GradingScheme] = None) -> float:
+    """Calculates percentage for a Solution Report Dimension (Approach, Context, Implications)
+
+    scores are the dimension's item scores in scheme order, e.g. correctness, convincingness, references.
+    """
+    scheme = scheme or default_scheme()
+    by_key = dict(zip((key for key, _, _ in scheme.dimension_terms[dim_key]), scores))
+    return scheme.dimension_pct(dim_key, by_key.__getitem__)
+
+def calculate_task_percentage(correct, details, scheme: Optional[GradingScheme] = None):
+    """Calculates the percentage of a practical task (scalars or Series)"""
+    return (scheme or default_scheme()).task_pct(correct, details)
+
+def calculate_total_percentage(formalities_pct, practical_tasks_pct, solution_report_pct, scheme: Optional[GradingScheme] = None):
+    """Weights the three section percentages into the total percentage (scalars or Series)"""
+    return (scheme or default_scheme()).total_pct(formalities_pct, practical_tasks_pct, solution_report_pct)
+
+def task_dimension_pcts(tasks, scheme: GradingScheme) -> Dict[str, Any]:
+    """Per-task Solution Report dimension percentages ('<dim key>_pct') from the *-tasks.csv columns.
+
+    Items without a task column in the scheme count as 0.
+    """
+    column_score = lambda column: tasks[column] if column else 0.0
+    return {
+        f"{dim_key}_pct": scheme.ratio_sum([(column, max_score, weight) for column, (_, max_score, weight) in zip(scheme.dimension_task_columns[dim_key], terms)], column_score)
+        for dim_key, terms in scheme.dimension_terms.items()
+    }
+
+def ordered_mean(values) -> float:
+    """Mean of the non-NaN values, summed left to right (NaN if there are none).
+
+    Unlike Series.mean, whose summation depends on the array length and on bottleneck, the
+    result does not depend on how the values are stored, so calculate_grades_batch (see
+    ordered_group_means) reproduces it to the last bit and a total exactly on a grade
+    boundary gets the same grade either way.
+    """
+    total, count = 0.0, 0
+    # Not sum(), which compensates rounding errors since Python 3.12
+    for value in values:
+        if not math.isnan(value):
+            total += value
+            count += 1
+    return total / count if count else math.nan
+
+def ordered_group_means(frame: pd.DataFrame, groups) -> pd.DataFrame:
+    """ordered_mean of every column of frame per group, indexed by group in first-seen order.
+
+    The rows of all groups are added one position at a time, so each group is still summed
+    left to right in its row order while the work stays vectorized across groups.
+    """
+    codes, uniques = pd.factorize(pd.Series(groups).to_numpy())
+    position = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+    width = int(position.max()) + 1 if len(position) else 0
+    means = {}
+    for column in frame.columns:
+        values = np.full((len(uniques), width), np.nan)
+        values[codes, position] = frame[column].to_numpy(dtype=float)
+        total = np.zeros(len(uniques))
+        count = np.zeros(len(uniques))
+        for n in range(width):
+            present = ~np.isnan(values[:, n])
+            total = np.where(present, total + values[:, n], total)
+            count += present
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[column] = total / count
+    return pd.DataFrame(means, index=uniques)
+
+# calculate_grades and calculate_grades_batch are not used to grade: the workbook, --export,
+# the snapshot and --serve all take their grades from excel_generator.sheet_grades, which
+# follows the sheet's formulas. These two keep the per-student semantics (non-numeric scores
+# are left out of averages) and serve only benchmark.py, which times calculate_grades_batch
+# and checks it against calculate_grades on every cohort (see benchmark.batch_mismatches).
+def calculate_grades(other_df, tasks_df, rubric: Optional[Dict[str, RubricScore]] = None, scheme: Optional[GradingScheme] = None) -> Dict[str, Any]:
+    """Computes the sub-totals, total and German grade of one student.
+
+    other_df and tasks_df are the parsed CSVs as OtherRows / TaskRows or DataFrames.
+    Pass the resolve_rubric result of other_df as rubric to skip resolving it again.
+    """
+    scheme = scheme or default_scheme()
+    correct_column, details_column = scheme.practical_task['correct_column'], scheme.practical_task['details_column']
     res = {}
+    tasks_df = as_frame(tasks_df)
     
     # --- 1. Practical Tasks (40%) ---
     # For each task: (correctness/2)*0.65 + (detail/1)*0.35
     # Then average across all tasks
     if tasks_df is not None and not tasks_df.empty:
-        tasks_df['task_pct'] = (tasks_df['practicalTaskCorrect'] / 2.0) * 0.65 + (tasks_df['practicalTaskDetails'] / 1.0) * 0.35
-        practical_tasks_pct = tasks_df['task_pct'].mean()
+        tasks_df['task_pct'] = scheme.task_pct(tasks_df[correct_column], tasks_df[details_column])
+        practical_tasks_pct = ordered_mean(tasks_df['task_pct'])
         res['practical_tasks_pct'] = practical_tasks_pct
         
         # Calculate per-task Solution Report averages if needed for fallback
         # Just compute them as additional info
-        tasks_df['approach_pct'] = calculate_dim_percentage(tasks_df['approachCorrect'], tasks_df['approachConvincing'], tasks_df['approachReferences'])
-        tasks_df['sit_pct'] = calculate_dim_percentage(tasks_df['situationalityCorrect'], tasks_df['situationalityConvincing'], tasks_df['situationalityReferences'])
-        tasks_df['imp_pct'] = calculate_dim_percentage(tasks_df['implicationsCorrect'], tasks_df['implicationsConvincing'], tasks_df['implicationsReferences'])
+        for name, values in task_dimension_pcts(tasks_df, scheme).items():
+            tasks_df[name] = values
     else:
         res['practical_tasks_pct'] = 0.0
 
@@ -56,47 +125,80 @@ def calculate_grades(other_df: pd.DataFrame, tasks_df: pd.DataFrame) -> Dict[str
     res['solution_report_pct'] = 0.0
     
     if other_df is not None and not other_df.empty:
-        # Exctract Formatting, Structure, Style
-        def get_score(cat, item):
-            row = other_df[(other_df['Category'] == cat) & (other_df['Item'].str.contains(item, case=False, na=False))]
-            return row['Score'].values[0] if not row.empty else 0.0
-            
-        fmt = get_score('Overall', 'Formatting')
-        struc = get_score('Overall', 'Structure')
-        style = get_score('Overall', 'Style/Language')
+        if rubric is None:
+            rubric = resolve_rubric(other_df, scheme)
+        score = lambda key: rubric_score(rubric, key)
         
-        formalities_pct = (fmt / 2.0) * 0.3 + (struc / 2.0) * 0.5 + (style / 2.0) * 0.2
-        res['formalities_pct'] = formalities_pct
+        res['formalities_pct'] = scheme.formalities_pct(score)
         
         # --- 3. Solution Report (40%) ---
-        app_corr = get_score('Solution Report', 'Approach - Correctness')
-        app_conv = get_score('Solution Report', 'Approach - Convincingness')
-        app_ref = get_score('Solution Report', 'Approach - References')
-        
-        sit_corr = get_score('Solution Report', 'Context & Situationality - Correctness')
-        sit_conv = get_score('Solution Report', 'Context & Situationality - Convincingness')
-        sit_ref = get_score('Solution Report', 'Context & Situationality - References')
-        
-        imp_corr = get_score('Solution Report', 'Implications - Correctness')
-        imp_conv = get_score('Solution Report', 'Implications - Convincingness')
-        imp_ref = get_score('Solution Report', 'Implications - References')
-        
-        approach_pct = calculate_dim_percentage(app_corr, app_conv, app_ref)
-        sit_pct = calculate_dim_percentage(sit_corr, sit_conv, sit_ref)
-        imp_pct = calculate_dim_percentage(imp_corr, imp_conv, imp_ref)
-        
-        solution_report_pct = approach_pct * 0.5 + sit_pct * 0.25 + imp_pct * 0.25
-        res['solution_report_pct'] = solution_report_pct
+        dim_pcts = {dim_key: scheme.dimension_pct(dim_key, score) for dim_key in scheme.dimension_terms}
+        res['solution_report_pct'] = scheme.solution_report_pct(dim_pcts.__getitem__)
     else:
         # Fallback to tasks_df if other_df is missing (unlikely based on example but safe)
         if tasks_df is not None and not tasks_df.empty:
-            avg_app = tasks_df['approach_pct'].mean()
-            avg_sit = tasks_df['sit_pct'].mean()
-            avg_imp = tasks_df['imp_pct'].mean()
-            res['solution_report_pct'] = avg_app * 0.5 + avg_sit * 0.25 + avg_imp * 0.25
+            res['solution_report_pct'] = scheme.solution_report_pct(lambda dim_key: ordered_mean(tasks_df[f"{dim_key}_pct"]))
 
     # Compute Total Percentage
-    res['total_pct'] = res['formalities_pct'] * 0.20 + res['practical_tasks_pct'] * 0.40 + res['solution_report_pct'] * 0.40
-    res['german_grade'] = get_german_grade(res['total_pct'])
+    res['total_pct'] = scheme.total_pct(res['formalities_pct'], res['practical_tasks_pct'], res['solution_report_pct'])
+    res['german_grade'] = scheme.grade(res['total_pct'])
     
     return res
+
+# Score columns of *-tasks.csv used by calculate_grades_batch with the built-in scheme
+TASK_SCORE_COLUMNS = default_scheme().task_score_columns
+
+def calculate_grades_batch(all_other: Dict[str, Any], all_tasks: Dict[str, Any], scheme: Optional[GradingScheme] = None) -> pd.DataFrame:
+    """Computes the calculate_grades results for a whole cohort at once, identical to the last bit (benchmark only).
+
+    Returns one row per username found in either mapping (in first-seen order) with the
+    columns formalities_pct, practical_tasks_pct, solution_report_pct, total_pct and german_grade.
+    """
+    scheme = scheme or default_scheme()
+    usernames = pd.Index(list(dict.fromkeys([*all_other, *all_tasks])), name='Username')
+    res = pd.DataFrame(index=usernames)
+    
+    # --- 1. Practical Tasks (40%) ---
+    tasks_frames = {u: df for u, df in all_tasks.items() if df is not None and not df.empty}
+    has_tasks = usernames.isin(list(tasks_frames))
+    if tasks_frames:
+        tasks = stack_tasks(tasks_frames, scheme.task_score_columns)
+        task_pct = scheme.task_pct(tasks[scheme.practical_task['correct_column']], tasks[scheme.practical_task['details_column']])
+        by_student = ordered_group_means(pd.DataFrame({
+            'task_pct': task_pct,
+            **task_dimension_pcts(tasks, scheme),
+        }), tasks['Username']).reindex(usernames)
+    else:
+        by_student = pd.DataFrame(np.nan, index=usernames, columns=['task_pct', *(f"{dim_key}_pct" for dim_key in scheme.dimension_terms)])
+    res['practical_tasks_pct'] = by_student['task_pct'].where(has_tasks, 0.0)
+    
+    # --- 2./3. Formalities and Solution Report from one pivot of all *-other.csv rows ---
+    other_frames = {u: df for u, df in all_other.items() if df is not None and not df.empty}
+    has_other = usernames.isin(list(other_frames))
+    keys = scheme.rubric_keys
+    scores = pd.DataFrame(np.nan, index=usernames, columns=keys)
+    if other_frames:
+        other = stack_other(other_frames)
+        # Cohorts share a handful of distinct (Category, Item) pairs, so match each pair only once
+        pair_codes, pairs = pd.MultiIndex.from_arrays([other['Category'], other['Item']]).factorize()
+        pairs = pairs.to_frame(index=False, name=['Category', 'Item'])
+        pair_keys = np.array([scheme.match_item(cat, item) for cat, item in zip(pairs['Category'], pairs['Item'])], dtype=object)
+        other['key'] = pair_keys[pair_codes]
+        # Like get_score, the first matching row wins, even if its score is NaN
+        matched = other[other['key'].notna()].drop_duplicates(['Username', 'key'])
+        pivoted = matched.set_index(['Username', 'key'])['Score'].unstack().reindex(index=usernames, columns=keys)
+        present = matched.set_index(['Username', 'key'])['Category'].unstack().reindex(index=usernames, columns=keys).notna()
+        # Rubric items without a matching row count as 0, like the get_score default
+        scores = pivoted.where(present, 0.0)
+    
+    formalities_pct = scheme.formalities_pct(scores.__getitem__)
+    solution_report_pct = scheme.solution_report_pct(lambda dim_key: scheme.dimension_pct(dim_key, scores.__getitem__))
+    # Without *-other.csv data formalities are 0 and the Solution Report falls back to the task averages
+    tasks_sr_pct = scheme.solution_report_pct(lambda dim_key: by_student[f"{dim_key}_pct"])
+    res['formalities_pct'] = formalities_pct.where(has_other, 0.0)
+    res['solution_report_pct'] = solution_report_pct.where(has_other, tasks_sr_pct.where(has_tasks, 0.0))
+    
+    res['total_pct'] = scheme.total_pct(res['formalities_pct'], res['practical_tasks_pct'], res['solution_report_pct'])
+    res['german_grade'] = get_german_grades(res['total_pct'].to_numpy(), scheme)
+    
+    return res[['formalities_pct', 'practical_tasks_pct', 'solution_report_pct', 'total_pct', 'german_grade']]
@@ -1,371 +1,856 @@
+import math
+import multiprocessing
+import os
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+from pathlib import Path
 import pandas as pd
 import xlsxwriter
-from typing import Dict, Any, List
+from xlsxwriter.worksheet import Worksheet
+from xlsxwriter.utility import xl_cell_to_rowcol, xl_col_to_name, xl_rowcol_to_cell
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Set, Tuple
+from rubric import RubricScore, resolve_rubric
+from scheme import GradingScheme, default_scheme
+from instrumentation import emit, collect_events, replay
+from records import TaskRows
+from appendix import AppendixWriter, DEFAULT_CHUNK_CHARS, find_boilerplate
 
-def setup_grade_mapping_sheet(workbook, sheet_name='GradeMapping'):
+def setup_grade_mapping_sheet(workbook, sheet_name='GradeMapping', scheme: Optional[GradingScheme] = None):
     """Sets up a hidden sheet with the grading scale for VLOOKUP."""
+    scheme = scheme or default_scheme()
     mapping_sheet = workbook.add_worksheet(sheet_name)
-    scale = [
-        (0.00, "5.0"),
-        (0.50, "4.0"),
-        (0.55, "3.7"),
-        (0.60, "3.3"),
-        (0.65, "3.0"),
-        (0.70, "2.7"),
-        (0.75, "2.3"),
-        (0.80, "2.0"),
-        (0.85, "1.7"),
-        (0.90, "1.3"),
-        (0.95, "1.0")
-    ]
-    for row, (pct, grade) in enumerate(scale):
+    for row, (pct, grade) in enumerate(scheme.grade_scale):
         mapping_sheet.write_number(row, 0, pct)
         mapping_sheet.write_string(row, 1, grade)
     # mapping_sheet.hide() # Uncomment to hide this sheet in production
-    return f"'{sheet_name}'!$A$1:$B$11"
+    return scheme.mapping_range(sheet_name)
+
+MAPPING_RANGE = default_scheme().mapping_range()
+
+# How the sheets of a workbook are tied together:
+#   linked  the Master Overview refers to the totals of each individual sheet (the default)
+#   scores  a hidden 'Scores' sheet holds every student's scores in one row; the Master
+#           Overview computes the totals in-row and individual sheets look their values up
+LAYOUTS = ('linked', 'scores')
+SCORES_SHEET = 'Scores'
+# Hidden sheet of every workbook with the scores its sheets were written with (see GeneratedSheet)
+GENERATED_SHEET = 'Generated'
+MASTER_SHEET = 'Master Overview'
+# Columns of the section percentages, total and grade on the Master Overview
+MASTER_COLUMNS = {'formalities': 'D', 'practical_tasks': 'E', 'solution_report': 'F', 'total': 'G', 'grade': 'H'}
+
+def sheet_score(rubric: Dict[str, RubricScore], key: str):
+    """Returns the (score, notes) written for a rubric item; missing or non-numeric scores are written as 0."""
+    entry = rubric.get(key)
+    if entry is None:
+        return 0.0, ""
+    return (0.0 if math.isnan(entry.score) else entry.score), entry.notes
 
-def write_excel(output_path: str, students_df: pd.DataFrame, all_tasks: Dict[str, pd.DataFrame], all_other: Dict[str, pd.DataFrame], all_texts: Dict[str, str] = None):
-    """Generates the main Excel grading report using native Excel formulas with a polished layout."""
+def student_sheet_name(username: str) -> str:
+    """Returns the worksheet name of a student's individual sheet (Excel allows 31 characters)."""
+    return str(username)[:31]
+
+def sheet_task_scores(tasks_df, scheme: Optional[GradingScheme] = None) -> List[Tuple[str, float, float]]:
+    """Returns (task, correctness, detail) as written to the Practical Tasks rows; non-numeric scores become 0.
     
-    if all_texts is None:
-        all_texts = {}
+    tasks_df is the parsed *-tasks.csv as TaskRows or DataFrame; missing score columns read as 0.
+    """
+    if tasks_df is None or tasks_df.empty:
+        return []
+    scheme = scheme or default_scheme()
+    if not isinstance(tasks_df, TaskRows):
+        tasks_df = TaskRows.from_frame(tasks_df)
+    return [
+        (t_name, 0 if math.isnan(c_score) else c_score, 0 if math.isnan(d_score) else d_score)
+        for t_name, c_score, d_score in zip(tasks_df.task, tasks_df.column(scheme.practical_task['correct_column']), tasks_df.column(scheme.practical_task['details_column']))
+    ]
+
+def evaluate_student_sheet(record: Dict[str, Any], task_scores: Optional[List[Tuple[str, float, float]]] = None, scheme: Optional[GradingScheme] = None) -> Dict[str, Any]:
+    """Computes in Python what the formulas of a student's individual sheet evaluate to.
     
-    with xlsxwriter.Workbook(output_path) as workbook:
-        # Colors
-        COLOR_PRIMARY = '#4F81BD'
-        COLOR_SECONDARY = '#DCE6F1'
-        COLOR_TOTAL = '#B8CCE4'
-        COLOR_WHITE = '#FFFFFF'
-        
-        # Formats
-        header_format = workbook.add_format({'bold': True, 'bg_color': COLOR_PRIMARY, 'font_color': COLOR_WHITE, 'bottom': 1})
-        percent_format = workbook.add_format({'num_format': '0.00%'})
-        score_format = workbook.add_format({'num_format': '0.0', 'align': 'center'})
-        grade_format = workbook.add_format({'bold': True, 'align': 'center'})
+    Mirrors the sheet rather than calculate_grades: missing or non-numeric scores count as 0
+    and there is no fallback to the per-task Solution Report columns. Pass the
+    sheet_task_scores result as task_scores if it is already at hand.
+    """
+    scheme = scheme or default_scheme()
+    rubric = record.get('rubric') or {}
+    if task_scores is None:
+        task_scores = sheet_task_scores(record.get('tasks'), scheme)
+    score = lambda key: sheet_score(rubric, key)[0]
+    
+    formalities_pct = scheme.formalities_pct(score)
+    dim_pcts = {dim_key: scheme.dimension_pct(dim_key, score) for dim_key in scheme.dimension_terms}
+    solution_report_pct = scheme.solution_report_pct(dim_pcts.__getitem__)
+    task_pcts = [scheme.task_pct(c_score, d_score) for _, c_score, d_score in task_scores]
+    practical_tasks_pct = sum(task_pcts) / len(task_pcts) if task_pcts else 0.0
+    
+    total_pct = scheme.total_pct(formalities_pct, practical_tasks_pct, solution_report_pct)
+    return {
+        'dim_pcts': dim_pcts,
+        'task_pcts': task_pcts,
+        'formalities_pct': formalities_pct,
+        'practical_tasks_pct': practical_tasks_pct,
+        'solution_report_pct': solution_report_pct,
+        'total_pct': total_pct,
+        'german_grade': scheme.grade(total_pct)
+    }
+
+# The evaluate_student_sheet values shown on the Master Overview
+GRADE_VALUES = ('formalities_pct', 'practical_tasks_pct', 'solution_report_pct', 'total_pct', 'german_grade')
+
+def sheet_grades(students_df: pd.DataFrame, all_tasks: Dict[str, Any], all_other: Dict[str, Any], all_rubrics: Dict[str, Dict[str, RubricScore]] = None, scheme: Optional[GradingScheme] = None) -> pd.DataFrame:
+    """Returns the sub-totals, total and grade the workbook shows for every student in students_df.
+    
+    One row per roster row (indexed by Username) with the GRADE_VALUES of evaluate_student_sheet,
+    so the export, the run snapshot and --serve always agree with the workbook.
+    """
+    records = iter_student_records(students_df, all_tasks, all_other, None, all_rubrics, scheme)
+    rows = [itemgetter(*GRADE_VALUES)(evaluate_student_sheet(record, scheme=scheme)) for record in records]
+    return pd.DataFrame(rows, index=pd.Index(students_df['Username'].tolist(), name='Username'), columns=list(GRADE_VALUES))
+
+# A cell reference, optionally qualified with its sheet ('Master Overview'!G2, Scores!C2)
+CELL_REF = r"(?:(?:'[^']+'|\b\w+)!)?\b[A-Z]+\d+\b"
+
+def _expand_range(match) -> str:
+    """Lists the cells of a (sheet-qualified) A1:B2 range for the formula evaluator."""
+    sheet, first, last = match.group(1) or '', match.group(2), match.group(3)
+    first_row, first_col = xl_cell_to_rowcol(first)
+    last_row, last_col = xl_cell_to_rowcol(last)
+    return "[" + ",".join(sheet + xl_rowcol_to_cell(row, col) for row in range(first_row, last_row + 1) for col in range(first_col, last_col + 1)) + "]"
+
+def evaluate_formula(formula: str, cells: Dict[str, Any], scheme: Optional[GradingScheme] = None):
+    """Evaluates a formula written by write_student_sheet against the values of its cells.
+    
+    Supports exactly the constructs used on individual sheets and the Master Overview: cell
+    references (sheet-qualified ones are looked up under their qualified name), arithmetic,
+    SUM, AVERAGE over a range, INDEX into a single column and the VLOOKUP into the grade mapping.
+    """
+    expr = formula.lstrip('=')
+    expr = re.sub(r"VLOOKUP\(([A-Z]+\d+),.*\)", r"_grade(\1)", expr)
+    expr = re.sub(r"INDEX\(((?:'[^']+'|\w+)!)([A-Z]+):[A-Z]+,(\d+)\)", r"\1\2\3", expr)
+    expr = re.sub(r"AVERAGE\(((?:'[^']+'|\w+)!)?([A-Z]+\d+):([A-Z]+\d+)\)", lambda m: "_average(" + _expand_range(m) + ")", expr)
+    expr = expr.replace("SUM(", "_sum(")
+    expr = re.sub(CELL_REF, lambda m: repr(cells.get(m.group(0), 0.0)), expr)
+    namespace = {'_sum': lambda *args: sum(args), '_average': lambda args: sum(args) / len(args), '_grade': (scheme or default_scheme()).grade}
+    return eval(expr, {'__builtins__': {}}, namespace)
+
+def verify_sheet_formulas(sheet_name: str, cells: Dict[str, Any], formulas: List[Tuple[str, str, Any]], scheme: Optional[GradingScheme] = None) -> List[str]:
+    """Re-evaluates every (cell, formula, cached value) of a sheet and describes each disagreement."""
+    mismatches = []
+    for cell, formula, cached in formulas:
+        result = evaluate_formula(formula, cells, scheme)
+        if isinstance(cached, str) or isinstance(result, str):
+            agrees = str(result) == str(cached)
+        else:
+            agrees = math.isclose(result, cached, rel_tol=1e-9, abs_tol=1e-12)
+        if not agrees:
+            mismatches.append(f"'{sheet_name}'!{cell}: {formula} evaluates to {result!r}, cached value is {cached!r}")
+    return mismatches
+
+def merge_rows_in_order(sheet, first_row: int, last_row: int, col: int, data: str, cell_format):
+    """Merges a vertical range of one column before the rows below first_row are written.
+    
+    merge_range pads the whole range with blank cells, which in constant_memory mode flushes
+    first_row before the rest of it is written. There only the merge is registered and the
+    top-left cell written; the padding cells carry no visible formatting.
+    """
+    if not sheet.constant_memory:
+        sheet.merge_range(first_row, col, last_row, col, data, cell_format)
+        return
+    sheet.merge.append([first_row, col, last_row, col])
+    sheet.write(first_row, col, data, cell_format)
+
+def merge_row(sheet, row: int, first_col: int, last_col: int, data: str, cell_format):
+    """Merges first_col..last_col of a single row."""
+    sheet.merge_range(row, first_col, row, last_col, data, cell_format)
+
+def build_sheet_plan(formats: Dict[str, Any], task_count: int, scheme: Optional[GradingScheme] = None, layout: str = 'linked') -> Dict[str, Any]:
+    """Precomputes the layout of an individual sheet with task_count practical tasks.
+    
+    Everything that does not depend on the student (labels, section headers, merges,
+    formatted filler cells, column widths and formula text) is laid out once; the plan
+    then only leaves slots for the student's values. Its 'ops' are in row order:
+    
+    - ('static', func, args): call func(sheet, *args)
+    - ('title', row): the report title
+    - ('score', row, key): rubric score in C and notes in H
+    - ('task', row, index): name, correctness and detail score of a practical task
+    - ('formula', row, col, cell, formula, format, value): value maps the
+      evaluate_student_sheet result to the cached result of the formula
+    - ('lookup', row, col, cell, master column, format, value): with the 'scores' layout,
+      an INDEX into the student's Master Overview row (total and grade)
+    
+    'cells' holds the constant numbers the formulas refer to, 'refs' the cells of the
+    sub-totals, total and grade, and 'cell_writes' / 'formula_count' what one sheet writes.
+    Labels, maxima and formulas come from the scheme's compiled terms. With the 'scores'
+    layout, the total and grade are looked up in the Master Overview instead of computed.
+    """
+    scheme = scheme or default_scheme()
+    weights = scheme.section_weights
+    ops = []
+    cells = {}
+    
+    def static(func, *args):
+        ops.append(('static', func, args))
+    
+    def number(row, col, value, cell_format):
+        static(Worksheet.write_number, row, col, value, cell_format)
+        cells[xl_rowcol_to_cell(row, col)] = value
+    
+    def formula(row, col, text, cell_format, value):
+        ops.append(('formula', row, col, xl_rowcol_to_cell(row, col), text, cell_format, value))
+    
+    def header_row(row, labels, centered, merge_first=False):
+        # Filler cells of header and total rows are written only for their background and borders
+        for col, label in enumerate(labels):
+            cell_format = formats['col_header_center'] if col in centered else formats['col_header']
+            if merge_first and col == 0:
+                static(merge_row, row, 0, 1, label, cell_format)
+            elif merge_first and col == 1:
+                continue
+            elif label is None:
+                static(Worksheet.write_blank, row, col, None, cell_format)
+            else:
+                static(Worksheet.write_string, row, col, label, cell_format)
+    
+    def total_row(row, label, text, cell_format, value, label_format=None, lookup=None):
+        static(merge_row, row, 0, 3, label, label_format or formats['total'])
+        if lookup is not None and layout == 'scores':
+            ops.append(('lookup', row, 4, xl_rowcol_to_cell(row, 4), lookup, cell_format, value))
+        else:
+            formula(row, 4, text, cell_format, value)
+        if label_format is None:
+            for col in (5, 6, 7):
+                static(Worksheet.write_blank, row, col, None, formats['total'])
+    
+    # Layout Mapping:
+    # A: Category / Task (width 25)
+    # B: Item (width 30 for text)
+    # C: Score 1 (width 12)
+    # D: Max 1 (width 12)
+    # E: Score 2 (width 12)
+    # F: Max 2 (width 12)
+    # G: Empty Spacer (width 2)
+    # H: Notes (width 50)
+    # I: Hidden column for Task %
+    static(Worksheet.set_column, 'A:A', 25)
+    static(Worksheet.set_column, 'B:B', 30)
+    static(Worksheet.set_column, 'C:F', 12)
+    static(Worksheet.set_column, 'G:G', 2)
+    static(Worksheet.set_column, 'H:H', 50, formats['text_wrap'])
+    static(Worksheet.set_column, 'I:I', None, None, {'hidden': True})
+    
+    row = 0
+    ops.append(('title', row))
+    # Back link to Master View, off to the right (Column J)
+    static(Worksheet.write_url, row, 9, "internal:'Master Overview'!A1", None, "Back to Master View")
+    row += 2
+    
+    refs = {}
+    
+    # -------------------------------------------------------------
+    # 1. Overall Formalities
+    # -------------------------------------------------------------
+    static(merge_row, row, 0, 7, f"1. Overall Formalities ({weights['formalities']*100:.0f}%)", formats['section'])
+    row += 1
+    header_row(row, ["Category", None, "Score", "Max", None, None, None, "Notes"], (2, 3), merge_first=True)
+    row += 1
+    
+    # (score, max) cells of every rubric item
+    item_cells = {}
+    for entry in scheme.formalities:
+        static(merge_row, row, 0, 1, f"{entry['label']} (w: {entry['weight']*100:.0f}%)", formats['cell_left_vcenter'])
+        ops.append(('score', row, entry['key']))
+        number(row, 3, entry['max'], formats['score'])
+        item_cells[entry['key']] = (f"C{row+1}", f"D{row+1}")
+        row += 1
+    
+    total_row(row, "Formalities Sub-Total %", "=" + scheme.ratio_sum_formula(scheme.formalities_terms, item_cells.__getitem__), formats['total_pct'], itemgetter('formalities_pct'))
+    refs['formalities'] = f"E{row+1}"
+    row += 2
+    
+    # -------------------------------------------------------------
+    # 2. Solution Report
+    # -------------------------------------------------------------
+    static(merge_row, row, 0, 7, f"2. Solution Report ({weights['solution_report']*100:.0f}%)", formats['section'])
+    row += 1
+    header_row(row, ["Dimension", "Item", "Score", "Max", None, None, None, "Notes"], (2, 3))
+    row += 1
+    
+    dim_cells = {}
+    for sr in scheme.solution_report:
+        static(merge_rows_in_order, row, row + len(sr['sub']) - 1, 0, f"{sr['label']}\n(w: {sr['weight']*100:.0f}%)", formats['merge'])
+        for entry in sr['sub']:
+            static(Worksheet.write_string, row, 1, f"{entry['label']} (w: {entry['weight']*100:.0f}%)", formats['cell_left_vcenter'])
+            ops.append(('score', row, entry['key']))
+            number(row, 3, entry['max'], formats['score'])
+            item_cells[entry['key']] = (f"C{row+1}", f"D{row+1}")
+            row += 1
+        total_row(row, f"{sr['dim']} Sub-Total", "=" + scheme.ratio_sum_formula(scheme.dimension_terms[sr['key']], item_cells.__getitem__), formats['total_pct'], lambda values, key=sr['key']: values['dim_pcts'][key])
+        dim_cells[sr['key']] = f"E{row+1}"
+        row += 1
+    
+    total_row(row, "Solution Report Final Sub-Total %", "=" + scheme.weighted_sum_formula(scheme.dimension_weights, dim_cells.__getitem__), formats['total_pct'], itemgetter('solution_report_pct'))
+    refs['solution_report'] = f"E{row+1}"
+    row += 2
+    
+    # -------------------------------------------------------------
+    # 3. Practical Tasks
+    # -------------------------------------------------------------
+    static(merge_row, row, 0, 7, f"3. Practical Tasks ({weights['practical_tasks']*100:.0f}%)", formats['section'])
+    row += 1
+    header_row(row, ["Task", None, "Corr. Score", "Corr. Max", "Det. Score", "Det. Max", None, "Notes"], (2, 3, 4, 5), merge_first=True)
+    row += 1
+    
+    if task_count:
+        first_task_row = row
+        for index in range(task_count):
+            ops.append(('task', row, index))
+            number(row, 3, scheme.practical_task['correct_max'], formats['score'])
+            number(row, 5, scheme.practical_task['details_max'], formats['score'])
+            task_cells = {scheme.practical_task['correct_column']: (f"C{row+1}", f"D{row+1}"), scheme.practical_task['details_column']: (f"E{row+1}", f"F{row+1}")}
+            task_formula = "=" + scheme.task_formula(task_cells.__getitem__)
+            formula(row, 8, task_formula, None, lambda values, index=index: values['task_pcts'][index]) # Column I (hidden)
+            row += 1
+        tasks_formula = f"=AVERAGE(I{first_task_row+1}:I{row})"
+    else:
+        tasks_formula = "=0"
+        static(merge_row, row, 0, 7, "No tasks data.", formats['cell_left_vcenter'])
+        row += 1
+    
+    total_row(row, "Practical Tasks Average %", tasks_formula, formats['total_pct'], itemgetter('practical_tasks_pct'))
+    refs['practical_tasks'] = f"E{row+1}"
+    row += 3
+    
+    # -------------------------------------------------------------
+    # Final Section
+    # -------------------------------------------------------------
+    static(merge_row, row, 0, 7, "--- FINAL AGGREGATION ---", formats['section'])
+    row += 1
+    
+    for label, section in (("Overall Formalities", 'formalities'), ("Solution Report", 'solution_report'), ("Practical Tasks", 'practical_tasks')):
+        total_row(row, f"{label} ({weights[section]*100:.0f}%)", f"={refs[section]}", formats['percent'], itemgetter(f"{section}_pct"), formats['cell_left_vcenter'])
+        row += 1
+    
+    # Compute Total Percentage on the individual sheet
+    total_formula = "=" + scheme.total_formula(refs.__getitem__)
+    total_row(row, "Total Final Percentage", total_formula, formats['total_pct'], itemgetter('total_pct'), lookup=MASTER_COLUMNS['total'])
+    refs['total'] = f"E{row+1}"
+    row += 1
+    
+    # Compute Final Grade on the individual sheet using VLOOKUP
+    total_row(row, "Total Final German Grade", f"=VLOOKUP({refs['total']}, {scheme.mapping_range()}, 2, TRUE)", formats['final_grade'], itemgetter('german_grade'), lookup=MASTER_COLUMNS['grade'])
+    refs['grade'] = f"E{row+1}"
+    
+    # Cell writes per op kind: a score fills C and H, a task A (merged), C and E
+    writes_per_op = {'title': 1, 'score': 2, 'task': 3, 'formula': 1}
+    cell_writes = sum(writes_per_op.get(op[0], 1) for op in ops if op[1] is not Worksheet.set_column)
+    formula_count = sum(1 for op in ops if op[0] in ('formula', 'lookup'))
+    return {'ops': ops, 'cells': cells, 'refs': refs, 'appendix_row': row + 3, 'cell_writes': cell_writes, 'formula_count': formula_count}
+
+def score_cells(task_count: int, scheme: Optional[GradingScheme] = None) -> Dict[str, Any]:
+    """Returns where an individual sheet with task_count tasks holds its scores (0-based rows).
+    
+    'items' lists (row, rubric key) with the score in column C, 'tasks' lists (row, task
+    index) with the task name in A and the correctness and detail scores in C and E, and
+    'last_row' is the last row of the graded part (the appendix follows below it). Taken
+    from the build_sheet_plan, so readers of a workbook always agree with its writer.
+    """
+    # Only the positions are needed, so the plan is built without cell formats
+    plan = build_sheet_plan(defaultdict(lambda: None), task_count, scheme)
+    return {
+        'items': [(op[1], op[2]) for op in plan['ops'] if op[0] == 'score'],
+        'tasks': [(op[1], op[2]) for op in plan['ops'] if op[0] == 'task'],
+        'last_row': plan['appendix_row'] - 3
+    }
+
+def scores_columns(task_slots: int, scheme: Optional[GradingScheme] = None) -> Dict[str, Any]:
+    """Returns the column letters of the Scores sheet (see ScoresSheet) for task_slots tasks."""
+    scheme = scheme or default_scheme()
+    first = 1 + len(scheme.rubric_keys)
+    return {
+        'items': {key: xl_col_to_name(1 + index) for index, key in enumerate(scheme.rubric_keys)},
+        'correct': [xl_col_to_name(first + slot) for slot in range(task_slots)],
+        'details': [xl_col_to_name(first + task_slots + slot) for slot in range(task_slots)],
+        'pct': [xl_col_to_name(first + 2 * task_slots + slot) for slot in range(task_slots)]
+    }
+
+class ScoresSheet:
+    """The hidden, columnar Scores sheet of the 'scores' layout.
+    
+    Row n holds the student of Master Overview row n: the username, one column per rubric
+    item, then task_slots columns each with the correctness scores, the detail scores and
+    the percentages of the practical tasks. The Master Overview computes every percentage
+    in-row from it, and individual sheets read their scores and final results with INDEX,
+    so no formula refers to another student's sheet and recalculation scales with rows.
+    """
+    
+    def __init__(self, workbook, formats: Dict[str, Any], task_slots: int, scheme: Optional[GradingScheme] = None):
+        self.scheme = scheme or default_scheme()
+        self.task_slots = task_slots
+        self.item_max = {entry['key']: entry['max'] for entry in self.scheme.rubric_items}
+        columns = scores_columns(task_slots, self.scheme)
+        self.item_columns = columns['items']
+        self.correct_columns = columns['correct']
+        self.details_columns = columns['details']
+        self.pct_columns = columns['pct']
         
-        text_wrap_format = workbook.add_format({'text_wrap': True, 'valign': 'vcenter'})
-        title_format = workbook.add_format({'bold': True, 'font_size': 16, 'bottom': 2})
+        self.sheet = workbook.add_worksheet(SCORES_SHEET)
+        self.sheet.hide()
+        headers = ['Username'] + [entry['label'] for entry in self.scheme.formalities] + [f"{dim['dim']} - {sub['label']}" for dim in self.scheme.solution_report for sub in dim['sub']]
+        for kind in ('Corr.', 'Det.', '%'):
+            headers += [f"Task {slot + 1} {kind}" for slot in range(task_slots)]
+        for col, header in enumerate(headers):
+            self.sheet.write_string(0, col, header, formats['header'])
+    
+    def lookup(self, column: str, row: int) -> str:
+        """INDEX formula of a Scores cell, for the student in (1-based) row."""
+        return f"=INDEX({SCORES_SHEET}!{column}:{column},{row})"
+    
+    def write_row(self, master_row: int, username: str, rubric: Dict[str, RubricScore], task_scores: List[Tuple[str, float, float]], values: Dict[str, Any]) -> Tuple[Dict[str, str], Dict[str, Any], List[Tuple[str, str, Any]]]:
+        """Writes a student's Scores row.
         
-        section_format = workbook.add_format({'bold': True, 'bg_color': COLOR_PRIMARY, 'font_color': COLOR_WHITE, 'font_size': 12, 'valign': 'vcenter'})
-        col_header_format = workbook.add_format({'bold': True, 'bg_color': COLOR_SECONDARY, 'bottom': 1, 'valign': 'vcenter'})
-        col_header_center_format = workbook.add_format({'bold': True, 'bg_color': COLOR_SECONDARY, 'bottom': 1, 'align': 'center', 'valign': 'vcenter'})
+        Returns the Master Overview formula per MASTER_COLUMNS entry, the values of the row's
+        cells under their qualified names and the (cell, formula, cached value) of the task
+        percentages, for verify_sheet_formulas.
+        """
+        scheme = self.scheme
+        row = master_row + 1
+        cells = {}
+        formulas = []
+        self.sheet.write_string(master_row, 0, username)
+        for key, column in self.item_columns.items():
+            score = sheet_score(rubric, key)[0]
+            self.sheet.write_number(f"{column}{row}", score)
+            cells[f"{SCORES_SHEET}!{column}{row}"] = score
+        for slot, (_, c_score, d_score) in enumerate(task_scores):
+            correct, details, pct = self.correct_columns[slot], self.details_columns[slot], self.pct_columns[slot]
+            self.sheet.write_number(f"{correct}{row}", c_score)
+            self.sheet.write_number(f"{details}{row}", d_score)
+            task_cells = {scheme.practical_task['correct_column']: (f"{correct}{row}", repr(scheme.practical_task['correct_max'])), scheme.practical_task['details_column']: (f"{details}{row}", repr(scheme.practical_task['details_max']))}
+            task_formula = "=" + scheme.task_formula(task_cells.__getitem__)
+            self.sheet.write_formula(f"{pct}{row}", task_formula, None, values['task_pcts'][slot])
+            formulas.append((f"{pct}{row}", task_formula, values['task_pcts'][slot]))
+            cells[f"{SCORES_SHEET}!{correct}{row}"] = c_score
+            cells[f"{SCORES_SHEET}!{details}{row}"] = d_score
+            cells[f"{SCORES_SHEET}!{pct}{row}"] = values['task_pcts'][slot]
         
-        total_format = workbook.add_format({'bold': True, 'bg_color': COLOR_TOTAL, 'top': 1, 'bottom': 1, 'valign': 'vcenter'})
-        total_pct_format = workbook.add_format({'bold': True, 'bg_color': COLOR_TOTAL, 'top': 1, 'bottom': 1, 'num_format': '0.00%', 'align': 'center', 'valign': 'vcenter'})
-        final_grade_format = workbook.add_format({'bold': True, 'bg_color': COLOR_TOTAL, 'top': 1, 'bottom': 1, 'align': 'center', 'valign': 'vcenter'})
+        item_cells = lambda key: (f"{SCORES_SHEET}!{self.item_columns[key]}{row}", repr(self.item_max[key]))
+        if task_scores:
+            tasks_formula = f"=AVERAGE({SCORES_SHEET}!{self.pct_columns[0]}{row}:{self.pct_columns[len(task_scores) - 1]}{row})"
+        else:
+            tasks_formula = "=0"
+        master_formulas = {
+            'formalities': "=" + scheme.ratio_sum_formula(scheme.formalities_terms, item_cells),
+            'practical_tasks': tasks_formula,
+            'solution_report': "=" + scheme.weighted_sum_formula(scheme.dimension_weights, lambda dim_key: scheme.ratio_sum_formula(scheme.dimension_terms[dim_key], item_cells)),
+            'total': "=" + scheme.total_formula(lambda section: f"{MASTER_COLUMNS[section]}{row}"),
+            'grade': f"=VLOOKUP({MASTER_COLUMNS['total']}{row}, {scheme.mapping_range()}, 2, TRUE)",
+        }
+        return master_formulas, cells, formulas
+
+class GeneratedSheet:
+    """The hidden Generated sheet: the scores each student's sheet was written with.
+    
+    Row n holds the student of Master Overview row n: the username, one column per rubric
+    item (headed by its key), then the correctness and detail score of each practical task
+    in turn. No formula refers to it. When a graded workbook is imported (see overrides),
+    its cells are compared against these values rather than the current grading files, so
+    only the scores graders changed are taken over and later corrections to the files stay.
+    """
+    
+    def __init__(self, workbook, formats: Dict[str, Any], scheme: Optional[GradingScheme] = None):
+        self.scheme = scheme or default_scheme()
+        self.sheet = workbook.add_worksheet(GENERATED_SHEET)
+        self.sheet.hide()
+        for col, header in enumerate(['Username'] + list(self.scheme.rubric_keys) + ['Tasks']):
+            self.sheet.write_string(0, col, header, formats['header'])
+    
+    def write_row(self, master_row: int, username: str, rubric: Dict[str, RubricScore], task_scores: List[Tuple[str, float, float]]) -> int:
+        """Writes a student's Generated row and returns the number of cells written."""
+        self.sheet.write_string(master_row, 0, username)
+        col = 1
+        for key in self.scheme.rubric_keys:
+            self.sheet.write_number(master_row, col, sheet_score(rubric, key)[0])
+            col += 1
+        for _, c_score, d_score in task_scores:
+            self.sheet.write_number(master_row, col, c_score)
+            self.sheet.write_number(master_row, col + 1, d_score)
+            col += 2
+        return col
+
+def write_student_sheet(workbook, formats: Dict[str, Any], master_sheet, master_row: int, record: Dict[str, Any], verify: bool = False, plans: Optional[Dict[int, Dict[str, Any]]] = None, scheme: Optional[GradingScheme] = None, appendix: Optional[AppendixWriter] = None, scores: Optional[ScoresSheet] = None, generated: Optional[GeneratedSheet] = None) -> Dict[str, Any]:
+    """Writes one student's individual sheet and links it from the given Master Overview row.
+    
+    record holds 'username', 'first_name', 'last_name' and the optional parsed 'tasks',
+    resolved 'rubric' and raw 'text' (string or TextFile) of the student. The sheet is stamped from the
+    build_sheet_plan for the student's number of tasks; pass the same plans dict (and scheme)
+    for all sheets of a workbook so each layout is built once. Rows are written strictly top to
+    bottom, so the sheet can be written in constant_memory mode. Every formula carries its
+    evaluate_student_sheet result as cached value, so readers that do not recalculate
+    still see the right numbers. The raw text is written below the sheet by appendix (one
+    cell per line if None). With scores (the 'scores' layout, whose plans must be built for
+    it), the student's scores go to the Scores sheet and the sheet looks them up. With
+    generated, the scores are also recorded in the Generated sheet.
+    Returns the cell references of the student's sub-totals, total and grade, and with
+    verify the verify_sheet_formulas mismatches under 'mismatches' and the values written
+    under 'values'. Emits a 'sheet_written'
+    event with the time taken and the cells and formulas written.
+    """
+    start = time.perf_counter()
+    username = record['username']
+    fname = record['first_name']
+    lname = record['last_name']
+    
+    sheet_name = student_sheet_name(username)
+    ind_sheet = workbook.add_worksheet(sheet_name)
+    
+    master_sheet.write(master_row, 0, username)
+    master_sheet.write(master_row, 1, fname)
+    master_sheet.write(master_row, 2, lname)
+    
+    rubric = record.get('rubric') or {}
+    task_scores = sheet_task_scores(record.get('tasks'), scheme)
+    values = evaluate_student_sheet(record, task_scores, scheme)
+    
+    if plans is None:
+        plans = {}
+    plan = plans.get(len(task_scores))
+    if plan is None:
+        plan = plans[len(task_scores)] = build_sheet_plan(formats, len(task_scores), scheme, 'linked' if scores is None else 'scores')
+    
+    # Numbers and formulas written to the sheet, kept for verify_sheet_formulas
+    cells = dict(plan['cells']) if verify else None
+    formulas = []
+    lookups = 0
+    generated_writes = generated.write_row(master_row, username, rubric, task_scores) if generated is not None else 0
+    
+    if scores is not None:
+        master_formulas, scores_cells, scores_formulas = scores.write_row(master_row, username, rubric, task_scores, values)
+        master_cells = {f"{column}{master_row + 1}": values[f"{section}_pct"] for section, column in MASTER_COLUMNS.items() if section != 'grade'}
+        if verify:
+            cells.update(scores_cells)
+            cells.update({f"'{MASTER_SHEET}'!{cell}": value for cell, value in master_cells.items()})
+            cells[f"'{MASTER_SHEET}'!{MASTER_COLUMNS['grade']}{master_row + 1}"] = values['german_grade']
+    
+    for op in plan['ops']:
+        kind = op[0]
+        if kind == 'static':
+            op[1](ind_sheet, *op[2])
+        elif kind == 'score':
+            _, row, key = op
+            score, notes = sheet_score(rubric, key)
+            if scores is None:
+                ind_sheet.write_number(row, 2, score, formats['score'])
+            else:
+                formula = scores.lookup(scores.item_columns[key], master_row + 1)
+                ind_sheet.write_formula(row, 2, formula, formats['score'], score)
+                formulas.append((f"C{row+1}", formula, score))
+                lookups += 1
+            ind_sheet.write_string(row, 7, notes)
+            if verify:
+                cells[f"C{row+1}"] = score
+        elif kind == 'task':
+            _, row, index = op
+            t_name, c_score, d_score = task_scores[index]
+            merge_row(ind_sheet, row, 0, 1, t_name, formats['cell_left_vcenter'])
+            if scores is None:
+                ind_sheet.write_number(row, 2, c_score, formats['score'])
+                ind_sheet.write_number(row, 4, d_score, formats['score'])
+            else:
+                for col, column, score in ((2, scores.correct_columns[index], c_score), (4, scores.details_columns[index], d_score)):
+                    formula = scores.lookup(column, master_row + 1)
+                    ind_sheet.write_formula(row, col, formula, formats['score'], score)
+                    formulas.append((xl_rowcol_to_cell(row, col), formula, score))
+                lookups += 2
+            if verify:
+                cells[f"C{row+1}"] = c_score
+                cells[f"E{row+1}"] = d_score
+        elif kind == 'formula':
+            _, row, col, cell, formula, cell_format, value = op
+            value = value(values)
+            ind_sheet.write_formula(row, col, formula, cell_format, value)
+            if verify:
+                cells[cell] = value
+                formulas.append((cell, formula, value))
+        elif kind == 'lookup':
+            _, row, col, cell, column, cell_format, value = op
+            value = value(values)
+            formula = f"=INDEX('{MASTER_SHEET}'!{column}:{column},{master_row + 1})"
+            ind_sheet.write_formula(row, col, formula, cell_format, value)
+            if verify:
+                cells[cell] = value
+                formulas.append((cell, formula, value))
+        elif kind == 'title':
+            merge_row(ind_sheet, op[1], 0, 7, f"Grading Report: {fname} {lname} ({username})", formats['title'])
+    
+    refs = {name: f"'{sheet_name}'!{cell}" for name, cell in plan['refs'].items()}
+    
+    # Link Master Overview to Individual Sheet, or compute its row from the Scores sheet
+    if scores is None:
+        master_formulas = {section: "=" + refs[section] for section in MASTER_COLUMNS}
+    for section, column in MASTER_COLUMNS.items():
+        value = values['german_grade'] if section == 'grade' else values[f"{section}_pct"]
+        master_sheet.write_formula(f"{column}{master_row + 1}", master_formulas[section], formats['grade'] if section == 'grade' else formats['percent'], value)
+    master_sheet.write_url(master_row, 8, f"internal:'{sheet_name}'!A1", string="View Sheet")
+    
+    # -------------------------------------------------------------
+    # Appendix: Raw Evaluation Text
+    # -------------------------------------------------------------
+    raw_text = record.get('text')
+    appendix_rows = 0
+    if raw_text is not None:
+        row = plan['appendix_row']
+        merge_row(ind_sheet, row, 0, 7, "--- APPENDIX: Raw Evaluation Text ---", formats['section'])
+        row += 1
         
-        cell_left_vcenter = workbook.add_format({'valign': 'vcenter'})
-        cell_center_vcenter = workbook.add_format({'align': 'center', 'valign': 'vcenter'})
-        merge_format = workbook.add_format({'valign': 'vcenter', 'align': 'center', 'text_wrap': True, 'bold': True})
+        appendix = appendix or AppendixWriter()
+        appendix_rows = 1 + appendix.write(ind_sheet, row, username, raw_text, formats)
+    
+    if verify:
+        refs['values'] = {name: values[name] for name in GRADE_VALUES}
+        refs['mismatches'] = verify_sheet_formulas(sheet_name, cells, formulas, scheme)
+        if scores is not None:
+            refs['mismatches'] += verify_sheet_formulas(SCORES_SHEET, {cell.split('!')[1]: value for cell, value in scores_cells.items()}, scores_formulas, scheme)
+            master_checks = [(f"{column}{master_row + 1}", master_formulas[section], values['german_grade'] if section == 'grade' else values[f"{section}_pct"]) for section, column in MASTER_COLUMNS.items()]
+            refs['mismatches'] += verify_sheet_formulas(MASTER_SHEET, {**scores_cells, **master_cells}, master_checks, scheme)
+    # The master row adds 3 names, 5 formulas and the link; a Scores row its cells and task formulas
+    scores_writes = 1 + len(scores.item_columns) + 3 * len(task_scores) if scores is not None else 0
+    emit('sheet_written', username=username, seconds=time.perf_counter() - start,
+         cells=plan['cell_writes'] + appendix_rows + 9 + scores_writes + generated_writes, formulas=plan['formula_count'] + 5 + lookups + (len(task_scores) if scores is not None else 0))
+    return refs
+
+def create_formats(workbook) -> Dict[str, Any]:
+    """Registers the cell formats shared by all sheets of the workbook."""
+    # Colors
+    COLOR_PRIMARY = '#4F81BD'
+    COLOR_SECONDARY = '#DCE6F1'
+    COLOR_TOTAL = '#B8CCE4'
+    COLOR_WHITE = '#FFFFFF'
+    
+    return {
+        'header': workbook.add_format({'bold': True, 'bg_color': COLOR_PRIMARY, 'font_color': COLOR_WHITE, 'bottom': 1}),
+        'percent': workbook.add_format({'num_format': '0.00%'}),
+        'score': workbook.add_format({'num_format': '0.0', 'align': 'center'}),
+        'grade': workbook.add_format({'bold': True, 'align': 'center'}),
         
-        mapping_range = "'GradeMapping'!$A$1:$B$11"
+        'text_wrap': workbook.add_format({'text_wrap': True, 'valign': 'vcenter'}),
+        'title': workbook.add_format({'bold': True, 'font_size': 16, 'bottom': 2}),
         
-        # --- Master Overview Sheet ---
-        master_sheet = workbook.add_worksheet('Master Overview')
-        master_sheet.set_column('A:A', 15)
-        master_sheet.set_column('B:C', 20)
-        master_sheet.set_column('D:G', 18, percent_format)
-        master_sheet.set_column('H:H', 15, grade_format)
-        master_sheet.set_column('I:I', 15)
+        'section': workbook.add_format({'bold': True, 'bg_color': COLOR_PRIMARY, 'font_color': COLOR_WHITE, 'font_size': 12, 'valign': 'vcenter'}),
+        'col_header': workbook.add_format({'bold': True, 'bg_color': COLOR_SECONDARY, 'bottom': 1, 'valign': 'vcenter'}),
+        'col_header_center': workbook.add_format({'bold': True, 'bg_color': COLOR_SECONDARY, 'bottom': 1, 'align': 'center', 'valign': 'vcenter'}),
         
-        headers = ['Username', 'First Name', 'Last Name', 'Formalities', 'Practical Tasks', 'Solution Report', 'Total Percentage', 'German Grade', 'Link']
-        for col_num, h in enumerate(headers):
-            master_sheet.write(0, col_num, h, header_format)
-            
-        master_row = 1
+        'total': workbook.add_format({'bold': True, 'bg_color': COLOR_TOTAL, 'top': 1, 'bottom': 1, 'valign': 'vcenter'}),
+        'total_pct': workbook.add_format({'bold': True, 'bg_color': COLOR_TOTAL, 'top': 1, 'bottom': 1, 'num_format': '0.00%', 'align': 'center', 'valign': 'vcenter'}),
+        'final_grade': workbook.add_format({'bold': True, 'bg_color': COLOR_TOTAL, 'top': 1, 'bottom': 1, 'align': 'center', 'valign': 'vcenter'}),
         
-        for index, row_data in students_df.iterrows():
-            username = row_data['Username']
-            fname = row_data['First name']
-            lname = row_data['Last name']
-            
-            sheet_name = str(username)[:31]
-            ind_sheet = workbook.add_worksheet(sheet_name)
-            
-            master_sheet.write(master_row, 0, username)
-            master_sheet.write(master_row, 1, fname)
-            master_sheet.write(master_row, 2, lname)
-            
-            tasks_df = all_tasks.get(username)
-            other_df = all_other.get(username)
-            
-            # Layout Mapping:
-            # A: Category / Task (width 25)
-            # B: Item (width 30 for text)
-            # C: Score 1 (width 12)
-            # D: Max 1 (width 12)
-            # E: Score 2 (width 12)
-            # F: Max 2 (width 12)
-            # G: Empty Spacer (width 2)
-            # H: Notes (width 50)
-            # I: Hidden column for Task %
-            ind_sheet.set_column('A:A', 25)
-            ind_sheet.set_column('B:B', 30)
-            ind_sheet.set_column('C:F', 12)
-            ind_sheet.set_column('G:G', 2)
-            ind_sheet.set_column('H:H', 50, text_wrap_format)
-            ind_sheet.set_column('I:I', None, None, {'hidden': True})
-            
-            row = 0
-            ind_sheet.merge_range(row, 0, row, 7, f"Grading Report: {fname} {lname} ({username})", title_format)
-            
-            # Back link to Master View, off to the right (Column J)
-            ind_sheet.write_url(row, 9, "internal:'Master Overview'!A1", string="Back to Master View")
-            row += 2
-            
-            pct_cells = {}
-            
-            # -------------------------------------------------------------
-            # 1. Overall Formalities
-            # -------------------------------------------------------------
-            ind_sheet.merge_range(row, 0, row, 7, "1. Overall Formalities (20%)", section_format)
-            row += 1
-            
-            ind_sheet.merge_range(row, 0, row, 1, "Category", col_header_format)
-            ind_sheet.write(row, 2, "Score", col_header_center_format)
-            ind_sheet.write(row, 3, "Max", col_header_center_format)
-            ind_sheet.write(row, 4, "", col_header_format)
-            ind_sheet.write(row, 5, "", col_header_format)
-            ind_sheet.write(row, 6, "", col_header_format)
-            ind_sheet.write(row, 7, "Notes", col_header_format)
-            row += 1
-            
-            formalities_data = [
-                ("Formatting", 0, 0.3, "Overall", "Formatting"),
-                ("Structure", 0, 0.5, "Overall", "Structure"),
-                ("Style/Language", 0, 0.2, "Overall", "Style/Language")
-            ]
-            
-            formalities_score_cells = []
-            
-            for label, default_score, weight, cat, item in formalities_data:
-                score = default_score
-                notes = ""
-                if other_df is not None and not other_df.empty:
-                    match = other_df[(other_df['Category'] == cat) & (other_df['Item'].str.contains(item, case=False, na=False))]
-                    if not match.empty:
-                        score = float(match['Score'].values[0]) if not pd.isna(match['Score'].values[0]) else 0.0
-                        notes = str(match['Notes'].values[0]) if 'Notes' in match.columns else ""
-                
-                ind_sheet.merge_range(row, 0, row, 1, f"{label} (w: {weight*100:.0f}%)", cell_left_vcenter)
-                ind_sheet.write_number(row, 2, score, score_format)
-                ind_sheet.write_number(row, 3, 2.0, score_format)
-                ind_sheet.write(row, 4, "")
-                ind_sheet.write(row, 5, "")
-                ind_sheet.write(row, 6, "")
-                ind_sheet.write_string(row, 7, notes)
-                
-                formalities_score_cells.append( (row+1, weight) )
-                row += 1
-            
-            f_formula = "=SUM(" + ",".join([f"((C{r}/D{r})*{w})" for r, w in formalities_score_cells]) + ")"
-            ind_sheet.merge_range(row, 0, row, 3, "Formalities Sub-Total %", total_format)
-            ind_sheet.write_formula(row, 4, f_formula, total_pct_format)
-            ind_sheet.write(row, 5, "", total_format)
-            ind_sheet.write(row, 6, "", total_format)
-            ind_sheet.write(row, 7, "", total_format)
-            pct_cells['formalities'] = f"'{sheet_name}'!E{row+1}"
-            row += 2
-            
-            # -------------------------------------------------------------
-            # 2. Solution Report
-            # -------------------------------------------------------------
-            ind_sheet.merge_range(row, 0, row, 7, "2. Solution Report (40%)", section_format)
-            row += 1
-            
-            ind_sheet.write(row, 0, "Dimension", col_header_format)
-            ind_sheet.write(row, 1, "Item", col_header_format)
-            ind_sheet.write(row, 2, "Score", col_header_center_format)
-            ind_sheet.write(row, 3, "Max", col_header_center_format)
-            ind_sheet.write(row, 4, "", col_header_format)
-            ind_sheet.write(row, 5, "", col_header_format)
-            ind_sheet.write(row, 6, "", col_header_format)
-            ind_sheet.write(row, 7, "Notes", col_header_format)
-            row += 1
-            
-            sr_metrics = [
-                {"dim": "Approach", "weight": 0.5, "sub": [
-                    ("Correctness", 2, 0.5, 'Solution Report', 'Approach - Correctness'),
-                    ("Convincingness", 2, 0.35, 'Solution Report', 'Approach - Convincingness'),
-                    ("References", 1, 0.15, 'Solution Report', 'Approach - References'),
-                ]},
-                {"dim": "Context &\nSituationality", "weight": 0.25, "sub": [
-                    ("Correctness", 2, 0.5, 'Solution Report', 'Context & Situationality - Correctness'),
-                    ("Convincingness", 2, 0.35, 'Solution Report', 'Context & Situationality - Convincingness'),
-                    ("References", 1, 0.15, 'Solution Report', 'Context & Situationality - References'),
-                ]},
-                {"dim": "Implications", "weight": 0.25, "sub": [
-                    ("Correctness", 2, 0.5, 'Solution Report', 'Implications - Correctness'),
-                    ("Convincingness", 2, 0.35, 'Solution Report', 'Implications - Convincingness'),
-                    ("References", 1, 0.15, 'Solution Report', 'Implications - References'),
-                ]}
-            ]
-            
-            dim_cells = []
-            for sr in sr_metrics:
-                dim_row_start = row
-                sub_cells = []
-                for label, max_val, weight, cat, item in sr['sub']:
-                    score = 0
-                    notes = ""
-                    if other_df is not None and not other_df.empty:
-                        match = other_df[(other_df['Category'] == cat) & (other_df['Item'].str.contains(item, case=False, na=False))]
-                        if not match.empty:
-                            score = float(match['Score'].values[0]) if not pd.isna(match['Score'].values[0]) else 0.0
-                            notes = str(match['Notes'].values[0]) if 'Notes' in match.columns else ""
-                            
-                    ind_sheet.write(row, 1, f"{label} (w: {weight*100:.0f}%)", cell_left_vcenter)
-                    ind_sheet.write_number(row, 2, score, score_format)
-                    ind_sheet.write_number(row, 3, max_val, score_format)
-                    ind_sheet.write(row, 4, "")
-                    ind_sheet.write(row, 5, "")
-                    ind_sheet.write(row, 6, "")
-                    ind_sheet.write_string(row, 7, notes)
-                    
-                    sub_cells.append(f"((C{row+1}/D{row+1})*{weight})")
-                    row += 1
-                    
-                ind_sheet.merge_range(dim_row_start, 0, row-1, 0, f"{sr['dim']}\n(w: {sr['weight']*100:.0f}%)", merge_format)
-                
-                dim_formula = "=SUM(" + ",".join(sub_cells) + ")"
-                ind_sheet.merge_range(row, 0, row, 3, f"{sr['dim'].replace(chr(10), ' ')} Sub-Total", total_format)
-                ind_sheet.write_formula(row, 4, dim_formula, total_pct_format)
-                ind_sheet.write(row, 5, "", total_format)
-                ind_sheet.write(row, 6, "", total_format)
-                ind_sheet.write(row, 7, "", total_format)
-                dim_cells.append(f"(E{row+1}*{sr['weight']})")
-                row += 1
-                
-            sr_formula = "=SUM(" + ",".join(dim_cells) + ")"
-            ind_sheet.merge_range(row, 0, row, 3, "Solution Report Final Sub-Total %", total_format)
-            ind_sheet.write_formula(row, 4, sr_formula, total_pct_format)
-            ind_sheet.write(row, 5, "", total_format)
-            ind_sheet.write(row, 6, "", total_format)
-            ind_sheet.write(row, 7, "", total_format)
-            pct_cells['solution_report'] = f"'{sheet_name}'!E{row+1}"
-            row += 2
-            
-            # -------------------------------------------------------------
-            # 3. Practical Tasks
-            # -------------------------------------------------------------
-            ind_sheet.merge_range(row, 0, row, 7, "3. Practical Tasks (40%)", section_format)
-            row += 1
-            
-            ind_sheet.merge_range(row, 0, row, 1, "Task", col_header_format)
-            ind_sheet.write(row, 2, "Corr. Score", col_header_center_format)
-            ind_sheet.write(row, 3, "Corr. Max", col_header_center_format)
-            ind_sheet.write(row, 4, "Det. Score", col_header_center_format)
-            ind_sheet.write(row, 5, "Det. Max", col_header_center_format)
-            ind_sheet.write(row, 6, "", col_header_format)
-            ind_sheet.write(row, 7, "Notes", col_header_format)
-            row += 1
-            
-            task_pct_cells = []
-            if tasks_df is not None and not tasks_df.empty:
-                for _, t_row in tasks_df.iterrows():
-                    t_name = t_row['Task']
-                    c_score = float(t_row.get('practicalTaskCorrect', 0)) if not pd.isna(t_row.get('practicalTaskCorrect', 0)) else 0
-                    d_score = float(t_row.get('practicalTaskDetails', 0)) if not pd.isna(t_row.get('practicalTaskDetails', 0)) else 0
-                    
-                    ind_sheet.merge_range(row, 0, row, 1, t_name, cell_left_vcenter)
-                    ind_sheet.write_number(row, 2, c_score, score_format)
-                    ind_sheet.write_number(row, 3, 2.0, score_format)
-                    ind_sheet.write_number(row, 4, d_score, score_format)
-                    ind_sheet.write_number(row, 5, 1.0, score_format)
-                    ind_sheet.write(row, 6, "")
-                    ind_sheet.write(row, 7, "")
-                    
-                    task_form = f"=((C{row+1}/D{row+1})*0.65)+((E{row+1}/F{row+1})*0.35)"
-                    ind_sheet.write_formula(row, 8, task_form) # Column I (hidden)
-                    task_pct_cells.append(f"I{row+1}")
-                    row += 1
-                
-                tasks_formula = f"=AVERAGE({task_pct_cells[0]}:{task_pct_cells[-1]})"
-            else:
-                tasks_formula = "=0"
-                ind_sheet.merge_range(row, 0, row, 7, "No tasks data.", cell_left_vcenter)
-                row += 1
-            
-            ind_sheet.merge_range(row, 0, row, 3, "Practical Tasks Average %", total_format)
-            ind_sheet.write_formula(row, 4, tasks_formula, total_pct_format)
-            ind_sheet.write(row, 5, "", total_format)
-            ind_sheet.write(row, 6, "", total_format)
-            ind_sheet.write(row, 7, "", total_format)
-            pct_cells['practical_tasks'] = f"'{sheet_name}'!E{row+1}"
-            row += 3
-            
-            # -------------------------------------------------------------
-            # Final Section
-            # -------------------------------------------------------------
-            ind_sheet.merge_range(row, 0, row, 7, "--- FINAL AGGREGATION ---", section_format)
-            row += 1
-            
-            f_cell = pct_cells['formalities'].split('!')[1]
-            sr_cell = pct_cells['solution_report'].split('!')[1]
-            pt_cell = pct_cells['practical_tasks'].split('!')[1]
-            
-            ind_sheet.merge_range(row, 0, row, 3, "Overall Formalities (20%)", cell_left_vcenter)
-            ind_sheet.write_formula(row, 4, f"={f_cell}", percent_format)
-            ind_sheet.write(row, 5, "")
-            ind_sheet.write(row, 6, "")
-            ind_sheet.write(row, 7, "")
-            row +=1
-            
-            ind_sheet.merge_range(row, 0, row, 3, "Solution Report (40%)", cell_left_vcenter)
-            ind_sheet.write_formula(row, 4, f"={sr_cell}", percent_format)
-            ind_sheet.write(row, 5, "")
-            ind_sheet.write(row, 6, "")
-            ind_sheet.write(row, 7, "")
-            row +=1
-            
-            ind_sheet.merge_range(row, 0, row, 3, "Practical Tasks (40%)", cell_left_vcenter)
-            ind_sheet.write_formula(row, 4, f"={pt_cell}", percent_format)
-            ind_sheet.write(row, 5, "")
-            ind_sheet.write(row, 6, "")
-            ind_sheet.write(row, 7, "")
-            row +=1
-            
-            # Compute Total Percentage on the individual sheet
-            ind_tot_pct_formula = f"={f_cell}*0.2 + {pt_cell}*0.4 + {sr_cell}*0.4"
-            ind_sheet.merge_range(row, 0, row, 3, "Total Final Percentage", total_format)
-            ind_sheet.write_formula(row, 4, ind_tot_pct_formula, total_pct_format)
-            ind_sheet.write(row, 5, "", total_format)
-            ind_sheet.write(row, 6, "", total_format)
-            ind_sheet.write(row, 7, "", total_format)
-            tot_pct_row = row + 1
-            row += 1
-            
-            # Compute Final Grade on the individual sheet using VLOOKUP
-            ind_grade_formula = f"=VLOOKUP(E{tot_pct_row}, {mapping_range}, 2, TRUE)"
-            ind_sheet.merge_range(row, 0, row, 3, "Total Final German Grade", total_format)
-            ind_sheet.write_formula(row, 4, ind_grade_formula, final_grade_format)
-            ind_sheet.write(row, 5, "", total_format)
-            ind_sheet.write(row, 6, "", total_format)
-            ind_sheet.write(row, 7, "", total_format)
-            grade_row = row + 1
-            
-            # Link Master Overview to Individual Sheet
-            master_sheet.write_formula(master_row, 3, "=" + pct_cells['formalities'], percent_format)
-            master_sheet.write_formula(master_row, 4, "=" + pct_cells['practical_tasks'], percent_format)
-            master_sheet.write_formula(master_row, 5, "=" + pct_cells['solution_report'], percent_format)
-            master_sheet.write_formula(master_row, 6, f"='{sheet_name}'!E{tot_pct_row}", percent_format)
-            master_sheet.write_formula(master_row, 7, f"='{sheet_name}'!E{grade_row}", grade_format)
-            master_sheet.write_url(master_row, 8, f"internal:'{sheet_name}'!A1", string="View Sheet")
-            
-            # -------------------------------------------------------------
-            # Appendix: Raw Evaluation Text
-            # -------------------------------------------------------------
-            if all_texts and username in all_texts:
-                row += 3
-                ind_sheet.merge_range(row, 0, row, 7, "--- APPENDIX: Raw Evaluation Text ---", section_format)
-                row += 1
-                
-                raw_text = all_texts[username]
-                for text_line in raw_text.splitlines():
-                    ind_sheet.write_string(row, 0, text_line)
-                    row += 1
-            
-            master_row += 1
+        'cell_left_vcenter': workbook.add_format({'valign': 'vcenter'}),
+        'cell_center_vcenter': workbook.add_format({'align': 'center', 'valign': 'vcenter'}),
+        'merge': workbook.add_format({'valign': 'vcenter', 'align': 'center', 'text_wrap': True, 'bold': True}),
+        'appendix': workbook.add_format({'text_wrap': True, 'valign': 'top'})
+    }
+
+def setup_master_sheet(workbook, formats: Dict[str, Any]):
+    """Adds the Master Overview sheet with its header row."""
+    master_sheet = workbook.add_worksheet(MASTER_SHEET)
+    master_sheet.set_column('A:A', 15)
+    master_sheet.set_column('B:C', 20)
+    master_sheet.set_column('D:G', 18, formats['percent'])
+    master_sheet.set_column('H:H', 15, formats['grade'])
+    master_sheet.set_column('I:I', 15)
+    
+    headers = ['Username', 'First Name', 'Last Name', 'Formalities', 'Practical Tasks', 'Solution Report', 'Total Percentage', 'German Grade', 'Link']
+    for col_num, h in enumerate(headers):
+        master_sheet.write(0, col_num, h, formats['header'])
+    return master_sheet
 
+def write_workbook(output_path: str, records: Iterable[Dict[str, Any]], constant_memory: bool = False, verify: bool = False, scheme: Optional[GradingScheme] = None, appendix: str = 'lines', appendix_chunk: int = DEFAULT_CHUNK_CHARS, boilerplate: Optional[List[str]] = None, layout: str = 'linked') -> Dict[str, Dict[str, Any]]:
+    """Writes the Master Overview, one sheet per student record and the GradeMapping sheet.
+    
+    Records are consumed one at a time. With constant_memory, xlsxwriter flushes every row
+    to disk once the next row is started and each finished sheet's temp file is closed, so
+    peak memory does not grow with the number of students. Sheets, formulas and the grade
+    mapping follow scheme (the default grading scheme if None). The raw texts are written in
+    the appendix mode (see AppendixWriter); in compact mode, lines listed in boilerplate are
+    linked to a shared 'Boilerplate' sheet. The sheets are tied together in one of the
+    LAYOUTS; the 'scores' layout sizes its Scores sheet for the student with the most
+    tasks, so it reads all records before writing. Every workbook records the scores it
+    was written with in its hidden Generated sheet (see GeneratedSheet).
+    Returns the write_student_sheet cell references per username (with verify, including
+    the formula mismatches found on each sheet). Emits a 'workbook_written' event with the
+    time taken to serialize the workbook and its size.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}' (use {', '.join(LAYOUTS)})")
+    if layout == 'scores':
+        records = list(records)
+    cell_refs = {}
+    appendix_writer = AppendixWriter(appendix, appendix_chunk, boilerplate, output_path)
+    with xlsxwriter.Workbook(output_path, {'constant_memory': constant_memory}) as workbook:
+        formats = create_formats(workbook)
+        master_sheet = setup_master_sheet(workbook, formats)
+        scores = None
+        if layout == 'scores':
+            task_slots = max((len(sheet_task_scores(record.get('tasks'), scheme)) for record in records), default=0)
+            scores = ScoresSheet(workbook, formats, task_slots, scheme)
+        generated = GeneratedSheet(workbook, formats, scheme)
+        
+        plans = {}
+        for master_row, record in enumerate(records, start=1):
+            cell_refs[record['username']] = write_student_sheet(workbook, formats, master_sheet, master_row, record, verify, plans, scheme, appendix_writer, scores, generated)
+            if constant_memory:
+                # Release the finished sheet's row data file; xlsxwriter reopens it when packaging
+                workbook.worksheets()[-1]._opt_close()
+        
         # Move Mapping sheet to end
-        setup_grade_mapping_sheet(workbook, 'GradeMapping')
+        setup_grade_mapping_sheet(workbook, 'GradeMapping', scheme)
+        appendix_writer.finish(workbook, formats)
+        serialize_start = time.perf_counter()
+    emit('workbook_written', path=str(output_path), sheets=len(cell_refs), serialize_seconds=time.perf_counter() - serialize_start, bytes=os.path.getsize(output_path))
+    return cell_refs
+
+def iter_student_records(students_df: pd.DataFrame, all_tasks: Dict[str, pd.DataFrame], all_other: Dict[str, pd.DataFrame], all_texts: Dict[str, str] = None, all_rubrics: Dict[str, Dict[str, RubricScore]] = None, scheme: Optional[GradingScheme] = None) -> Iterator[Dict[str, Any]]:
+    """Yields the write_student_sheet record of every student in students_df."""
+    if all_texts is None:
+        all_texts = {}
+    if all_rubrics is None:
+        all_rubrics = {}
+    
+    for username, firstname, lastname in students_df[['Username', 'First name', 'Last name']].itertuples(index=False):
+        rubric = all_rubrics.get(username)
+        if rubric is None:
+            rubric = resolve_rubric(all_other.get(username), scheme)
+        yield {
+            'username': username,
+            'first_name': firstname,
+            'last_name': lastname,
+            'tasks': all_tasks.get(username),
+            'rubric': rubric,
+            'text': all_texts.get(username)
+        }
+
+def write_excel(output_path: str, students_df: pd.DataFrame, all_tasks: Dict[str, pd.DataFrame], all_other: Dict[str, pd.DataFrame], all_texts: Dict[str, str] = None, all_rubrics: Dict[str, Dict[str, RubricScore]] = None, verify: bool = False, scheme: Optional[GradingScheme] = None, appendix: str = 'lines', appendix_chunk: int = DEFAULT_CHUNK_CHARS, layout: str = 'linked') -> Dict[str, Dict[str, Any]]:
+    """Generates the main Excel grading report using native Excel formulas with a polished layout.
+    
+    all_rubrics holds the resolve_rubric result per student; students missing from it are resolved from all_other.
+    With verify, every formula is re-evaluated against its cached value (see verify_sheet_formulas).
+    The raw texts are written in the appendix mode; compact mode first collects the boilerplate of the cohort.
+    layout is one of LAYOUTS.
+    Returns the cell references of every student's sub-totals, total and grade.
+    """
+    records = iter_student_records(students_df, all_tasks, all_other, all_texts, all_rubrics, scheme)
+    boilerplate = cohort_boilerplate(all_texts) if appendix == 'compact' else None
+    return write_workbook(output_path, records, verify=verify, scheme=scheme, appendix=appendix, appendix_chunk=appendix_chunk, boilerplate=boilerplate, layout=layout)
+
+def write_excel_streaming(output_path: str, records: Iterable[Dict[str, Any]], verify: bool = False, scheme: Optional[GradingScheme] = None, appendix: str = 'lines', appendix_chunk: int = DEFAULT_CHUNK_CHARS) -> Dict[str, Dict[str, Any]]:
+    """Like write_excel, but consumes student records lazily and writes in constant_memory mode.
+
+    The texts are not known in advance, so the compact appendix only chunks (no boilerplate sheet).
+    """
+    return write_workbook(output_path, records, constant_memory=True, verify=verify, scheme=scheme, appendix=appendix, appendix_chunk=appendix_chunk)
+
+def cohort_boilerplate(all_texts: Optional[Dict[str, Any]]) -> List[str]:
+    """Returns the find_boilerplate lines of all raw texts (strings or TextFiles)."""
+    return find_boilerplate((all_texts or {}).values())
+
+def shard_students(students_df: pd.DataFrame, shards: Optional[int] = None, shard_by: Optional[str] = None) -> List[Tuple[str, pd.DataFrame]]:
+    """Splits the roster into (shard name, students) groups, keeping roster order within each.
+    
+    With shard_by, students are grouped by that column of students.csv (e.g. a tutor group);
+    otherwise they are cut into `shards` contiguous chunks of near-equal size.
+    """
+    if shard_by is not None:
+        if shard_by not in students_df.columns:
+            raise ValueError(f"Column '{shard_by}' not found in the students file.")
+        groups = students_df.groupby(students_df[shard_by].fillna('unassigned'), sort=False)
+        return [(re.sub(r'[^\w.-]+', '_', str(value)).strip('_') or 'unassigned', group) for value, group in groups]
+    
+    shards = max(1, min(shards or 1, len(students_df)))
+    size, remainder = divmod(len(students_df), shards)
+    result = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < remainder else 0)
+        result.append((f"{i + 1:0{len(str(shards))}d}", students_df.iloc[start:end]))
+        start = end
+    return result
+
+def write_index_workbook(output_path: str, entries: List[Dict[str, Any]]):
+    """Writes a lightweight workbook with a Master Overview of all shards.
+    
+    Each entry holds the student's names, the shard file name and the evaluate_student_sheet
+    values. xlsxwriter cannot write the external link parts that cross-workbook formulas need,
+    so the values are written directly and every row links to the student's sheet in its shard.
+    """
+    with xlsxwriter.Workbook(output_path) as workbook:
+        formats = create_formats(workbook)
+        master_sheet = setup_master_sheet(workbook, formats)
+        master_sheet.set_column('J:J', 25)
+        master_sheet.write(0, 9, 'Workbook', formats['header'])
+        
+        for master_row, entry in enumerate(entries, start=1):
+            values = entry['values']
+            master_sheet.write(master_row, 0, entry['username'])
+            master_sheet.write(master_row, 1, entry['first_name'])
+            master_sheet.write(master_row, 2, entry['last_name'])
+            master_sheet.write_number(master_row, 3, values['formalities_pct'], formats['percent'])
+            master_sheet.write_number(master_row, 4, values['practical_tasks_pct'], formats['percent'])
+            master_sheet.write_number(master_row, 5, values['solution_report_pct'], formats['percent'])
+            master_sheet.write_number(master_row, 6, values['total_pct'], formats['percent'])
+            master_sheet.write_string(master_row, 7, values['german_grade'], formats['grade'])
+            master_sheet.write_url(master_row, 8, f"external:{entry['shard_file']}#'{student_sheet_name(entry['username'])}'!A1", string="View Sheet")
+            master_sheet.write_url(master_row, 9, f"external:{entry['shard_file']}", string=entry['shard_file'])
+
+def write_excel_sharded(output_path: str, students_df: pd.DataFrame, all_tasks: Dict[str, pd.DataFrame], all_other: Dict[str, pd.DataFrame], all_texts: Dict[str, str] = None, all_rubrics: Dict[str, Dict[str, RubricScore]] = None, shards: Optional[int] = None, shard_by: Optional[str] = None, workers: int = 1, verify: bool = False, changed: Optional[Set[str]] = None, scheme: Optional[GradingScheme] = None, appendix: str = 'lines', appendix_chunk: int = DEFAULT_CHUNK_CHARS, layout: str = 'linked') -> Dict[Path, Dict[str, Dict[str, Any]]]:
+    """Writes the report as several shard workbooks plus an index workbook at output_path.
+    
+    Shards are named '<output stem>-<shard>.xlsx' next to the index. With workers > 1 they are
+    written concurrently in at most that many processes (and no more than CPUs); otherwise
+    one after another in this process. With changed, only shards holding one of those usernames (or not
+    written yet) are rewritten; the index is always rewritten. In compact appendix mode every
+    shard gets the boilerplate of the whole cohort. Each shard is written in the given layout;
+    the index holds plain values either way. Returns the write_workbook result per
+    rewritten shard path.
+    """
+    output_path = Path(output_path)
+    shard_groups = shard_students(students_df, shards, shard_by)
+    write_options = {'appendix': appendix, 'appendix_chunk': appendix_chunk, 'boilerplate': cohort_boilerplate(all_texts) if appendix == 'compact' else None, 'layout': layout}
+    
+    entries = []
+    shard_jobs = []
+    for shard_name, shard_df in shard_groups:
+        shard_path = output_path.with_name(f"{output_path.stem}-{shard_name}{output_path.suffix}")
+        records = list(iter_student_records(shard_df, all_tasks, all_other, all_texts, all_rubrics, scheme))
+        for record in records:
+            entries.append({
+                'username': record['username'],
+                'first_name': record['first_name'],
+                'last_name': record['last_name'],
+                'shard_file': shard_path.name,
+                'values': evaluate_student_sheet(record, scheme=scheme)
+            })
+        if changed is not None and shard_path.exists() and changed.isdisjoint(record['username'] for record in records):
+            continue
+        shard_jobs.append((shard_path, records))
+    
+    workers = min(workers, os.cpu_count() or 1, len(shard_jobs))
+    if workers <= 1:
+        # A single shard or worker is not worth starting a process pool for
+        write_index_workbook(str(output_path), entries)
+        return {shard_path: write_workbook(str(shard_path), records, verify=verify, scheme=scheme, **write_options) for shard_path, records in shard_jobs}
+    
+    # Spawned, not forked: --serve and --watch regenerate shards from a process with threads
+    # running, and forking a multi-threaded process can deadlock the children
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        # Shards are written in other processes, so their events are collected and replayed here
+        futures = {shard_path: executor.submit(collect_events, write_workbook, str(shard_path), records, verify=verify, scheme=scheme, **write_options) for shard_path, records in shard_jobs}
+        write_index_workbook(str(output_path), entries)
+        shard_refs = {}
+        for shard_path, future in futures.items():
+            shard_refs[shard_path], events, _ = future.result()
+            replay(events)
+        return shard_refs
@@ -0,0 +1,86 @@
+import importlib.util
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from excel_generator import GRADE_VALUES, sheet_grades
+from records import TaskRows
+from rubric import RubricScore, resolve_rubric
+from scheme import GradingScheme, default_scheme
+
+# Output formats by file suffix; Parquet and Arrow need the optional pyarrow package
+EXPORT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+ROSTER_COLUMNS = ['Username', 'First name', 'Last name', 'Matriculation number', 'E-mail']
+
+def export_format(path: str | Path) -> Optional[str]:
+    """Returns the export format for a file name, or None if its suffix is not supported."""
+    return EXPORT_FORMATS.get(Path(path).suffix.lower())
+
+def missing_export_dependency(path: str | Path) -> Optional[str]:
+    """Returns the package needed to write path that is not installed, if any."""
+    if export_format(path) in ('parquet', 'arrow') and importlib.util.find_spec('pyarrow') is None:
+        return 'pyarrow'
+    return None
+
+def build_cohort_table(students_df: pd.DataFrame, all_tasks: Dict[str, Any], all_other: Dict[str, Any], all_rubrics: Dict[str, Dict[str, RubricScore]] = None, scheme: Optional[GradingScheme] = None) -> pd.DataFrame:
+    """Returns one flat row per roster student with the results their workbook sheet shows and their raw scores.
+
+    Columns are the roster columns, the sub-totals, total and grade (sheet_grades, where
+    missing or non-numeric scores count as 0), one 'score_<key>' column per rubric item and,
+    per practical task, 'task<N>_name' plus 'task<N>_<column>' for each score column of
+    *-tasks.csv. Raw scores without a row in the CSVs are NaN. Rubric items and task columns
+    are those of scheme (the default grading scheme if None).
+    """
+    scheme = scheme or default_scheme()
+    if all_rubrics is None:
+        all_rubrics = {}
+    usernames = students_df['Username'].tolist()
+    table = students_df[[name for name in ROSTER_COLUMNS if name in students_df.columns]].reset_index(drop=True)
+
+    grades = sheet_grades(students_df, all_tasks, all_other, all_rubrics, scheme)
+    for name in GRADE_VALUES:
+        table[name] = grades[name].to_numpy()
+
+    raw = {f"score_{entry['key']}": [] for entry in scheme.rubric_items}
+    for username in usernames:
+        rubric = all_rubrics.get(username)
+        if rubric is None:
+            rubric = resolve_rubric(all_other.get(username), scheme)
+        for entry in scheme.rubric_items:
+            score = rubric.get(entry['key'])
+            raw[f"score_{entry['key']}"].append(score.score if score is not None else np.nan)
+
+    task_rows = [all_tasks.get(username) for username in usernames]
+    task_rows = [TaskRows.from_frame(rows) if isinstance(rows, pd.DataFrame) else rows for rows in task_rows]
+    task_count = [len(rows) if rows is not None else 0 for rows in task_rows]
+    table['task_count'] = task_count
+    for n in range(max(task_count, default=0)):
+        present = [rows if count > n else None for rows, count in zip(task_rows, task_count)]
+        raw[f"task{n + 1}_name"] = [rows.task[n] if rows is not None else None for rows in present]
+        for column in scheme.task_score_columns:
+            raw[f"task{n + 1}_{column}"] = [
+                rows.columns[column][n] if rows is not None and column in rows.columns else np.nan
+                for rows in present
+            ]
+    return pd.concat([table, pd.DataFrame(raw)], axis=1)
+
+def write_cohort_table(table: pd.DataFrame, path: str | Path):
+    """Writes a build_cohort_table result as CSV, Parquet or Arrow IPC, depending on the suffix."""
+    fmt = export_format(path)
+    if fmt == 'csv':
+        table.to_csv(path, index=False)
+    elif fmt == 'parquet':
+        table.to_parquet(path, index=False)
+    elif fmt == 'arrow':
+        table.to_feather(path)
+    else:
+        raise ValueError(f"Unsupported export format: {path} (use {', '.join(EXPORT_FORMATS)})")
+
+def export_cohort(paths: List[str | Path], students_df: pd.DataFrame, all_tasks: Dict[str, Any], all_other: Dict[str, Any], all_rubrics: Dict[str, Dict[str, RubricScore]] = None, scheme: Optional[GradingScheme] = None) -> pd.DataFrame:
+    """Builds the cohort table once and writes it to every path; returns the table."""
+    table = build_cohort_table(students_df, all_tasks, all_other, all_rubrics, scheme)
+    for path in paths:
+        write_cohort_table(table, path)
+    return table
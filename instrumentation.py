@@ -0,0 +1,124 @@
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Callable, Iterator, List, Tuple
+
+# Pipeline modules report what they do through emit(); nothing is printed and, without
+# listeners, emitting costs a single check.
+_listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+def add_listener(listener: Callable[[str, Dict[str, Any]], None]):
+    """Registers listener(event, fields) for every event emitted in this process."""
+    _listeners.append(listener)
+
+def remove_listener(listener: Callable[[str, Dict[str, Any]], None]):
+    """Unregisters a listener added with add_listener."""
+    _listeners.remove(listener)
+
+def emit(event: str, **fields):
+    """Sends an event to all listeners of this process."""
+    if _listeners:
+        for listener in list(_listeners):
+            listener(event, fields)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times a pipeline stage and emits a 'stage' event with its duration."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit('stage', name=name, seconds=time.perf_counter() - start)
+
+def collect_events(func: Callable, *args, **kwargs) -> Tuple[Any, List[Tuple[str, Dict[str, Any]]], float]:
+    """Calls func and returns (result, events emitted meanwhile, seconds taken).
+
+    Worker processes have no listeners, so tasks submitted to a pool run through this and
+    the parent hands the events to its own listeners with replay().
+    """
+    events = []
+    saved = _listeners[:]
+    _listeners[:] = [lambda event, fields: events.append((event, fields))]
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        _listeners[:] = saved
+    return result, events, time.perf_counter() - start
+
+def replay(events: List[Tuple[str, Dict[str, Any]]]):
+    """Emits events collected by collect_events in this process."""
+    for event, fields in events:
+        emit(event, **fields)
+
+class RunReport:
+    """Listener that aggregates pipeline events into stage timers, per-student timings and counters."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages: Dict[str, float] = {}
+        self.students: Dict[str, Dict[str, Any]] = {}
+        self.counters: Counter = Counter()
+        self.parse_seconds: Counter = Counter()
+        self.name_conflicts: List[Dict[str, Any]] = []
+        self.extra: Dict[str, Any] = {}
+
+    def __call__(self, event: str, fields: Dict[str, Any]):
+        self.counters[f"events.{event}"] += 1
+        if event == 'stage':
+            self.stages[fields['name']] = self.stages.get(fields['name'], 0.0) + fields['seconds']
+        elif event == 'directory_scanned':
+            self.counters['files_scanned'] += fields['files']
+        elif event == 'file_stat':
+            self.counters['files_stated'] += 1
+            if fields.get('hashed'):
+                self.counters['files_hashed'] += 1
+        elif event == 'cache_hit':
+            self.counters['cache_hits'] += 1
+        elif event == 'cache_miss':
+            self.counters['cache_misses'] += 1
+        elif event == 'file_parsed':
+            self.counters[f"files_parsed.{fields['kind']}"] += 1
+            # Rows of a CSV, characters of a text file
+            self.counters['text_chars' if fields['kind'] == 'text' else 'csv_rows'] += fields['size']
+            self.parse_seconds[fields['kind']] += fields['seconds']
+        elif event == 'name_conflict':
+            self.name_conflicts.append(dict(fields))
+        elif event == 'student_parsed':
+            self._student(fields['username'])['parse_seconds'] = fields['seconds']
+        elif event == 'sheet_written':
+            student = self._student(fields['username'])
+            student['write_seconds'] = fields['seconds']
+            student['cells'] = fields['cells']
+            student['formulas'] = fields['formulas']
+            self.counters['sheets_written'] += 1
+            self.counters['cells_written'] += fields['cells']
+            self.counters['formulas_written'] += fields['formulas']
+        elif event == 'workbook_written':
+            self.counters['workbooks_written'] += 1
+            self.counters['output_bytes'] += fields['bytes']
+            # Part of the stage that wrote the workbook
+            self.stages['write.serialize'] = self.stages.get('write.serialize', 0.0) + fields['serialize_seconds']
+
+    def _student(self, username: str) -> Dict[str, Any]:
+        return self.students.setdefault(username, {})
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the report as plain JSON-serializable data."""
+        return {
+            'started': self.started,
+            'wall_seconds': time.time() - self.started,
+            'stages': self.stages,
+            'parse_seconds_by_kind': dict(self.parse_seconds),
+            'counters': dict(self.counters),
+            'students': self.students,
+            'name_conflicts': self.name_conflicts,
+            **self.extra
+        }
+
+    def write(self, path: str | Path):
+        """Writes the report as JSON."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
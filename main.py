@@ -1,20 +1,28 @@
 import argparse
+import sys
 from pathlib import Path
-from parser import parse_students, parse_grading_other, parse_grading_tasks, parse_grading_text, find_student_grading_files
-from excel_generator import write_excel
+from parser import parse_students, read_students, DirectoryIndex
+from cache import ParseCache, default_cache_path
+from scheme import default_scheme, load_scheme
+from appendix import APPENDIX_MODES, DEFAULT_CHUNK_CHARS, MAX_CELL_CHARS
+from instrumentation import RunReport, add_listener, remove_listener, stage
+from pipeline import discover_student_files, report_name_conflicts, iter_streamed_records, report_parse_errors, report_formula_mismatches, load_student_data, collect_grading, import_grader_overrides, write_report
 
-def main():
-    parser = argparse.ArgumentParser(description="Grading Support Tool (Native Excel Formulas)")
-    parser.add_argument('--input-dir', type=str, required=True, help="Directory containing students and grading CSVs")
-    parser.add_argument('--output', type=str, default='grades_output.xlsx', help="Path to the output Excel file")
+# pandas, numpy and xlsxwriter (via excel_generator) as well as the process pool and the
+# profilers are imported by the stages that use them, so --help and --dry-run start fast.
+
+def run(args) -> int:
+    """Runs the grading pipeline for parsed command line arguments, timing each stage.
     
-    args = parser.parse_args()
+    Returns the exit status: 1 if the inputs or the --scheme file are missing or invalid, or
+    --dry-run found errors.
+    """
     input_path = Path(args.input_dir)
     output_path = args.output
     
     if not input_path.exists():
         print(f"Error: Input directory '{input_path}' does not exist.")
-        return
+        return 1
         
     # Find students.csv
     students_file = input_path / 'students.csv'
@@ -23,49 +31,218 @@ def main():
     
     if not students_file.exists():
         print(f"Error: Could not find students.csv or example-students.csv in {input_path}")
-        return
+        return 1
+    
+    scheme = default_scheme()
+    if args.scheme is not None:
+        try:
+            scheme = load_scheme(args.scheme)
+        except (OSError, ValueError) as e:
+            print(f"Error: Cannot load grading scheme '{args.scheme}': {e}")
+            return 1
+        print(f"Using grading scheme '{scheme.name}' from {args.scheme}.")
         
     print(f"Loading students from {students_file}...")
-    students_df = parse_students(students_file)
-    print(f"Identified {len(students_df)} students.")
+    with stage('load_students'):
+        if args.dry_run:
+            students = read_students(students_file)
+            columns = list(students[0]) if students else []
+        else:
+            students_df = parse_students(students_file)
+            students = students_df.to_dict('records')
+            columns = list(students_df.columns)
+    print(f"Identified {len(students)} students.")
     
-    all_tasks = {}
-    all_other = {}
-    all_texts = {}
+    if args.shard_by is not None and args.shard_by not in columns:
+        print(f"Error: Column '{args.shard_by}' not found in {students_file}")
+        return 1
     
-    for _, student in students_df.iterrows():
-        username = student['Username']
-        firstname = student.get('First name', "")
-        lastname = student.get('Last name', "")
-        
-        found_files = find_student_grading_files(input_path, username, firstname, lastname)
-        
-        other_file = found_files['other']
-        tasks_file = found_files['tasks']
-        text_file = found_files['text']
-        
-        # Override for the purely example files
-        if username == 'jakbrz': 
-            if (input_path / "example-grading-other.csv").exists():
-                other_file = input_path / "example-grading-other.csv"
-            if (input_path / "example-grading-tasks.csv").exists():
-                tasks_file = input_path / "example-grading-tasks.csv"
-            if (input_path / "example-grading-text.txt").exists():
-                text_file = input_path / "example-grading-text.txt"
-        
-        if other_file or tasks_file or text_file:
-            print(f"Found grading files for {username}")
-            
-            if other_file:
-                all_other[username] = parse_grading_other(other_file)
-            if tasks_file:
-                all_tasks[username] = parse_grading_tasks(tasks_file)
-            if text_file:
-                all_texts[username] = parse_grading_text(text_file)
-                
-    print(f"Finished parsing. Building Excel workbook at {output_path}...")
-    write_excel(output_path, students_df, all_tasks, all_other, all_texts)
+    # Scan the input directory once; all per-student lookups below are served from this index
+    with stage('scan_directory'):
+        index = DirectoryIndex(input_path)
+    
+    conflicts = {}
+    with stage('discover'):
+        jobs = discover_student_files(students, index, conflicts)
+    
+    if args.dry_run:
+        from validate import validate_inputs, print_validation
+        with stage('validate'):
+            result = validate_inputs(index, jobs, scheme, conflicts)
+        print_validation(result)
+        if not Path(output_path).resolve().parent.is_dir():
+            print(f"Error: Output directory for '{output_path}' does not exist.")
+            return 1
+        return 1 if result['errors'] else 0
+    report_name_conflicts(conflicts)
+    
+    if args.stream:
+        from excel_generator import write_excel_streaming
+        print(f"Streaming {len(jobs)} students into {output_path}...")
+        errors = {}
+        with stage('parse_and_write'):
+            cell_refs = write_excel_streaming(output_path, iter_streamed_records(students_df, jobs, args.workers, errors, lazy_text=args.lazy_text, scheme=scheme), verify=args.verify_formulas, scheme=scheme, appendix=args.appendix, appendix_chunk=args.appendix_chunk)
+        report_parse_errors(errors)
+        if args.verify_formulas:
+            report_formula_mismatches(cell_refs)
+        print("Done!")
+        return 0
+    
+    cache = None
+    if args.incremental:
+        with stage('cache_lookup'):
+            cache = ParseCache(args.cache or default_cache_path(output_path), use_hash=args.hash_inputs).load()
+    
+    student_data, errors = load_student_data(jobs, args.workers, cache, io_threads=args.io_threads, lazy_text=args.lazy_text)
+    grading = collect_grading(student_data, scheme)
+    report_parse_errors(errors)
+    
+    if cache is not None:
+        with stage('cache_save'):
+            cache.save()
+    
+    if args.import_overrides is not None:
+        import_grader_overrides(args, input_path, student_data, grading, dict(jobs), scheme)
+    
+    write_report(args, students_df, grading, scheme=scheme, files=dict(jobs))
+    if args.watch or args.serve:
+        from watch import WarmState
+        state = WarmState(args, students_file, students_df, jobs, student_data, grading, cache, scheme, errors)
+        if args.serve:
+            from serve import serve_state
+            return serve_state(state)
+        from watch import watch_inputs
+        return watch_inputs(state)
     print("Done!")
+    return 0
+
+def run_profiled(args, report: RunReport) -> int:
+    """Runs the pipeline under cProfile and tracemalloc and adds a summary to the report.
+    
+    The full profile is saved next to the output as '<stem>.prof' (readable with pstats).
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+    
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        status = run(args)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    
+    profile_path = Path(args.output).with_suffix('.prof')
+    profiler.dump_stats(profile_path)
+    stats = pstats.Stats(profiler)
+    top_functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:20]
+    report.extra['profile'] = {
+        'stats_file': str(profile_path),
+        'top_cumulative': [
+            {'function': f"{filename}:{line}({name})", 'calls': calls, 'total_seconds': total, 'cumulative_seconds': cumulative}
+            for (filename, line, name), (_, calls, total, cumulative, _) in top_functions
+        ],
+        'traced_peak_mb': peak / (1024 * 1024),
+        'top_allocations': [
+            {'location': str(stat.traceback[0]), 'size_mb': stat.size / (1024 * 1024), 'count': stat.count}
+            for stat in snapshot.statistics('lineno')[:20]
+        ]
+    }
+    print(f"Profile saved to {profile_path} (traced peak memory {peak / (1024 * 1024):.1f} MB).")
+    return status
+
+def build_parser() -> argparse.ArgumentParser:
+    """The command line parser; batch.py builds each course's options with it too."""
+    parser = argparse.ArgumentParser(description="Grading Support Tool (Native Excel Formulas)")
+    parser.add_argument('--input-dir', type=str, required=True, help="Directory containing students and grading CSVs")
+    parser.add_argument('--output', type=str, default='grades_output.xlsx', help="Path to the output Excel file")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes used to parse the grading files")
+    parser.add_argument('--incremental', action='store_true', help="Reuse cached parse results for grading files that did not change since the last run")
+    parser.add_argument('--cache', type=str, default=None, help="With --incremental, the parse cache file to use (default: '<output>.cache.pkl' next to --output)")
+    parser.add_argument('--hash-inputs', action='store_true', help="With --incremental, also compare file content hashes instead of only size and mtime; also rehashes every input for the run snapshot")
+    parser.add_argument('--stream', action='store_true', help="Parse and write one student at a time in constant-memory mode (bounded memory for large cohorts)")
+    parser.add_argument('--shards', type=int, default=None, help="Split the report into N workbooks, written in parallel with --workers, plus an index workbook at --output")
+    parser.add_argument('--verify-formulas', action='store_true', help="Re-evaluate every written formula and report any disagreement with its precomputed cached value")
+    parser.add_argument('--shard-by', type=str, default=None, help="Split the report into one workbook per value of this students.csv column (e.g. a tutor group)")
+    parser.add_argument('--report', type=str, default=None, help="Write a JSON report with stage timings, per-student timings and counters to this file")
+    parser.add_argument('--dry-run', action='store_true', help="Only check the inputs (roster, file discovery, CSV contents, score ranges) without writing a workbook; exits with status 1 on errors")
+    parser.add_argument('--profile', action='store_true', help="Run under cProfile and tracemalloc; saves '<output>.prof' and adds a summary to --report")
+    parser.add_argument('--io-threads', type=int, default=0, help="Read the raw evaluation texts in this many threads while the CSVs are parsed (helps on network filesystems)")
+    parser.add_argument('--lazy-text', action='store_true', help="Do not keep the raw evaluation texts in memory; stream each one from disk into its appendix while writing")
+    parser.add_argument('--export', type=str, action='append', default=[], help="Also write the per-student results and raw scores as a flat table (.csv, .parquet or .arrow/.feather); repeatable")
+    parser.add_argument('--no-workbook', action='store_true', help="Skip the Excel workbook and only write the --export files")
+    parser.add_argument('--watch', action='store_true', help="After the first run, keep watching the input directory and regenerate the output when grading files or the roster change")
+    parser.add_argument('--poll-interval', type=float, default=0.5, help="With --watch, seconds between directory scans (inotify wakes the watcher earlier where available)")
+    parser.add_argument('--debounce', type=float, default=0.2, help="With --watch, seconds the input directory must stay unchanged before regenerating")
+    parser.add_argument('--import-overrides', type=str, default=None, help="Read the scores of every individual sheet from this previously generated workbook (usually --output) and use those graders changed instead of the CSV values")
+    parser.add_argument('--write-back', action='store_true', help="With --import-overrides, also write the changed scores into the *-other.csv and *-tasks.csv files")
+    parser.add_argument('--serve', action='store_true', help="After the first run, keep the parsed data in memory and serve a local JSON API (student grades, cohort summary, regenerate) until interrupted")
+    parser.add_argument('--port', type=int, default=8765, help="With --serve, the port on 127.0.0.1 to listen on")
+    parser.add_argument('--socket', type=str, default=None, help="With --serve, listen on this Unix socket instead of a TCP port")
+    parser.add_argument('--no-snapshot', action='store_true', help="Do not save the '<output>.snapshot.json' with every student's results and input hashes (compare two with snapshot.py)")
+    parser.add_argument('--scheme', type=str, default=None, help="Grading scheme file (.toml or .json) with the rubric items, weights, maxima and grade scale; defaults to the built-in ISBPM scheme")
+    parser.add_argument('--appendix', choices=APPENDIX_MODES, default='lines', help="How the raw evaluation texts are written: one cell per line, compact wrapped cells with shared boilerplate, or a sidecar '<output>.texts.zip' linked from each sheet")
+    parser.add_argument('--appendix-chunk', type=int, default=DEFAULT_CHUNK_CHARS, help=f"With --appendix compact, the maximum characters per appendix cell (at most {MAX_CELL_CHARS})")
+    parser.add_argument('--layout', choices=('linked', 'scores'), default='linked', help="How the sheets are tied together: the Master Overview links to every individual sheet, or a hidden 'Scores' sheet holds one row per student and the Master Overview computes the totals in-row (faster recalculation for large cohorts)")
+    return parser
+
+def check_args(parser: argparse.ArgumentParser, args):
+    """Rejects option combinations that cannot work together (exits through parser.error)."""
+    if args.stream and args.incremental:
+        parser.error("--incremental keeps all parsed data in memory and cannot be combined with --stream")
+    if (args.shards is not None or args.shard_by is not None) and args.stream:
+        parser.error("--shards/--shard-by cannot be combined with --stream")
+    if args.export or args.no_workbook:
+        from export import export_format, missing_export_dependency
+        if args.no_workbook and not args.export:
+            parser.error("--no-workbook requires at least one --export file")
+        if args.stream:
+            parser.error("--export needs the whole cohort in memory and cannot be combined with --stream")
+        for path in args.export:
+            if export_format(path) is None:
+                parser.error(f"--export {path}: unsupported format (use .csv, .parquet, .arrow or .feather)")
+            if missing_export_dependency(path):
+                parser.error(f"--export {path}: writing this format requires the '{missing_export_dependency(path)}' package")
+    if not 1 <= args.appendix_chunk <= MAX_CELL_CHARS:
+        parser.error(f"--appendix-chunk must be between 1 and {MAX_CELL_CHARS}")
+    if args.stream and args.layout == 'scores':
+        parser.error("--layout scores sizes the Scores sheet for the whole cohort and cannot be combined with --stream")
+    if args.watch and (args.stream or args.dry_run):
+        parser.error("--watch keeps parsed data in memory and cannot be combined with --stream or --dry-run")
+    if args.write_back and args.import_overrides is None:
+        parser.error("--write-back requires --import-overrides")
+    if args.import_overrides is not None and (args.stream or args.dry_run):
+        parser.error("--import-overrides compares against the parsed cohort and cannot be combined with --stream or --dry-run")
+    if args.serve and (args.stream or args.dry_run or args.watch):
+        parser.error("--serve keeps parsed data in memory and cannot be combined with --stream, --dry-run or --watch")
+    if args.cache is not None and not args.incremental:
+        parser.error("--cache requires --incremental")
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    check_args(parser, args)
+    
+    if args.report is None and not args.profile:
+        sys.exit(run(args))
+    
+    report = RunReport()
+    add_listener(report)
+    try:
+        if args.profile:
+            status = run_profiled(args, report)
+        else:
+            status = run(args)
+    finally:
+        remove_listener(report)
+    if args.report is not None:
+        report.write(args.report)
+        print(f"Report written to {args.report}")
+    sys.exit(status)
 
 if __name__ == "__main__":
     main()
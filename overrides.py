@@ -0,0 +1,375 @@
+import csv
+import io
+import math
+import os
+from array import array
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from records import OtherRows, TaskRows, text_cell
+from scheme import GradingScheme, default_scheme
+
+# Graders sometimes fix scores directly in a generated workbook. These functions read the
+# Score cells of such a workbook back, compare them with the scores the workbook was written
+# with (its hidden Generated sheet) and take the changed ones over into the parsed CSVs,
+# either by patching the parsed data (overrides) or by writing the fixes into the
+# *-other.csv / *-tasks.csv files. Scores changed in the CSVs since are kept as they are.
+# Workbooks are read with openpyxl in read-only mode: sheets are parsed as XML streams and
+# only up to the last graded row, so thousands of sheets never sit in memory at once.
+
+# Scores closer than this count as unchanged
+TOLERANCE = 1e-9
+
+def _number(value) -> Optional[float]:
+    """Returns a cell value typed as a number; formulas, text and blanks give None."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+def _read_scores_sheet(sheet, scheme: GradingScheme) -> Dict[str, Dict[str, Any]]:
+    """Reads the numeric cells of a 'scores' layout Scores sheet per username."""
+    from excel_generator import scores_columns
+    from xlsxwriter.utility import xl_cell_to_rowcol
+    rows = sheet.iter_rows(values_only=True)
+    header = next(rows, None) or ()
+    task_slots = max(0, (len(header) - 1 - len(scheme.rubric_keys)) // 3)
+    columns = scores_columns(task_slots, scheme)
+    position = lambda column: xl_cell_to_rowcol(f"{column}1")[1]
+    items = {key: position(column) for key, column in columns['items'].items()}
+    tasks = [(slot, scheme.practical_task[name], position(column)) for name, kind in (('correct_column', 'correct'), ('details_column', 'details')) for slot, column in enumerate(columns[kind])]
+    found = {}
+    for row in rows:
+        if not row or row[0] is None:
+            continue
+        cell = lambda col: _number(row[col]) if col < len(row) else None
+        found[str(row[0])] = {
+            'items': {key: cell(col) for key, col in items.items() if cell(col) is not None},
+            'tasks': {(slot, name): cell(col) for slot, name, col in tasks if cell(col) is not None}
+        }
+    return found
+
+def _read_generated_sheet(sheet, scheme: GradingScheme) -> Dict[str, Dict[str, Any]]:
+    """Reads the GeneratedSheet of a workbook per username, in the shape of read_workbook_scores."""
+    correct_column, details_column = scheme.practical_task['correct_column'], scheme.practical_task['details_column']
+    rows = sheet.iter_rows(values_only=True)
+    header = list(next(rows, None) or ())
+    items = {key: header.index(key) for key in scheme.rubric_keys if key in header}
+    first_task = header.index('Tasks') if 'Tasks' in header else len(header)
+    found = {}
+    for row in rows:
+        if not row or row[0] is None:
+            continue
+        values = [_number(value) for value in row[first_task:]]
+        while values and values[-1] is None:
+            values.pop()
+        found[str(row[0])] = {
+            'items': {key: _number(row[col]) or 0.0 for key, col in items.items() if col < len(row)},
+            'tasks': {(index // 2, correct_column if index % 2 == 0 else details_column): value or 0.0 for index, value in enumerate(values)}
+        }
+    return found
+
+def read_workbook_scores(path: str | Path, task_counts: Dict[str, int], scheme: Optional[GradingScheme] = None) -> Dict[str, Dict[str, Any]]:
+    """Reads the scores of the students in task_counts from a workbook written by excel_generator.
+
+    task_counts maps usernames to their number of parsed tasks, which fixes the layout of
+    their sheet (see excel_generator.score_cells). Returns per username found
+    {'items': {rubric key: score}, 'tasks': {(task index, score column): score}} with the
+    cells that hold numbers; cells still holding formulas (the 'scores' layout's lookups)
+    are taken from the Scores sheet instead. Under 'generated' goes the same for the scores
+    the sheet was written with, from the workbook's Generated sheet (None for workbooks
+    written without one). A sheet whose layout does not match the parsed tasks, e.g. after
+    rows were inserted, is skipped with a warning. An index workbook of a sharded report is
+    followed to its shard workbooks.
+    """
+    import openpyxl
+    from excel_generator import GENERATED_SHEET, MASTER_SHEET, SCORES_SHEET, score_cells, student_sheet_name
+    scheme = scheme or default_scheme()
+    path = Path(path)
+    correct_column, details_column = scheme.practical_task['correct_column'], scheme.practical_task['details_column']
+    layouts = {}
+    found = {}
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        sheet_names = set(workbook.sheetnames)
+        if SCORES_SHEET in sheet_names:
+            found = {username: scores for username, scores in _read_scores_sheet(workbook[SCORES_SHEET], scheme).items() if username in task_counts}
+        for username, task_count in task_counts.items():
+            sheet_name = student_sheet_name(username)
+            if sheet_name not in sheet_names:
+                continue
+            layout = layouts.get(task_count)
+            if layout is None:
+                layout = layouts[task_count] = score_cells(task_count, scheme)
+            rows = list(workbook[sheet_name].iter_rows(min_row=1, max_row=layout['last_row'] + 1, max_col=5, values_only=True))
+            cell = lambda row, col: rows[row][col] if row < len(rows) and col < len(rows[row]) else None
+            if not str(cell(0, 0) or '').endswith(f"({username})") or cell(layout['last_row'], 0) != "Total Final German Grade":
+                print(f"Warning: Sheet '{sheet_name}' does not match the {task_count} parsed task(s) of {username}; its scores are not imported.")
+                found.pop(username, None)
+                continue
+            scores = found.setdefault(username, {'items': {}, 'tasks': {}})
+            for row, key in layout['items']:
+                value = _number(cell(row, 2))
+                if value is not None:
+                    scores['items'][key] = value
+            for row, index in layout['tasks']:
+                for col, column in ((2, correct_column), (4, details_column)):
+                    value = _number(cell(row, col))
+                    if value is not None:
+                        scores['tasks'][(index, column)] = value
+        generated = _read_generated_sheet(workbook[GENERATED_SHEET], scheme) if GENERATED_SHEET in sheet_names else {}
+        for username, scores in found.items():
+            scores['generated'] = generated.get(username)
+
+        # An index workbook lists the shard workbook of each student in its 'Workbook' column
+        shard_files = {}
+        if MASTER_SHEET in sheet_names:
+            master_rows = workbook[MASTER_SHEET].iter_rows(max_col=10, values_only=True)
+            header = next(master_rows, None) or ()
+            if len(header) >= 10 and header[9] == 'Workbook':
+                for row in master_rows:
+                    if row[0] in task_counts and row[0] not in found and row[9]:
+                        shard_files.setdefault(row[9], {})[row[0]] = task_counts[row[0]]
+    finally:
+        workbook.close()
+    for shard_file, shard_counts in shard_files.items():
+        shard_path = path.with_name(shard_file)
+        if shard_path.exists():
+            found.update(read_workbook_scores(shard_path, shard_counts, scheme))
+        else:
+            print(f"Warning: Shard workbook {shard_path} not found; its scores are not imported.")
+    return found
+
+def _changed(a: float, b: float) -> bool:
+    return not math.isclose(a, b, rel_tol=0.0, abs_tol=TOLERANCE)
+
+def find_overrides(workbook_scores: Dict[str, Dict[str, Any]], grading: Dict[str, Dict[str, Any]], scheme: Optional[GradingScheme] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Finds the scores graders changed in a workbook, from read_workbook_scores results and a collect_grading result.
+
+    Each workbook cell is compared with the score the workbook was generated with and, if
+    the grader changed it, with the score parsed now (values the sheets are written with:
+    missing or non-numeric scores are 0). A change is an override if the parsed score is
+    still the generated one, and a conflict if the grading files changed it too (to another
+    value); scores changed only in the grading files are neither. Students whose workbook
+    has no Generated sheet to compare with are skipped with a warning.
+    Returns (overrides, conflicts): per student with overrides {'items': {key: (parsed,
+    workbook)}, 'tasks': {(task index, score column): (parsed, workbook)}}, and per student
+    with conflicts the same with (generated, parsed, workbook) tuples.
+    """
+    from excel_generator import sheet_score, sheet_task_scores
+    scheme = scheme or default_scheme()
+    correct_column = scheme.practical_task['correct_column']
+    overrides = {}
+    conflicts = {}
+    unknown = [username for username, scores in workbook_scores.items() if scores.get('generated') is None]
+    if unknown:
+        print(f"Warning: The workbook holds no generated scores for {len(unknown)} student(s) (e.g. {unknown[0]}), as written by an older version; their scores are not imported.")
+    for username, scores in workbook_scores.items():
+        generated = scores.get('generated')
+        if generated is None:
+            continue
+        rubric = grading['rubrics'].get(username) or {}
+        task_scores = sheet_task_scores(grading['tasks'].get(username), scheme)
+        found = {'items': {}, 'tasks': {}}
+        clashes = {'items': {}, 'tasks': {}}
+        cells = [('items', key, value, generated['items'].get(key), lambda key: sheet_score(rubric, key)[0]) for key, value in scores['items'].items()]
+        cells += [('tasks', (index, column), value, generated['tasks'].get((index, column)), lambda cell: task_scores[cell[0]][1 if cell[1] == correct_column else 2]) for (index, column), value in scores['tasks'].items() if index < len(task_scores)]
+        for kind, cell, value, base, parsed_score in cells:
+            if base is None or not _changed(base, value):
+                continue
+            parsed = parsed_score(cell)
+            if not _changed(parsed, base):
+                found[kind][cell] = (parsed, value)
+            elif _changed(parsed, value):
+                clashes[kind][cell] = (base, parsed, value)
+        if found['items'] or found['tasks']:
+            overrides[username] = found
+        if clashes['items'] or clashes['tasks']:
+            conflicts[username] = clashes
+    return overrides, conflicts
+
+def report_overrides(overrides: Dict[str, Dict[str, Any]], source: str | Path, scheme: Optional[GradingScheme] = None, conflicts: Optional[Dict[str, Dict[str, Any]]] = None):
+    """Prints every score found changed in the workbook, and the find_overrides conflicts."""
+    scheme = scheme or default_scheme()
+    labels = {entry['key']: entry['item'] for entry in scheme.rubric_items}
+    name = lambda kind, cell: labels[cell] if kind == 'items' else f"task {cell[0] + 1} {cell[1]}"
+    count = sum(len(changes['items']) + len(changes['tasks']) for changes in overrides.values())
+    print(f"Imported {count} changed score(s) of {len(overrides)} student(s) from {source}.")
+    for username, changes in overrides.items():
+        for kind in ('items', 'tasks'):
+            for cell, (parsed, value) in changes[kind].items():
+                print(f"  {username}: {name(kind, cell)} {parsed:g} -> {value:g}")
+    if conflicts:
+        count = sum(len(changes['items']) + len(changes['tasks']) for changes in conflicts.values())
+        print(f"Warning: {count} score(s) of {len(conflicts)} student(s) were changed both in {source} and in the grading files; the grading files' scores are kept:")
+        for username, changes in conflicts.items():
+            for kind in ('items', 'tasks'):
+                for cell, (base, parsed, value) in changes[kind].items():
+                    print(f"  {username}: {name(kind, cell)} was {base:g}, grading files {parsed:g}, workbook {value:g}")
+
+def _patched_other(rows, items: Dict[str, Tuple[float, float]], scheme: GradingScheme) -> Optional[OtherRows]:
+    # Parsed rows may be shared with the parse cache, so they are copied rather than changed
+    if not items:
+        return rows
+    if rows is None:
+        rows = OtherRows([], [], array('d'), [])
+    elif not isinstance(rows, OtherRows):
+        rows = OtherRows.from_frame(rows)
+    patched = OtherRows(list(rows.category), list(rows.item), array('d', rows.score), list(rows.notes) if rows.notes is not None else None)
+    entries = {entry['key']: entry for entry in scheme.rubric_items}
+    for key, (_, value) in items.items():
+        pos = next((pos for pos, (category, item) in enumerate(zip(patched.category, patched.item)) if scheme.match_item(category, item) == key), None)
+        if pos is not None:
+            patched.score[pos] = value
+            continue
+        # The item had no row and was graded 0; the override adds one
+        patched.category.append(entries[key]['category'])
+        patched.item.append(entries[key]['item'])
+        patched.score.append(value)
+        if patched.notes is not None:
+            patched.notes.append("")
+    return patched
+
+def _patched_tasks(rows, tasks: Dict[Tuple[int, str], Tuple[float, float]]) -> Optional[TaskRows]:
+    if not tasks:
+        return rows
+    if not isinstance(rows, TaskRows):
+        rows = TaskRows.from_frame(rows)
+    patched = TaskRows(list(rows.task), {name: array('d', values) for name, values in rows.columns.items()})
+    for (index, column), (_, value) in tasks.items():
+        # A column missing from the file was graded 0 in every row
+        values = patched.columns.setdefault(column, array('d', [0.0] * len(patched.task)))
+        values[index] = value
+    return patched
+
+def apply_overrides(student_data: Dict[str, Dict[str, Any]], overrides: Dict[str, Dict[str, Any]], scheme: Optional[GradingScheme] = None) -> Dict[str, Dict[str, Any]]:
+    """Returns the parsed data of every overridden student with the workbook scores applied.
+
+    student_data is the load_student_data result; it is left unchanged.
+    """
+    scheme = scheme or default_scheme()
+    patched = {}
+    for username, changes in overrides.items():
+        data = student_data.get(username) or {'other': None, 'tasks': None, 'text': None}
+        patched[username] = {**data, 'other': _patched_other(data['other'], changes['items'], scheme), 'tasks': _patched_tasks(data['tasks'], changes['tasks'])}
+    return patched
+
+def _score_text(value: float) -> str:
+    return f"{value:g}"
+
+class _CsvFile:
+    """A grading file opened by write_back: its header and data rows as read_csv_rows gives them.
+
+    The rows can be changed in place and appended to. save writes every line whose cells
+    are unchanged exactly as it was read (quoting, line ending and byte order mark
+    included), so the file differs from before only in the rows write_back changed.
+    """
+
+    def __init__(self, path: Path, header: Optional[List[str]] = None):
+        self.path = path
+        self.bom = ''
+        self.newline = '\n'
+        # [cells, cells as read, text as read] per record of the file; blank lines have no cells
+        self.records = []
+        if header is not None:
+            self.records.append([header, None, None])
+        else:
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                text = f.read()
+            if text.startswith('\ufeff'):
+                self.bom, text = '\ufeff', text[1:]
+            lines = list(io.StringIO(text, newline=''))
+            if lines and lines[0].endswith('\r\n'):
+                self.newline = '\r\n'
+            reader = csv.reader(lines)
+            start = 0
+            for cells in reader:
+                self.records.append([cells, list(cells), ''.join(lines[start:reader.line_num])])
+                start = reader.line_num
+        data = [record[0] for record in self.records if record[0]]
+        if not data:
+            raise ValueError(f"No columns to parse from {path}")
+        self.header, self.rows = data[0], data[1:]
+
+    def append(self, row: List[str]):
+        self.rows.append(row)
+        self.records.append([row, None, None])
+
+    def save(self):
+        parts = [self.bom]
+        for cells, read, text in self.records:
+            if text is None or cells != read:
+                if not parts[-1].endswith(('\n', '\r')) and len(parts) > 1:
+                    parts.append(self.newline)
+                line = io.StringIO()
+                csv.writer(line, lineterminator=self.newline).writerow(cells)
+                text = line.getvalue()
+            parts.append(text)
+        # Replaced only once complete, so an interrupted write never leaves half a file
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(''.join(parts))
+        os.replace(tmp_path, self.path)
+
+def _file_stem(found_files: Dict[str, Optional[Path]]) -> Optional[str]:
+    """Returns the stem ('<username>' or '<Lastname>-<Firstname>') of a student's discovered files."""
+    for kind, suffix in (('tasks', '-tasks.csv'), ('text', '.txt')):
+        path = found_files.get(kind)
+        if path is not None and path.name.lower().endswith(suffix):
+            return path.name[:-len(suffix)]
+    return None
+
+def write_back(files: Dict[str, Dict[str, Optional[Path]]], overrides: Dict[str, Dict[str, Any]], input_dir: str | Path, scheme: Optional[GradingScheme] = None) -> Tuple[List[Path], Dict[str, str]]:
+    """Writes the overridden scores into the students' *-other.csv and *-tasks.csv files.
+
+    files are the discovered grading files per username. A rubric item without a row gets
+    one appended; a student without a *-other.csv gets one named like their other grading
+    files in input_dir, since a '<username>-other.csv' next to name-matched files would hide
+    those from the next run. Students with no grading files to take the name from are not
+    written back. Lines without changed scores are written back byte for byte as read.
+    Returns the files written and the reason per username that was not written back.
+    """
+    scheme = scheme or default_scheme()
+    entries = {entry['key']: entry for entry in scheme.rubric_items}
+    written = []
+    errors = {}
+    for username, changes in overrides.items():
+        found_files = files.get(username, {})
+        if changes['items'] and found_files.get('other') is None and _file_stem(found_files) is None:
+            errors[username] = "no grading files to name a new *-other.csv after"
+            continue
+        if changes['items']:
+            path = found_files.get('other')
+            if path is None:
+                csv_file = _CsvFile(Path(input_dir) / f"{_file_stem(found_files)}-other.csv", ['Category', 'Item', 'Score', 'Notes'])
+            else:
+                csv_file = _CsvFile(path)
+            header, rows = csv_file.header, csv_file.rows
+            cat_pos, item_pos, score_pos = (header.index(name) if name in header else None for name in ('Category', 'Item', 'Score'))
+            for key, (_, value) in changes['items'].items():
+                row = next((row for row in rows if scheme.match_item(*(text_cell(row[pos]) if pos is not None and pos < len(row) else None for pos in (cat_pos, item_pos))) == key), None)
+                if row is None:
+                    row = [''] * len(header)
+                    if cat_pos is not None:
+                        row[cat_pos] = entries[key]['category']
+                    if item_pos is not None:
+                        row[item_pos] = entries[key]['item']
+                    csv_file.append(row)
+                row.extend([''] * (score_pos + 1 - len(row)))
+                row[score_pos] = _score_text(value)
+            csv_file.save()
+            written.append(csv_file.path)
+        if changes['tasks']:
+            csv_file = _CsvFile(found_files['tasks'])
+            header, rows = csv_file.header, csv_file.rows
+            for (index, column), (_, value) in changes['tasks'].items():
+                if column not in header:
+                    header.append(column)
+                    for row in rows:
+                        row.extend([''] * (len(header) - 1 - len(row)) + ['0'])
+                pos = header.index(column)
+                row = rows[index]
+                row.extend([''] * (pos + 1 - len(row)))
+                row[pos] = _score_text(value)
+            csv_file.save()
+            written.append(csv_file.path)
+    return written, errors
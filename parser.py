@@ -1,18 +1,47 @@
-import pandas as pd
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import TYPE_CHECKING, Collection, Dict, Any, List, Optional
 from unidecode import unidecode
+from instrumentation import emit
+from records import OtherRows, TaskRows, text_cell
 
-def parse_students(filepath: str | Path) -> pd.DataFrame:
+# pandas is imported by the functions that build DataFrames, so validation runs start fast
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Roster statuses of examined students; tutor accounts and the like are skipped
+STUDENT_STATUSES = ('autor', 'accepted')
+
+def parse_students(filepath: str | Path) -> 'pd.DataFrame':
     """Parses the students CSV."""
+    import pandas as pd
     df = pd.read_csv(filepath, sep=';', dtype=str)
     # Filter out accepted/tutor accounts if needed, depending on 'Status' or 'Position'
     if 'Status' in df.columns:
-        df = df[df['Status'].isin(['autor', 'accepted'])]
+        df = df[df['Status'].isin(STUDENT_STATUSES)]
     return df
 
-def parse_grading_other(filepath: str | Path) -> pd.DataFrame:
+def read_students(filepath: str | Path) -> List[Dict[str, Optional[str]]]:
+    """Reads the students CSV into one dict per student with the stdlib csv module.
+
+    Filters like parse_students, without loading pandas; empty cells are None.
+    """
+    with open(filepath, 'r', encoding='utf-8-sig', newline='') as f:
+        rows = [row for row in csv.reader(f, delimiter=';') if row]
+    if not rows:
+        raise ValueError(f"No columns to parse from {filepath}")
+    header = rows[0]
+    students = [{name: text_cell(row[pos]) if pos < len(row) else None for pos, name in enumerate(header)} for row in rows[1:]]
+    if 'Status' in header:
+        students = [student for student in students if student['Status'] in STUDENT_STATUSES]
+    return students
+
+def parse_grading_other(filepath: str | Path) -> 'pd.DataFrame':
     """Parses the *-other.csv which contains Overall and Solution Report scores/comments."""
+    import pandas as pd
     df = pd.read_csv(filepath, sep=',', dtype=str)
     # Convert 'Score' to float where possible
     df['Score'] = pd.to_numeric(df['Score'], errors='coerce')
@@ -21,8 +50,9 @@ def parse_grading_other(filepath: str | Path) -> pd.DataFrame:
         df['Notes'] = df['Notes'].fillna("")
     return df
 
-def parse_grading_tasks(filepath: str | Path) -> pd.DataFrame:
+def parse_grading_tasks(filepath: str | Path) -> 'pd.DataFrame':
     """Parses the *-tasks.csv which contains per-task grading points."""
+    import pandas as pd
     df = pd.read_csv(filepath, sep=',', dtype=str)
     # Convert all columns except 'Task' to floats
     for col in df.columns:
@@ -30,46 +60,173 @@ def parse_grading_tasks(filepath: str | Path) -> pd.DataFrame:
             df[col] = pd.to_numeric(df[col], errors='coerce')
     return df
 
-def find_student_grading_files(base_dir: Path, username: str, firstname: str = "", lastname: str = "") -> Dict[str, Optional[Path]]:
-    """Tries to find the grading files for a specific student username or name."""
-    
-    # Standard format: {username}-...
-    other_file = base_dir / f"{username}-other.csv"
-    tasks_file = base_dir / f"{username}-tasks.csv"
-    text_file = base_dir / f"{username}.txt"
-    
-    if other_file.exists() or tasks_file.exists() or text_file.exists():
-        return {
-            'other': other_file if other_file.exists() else None,
-            'tasks': tasks_file if tasks_file.exists() else None,
-            'text': text_file if text_file.exists() else None
+# Suffixes of the AI format files, checked in this order when classifying a filename
+AI_FILE_SUFFIXES = (('other', '-other.csv'), ('tasks', '-tasks.csv'), ('text', '.txt'))
+
+def name_stem(firstname: str, lastname: str) -> str:
+    """Returns the normalized {LastName}-{FirstName} stem of a student's AI format files."""
+    return unidecode(f"{lastname}-{firstname}").lower()
+
+class DirectoryIndex:
+    """Snapshot of an input directory, built with a single scandir per run.
+
+    Every filename is transliterated once. Files in the {LastName}-{FirstName} format
+    are grouped by their normalized stem, and each '-'-delimited prefix of a stem lists
+    the stems it starts, so a student's files are found with dictionary lookups (linear
+    in the length of the name) instead of rescanning the directory.
+    """
+
+    def __init__(self, base_dir: str | Path):
+        self.base_dir = Path(base_dir)
+        self.files: Dict[str, Path] = {}
+        self.by_stem: Dict[str, Dict[str, List[Path]]] = {}
+        self.by_prefix: Dict[str, List[str]] = {}
+
+        with os.scandir(self.base_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                path = Path(entry.path)
+                self.files[entry.name] = path
+
+                fname_lower = unidecode(entry.name).lower()
+                for kind, suffix in AI_FILE_SUFFIXES:
+                    if fname_lower.endswith(suffix):
+                        stem = fname_lower[:-len(suffix)]
+                        kinds = self.by_stem.get(stem)
+                        if kinds is None:
+                            kinds = self.by_stem[stem] = {}
+                            for prefix in _name_prefixes(stem):
+                                self.by_prefix.setdefault(prefix, []).append(stem)
+                        # Several names can transliterate to the same stem (Müller, Muller)
+                        kinds.setdefault(kind, []).append(path)
+                        break
+        emit('directory_scanned', path=str(self.base_dir), files=len(self.files))
+
+    def get(self, filename: str) -> Optional[Path]:
+        """Returns the path of a file directly inside the indexed directory, if present."""
+        return self.files.get(filename)
+
+    def match_name(self, stem: str, reserved: Collection[str] = ()) -> Dict[str, List[Path]]:
+        """Returns the candidate files per kind for a normalized name stem (see name_stem).
+
+        A file named exactly after the stem wins. Otherwise every file whose stem continues
+        it ('{stem}-...') is a candidate, unless that longer stem is in reserved, e.g. the
+        exact name of another student. Several candidates for a kind make the match ambiguous.
+        """
+        exact = self.by_stem.get(stem, {})
+        longer = [other for other in self.by_prefix.get(stem, ()) if other != stem and other not in reserved]
+        candidates = {}
+        for kind, _ in AI_FILE_SUFFIXES:
+            paths = exact.get(kind) or [path for other in longer for path in self.by_stem[other].get(kind, ())]
+            if paths:
+                candidates[kind] = sorted(paths)
+        return candidates
+
+    def find(self, username: str, firstname: str = "", lastname: str = "", reserved: Collection[str] = (), ambiguous: Optional[Dict[str, List[Path]]] = None) -> Dict[str, Optional[Path]]:
+        """Looks up the grading files for a student by username, falling back to the name.
+
+        A name matching several files of one kind (see match_name) gets none of them rather
+        than an arbitrary one; pass a dict as ambiguous to receive those candidates per kind.
+        """
+        found = {
+            'other': self.get(f"{username}-other.csv"),
+            'tasks': self.get(f"{username}-tasks.csv"),
+            'text': self.get(f"{username}.txt")
         }
-        
-    # AI format: {LastName}-{FirstName}-...
-    if firstname and lastname:
-        # Some special character replacements might happen, so case-insensitive matching is safer
-        name_prefix = unidecode(f"{lastname}-{firstname}").lower()
-        
-        for file in base_dir.iterdir():
-            if not file.is_file():
-                continue
-                
-            fname_lower = unidecode(file.name).lower()
-            if fname_lower.startswith(name_prefix):
-                if fname_lower.endswith('-other.csv'):
-                    other_file = file
-                elif fname_lower.endswith('-tasks.csv'):
-                    tasks_file = file
-                elif fname_lower.endswith('.txt'):
-                    text_file = file
-                    
-    return {
-        'other': other_file if other_file.exists() and other_file.is_file() else None,
-        'tasks': tasks_file if tasks_file.exists() and tasks_file.is_file() else None,
-        'text': text_file if text_file.exists() and text_file.is_file() else None
-    }
+        if any(found.values()):
+            return found
+
+        if firstname and lastname:
+            for kind, paths in self.match_name(name_stem(firstname, lastname), reserved).items():
+                if len(paths) == 1:
+                    found[kind] = paths[0]
+                elif ambiguous is not None:
+                    ambiguous[kind] = paths
+        return found
+
+def _name_prefixes(stem: str) -> List[str]:
+    """Returns all prefixes of a stem that end at a '-' or at the end of the stem."""
+    prefixes = [stem[:pos] for pos, char in enumerate(stem) if char == '-' and pos > 0]
+    prefixes.append(stem)
+    return prefixes
+
+def find_student_grading_files(base_dir: Path, username: str, firstname: str = "", lastname: str = "", index: Optional[DirectoryIndex] = None) -> Dict[str, Optional[Path]]:
+    """Tries to find the grading files for a specific student username or name.
+
+    Pass a prebuilt DirectoryIndex when resolving many students to avoid rescanning base_dir.
+    """
+    if index is None:
+        index = DirectoryIndex(base_dir)
+    return index.find(username, firstname, lastname)
 
 def parse_grading_text(filepath: str | Path) -> str:
     """Parses a text file and returns its content as a single string."""
     with open(filepath, 'r', encoding='utf-8') as f:
         return f.read()
+
+def read_grading_other(filepath: str | Path) -> OtherRows:
+    """Reads a *-other.csv into compact OtherRows with the stdlib csv module.
+
+    Gives the same values as parse_grading_other without building a DataFrame, which
+    dominates the cost for files of a few dozen rows.
+    """
+    return OtherRows.from_csv(filepath)
+
+def read_grading_tasks(filepath: str | Path) -> TaskRows:
+    """Reads a *-tasks.csv into compact TaskRows with the stdlib csv module (see read_grading_other)."""
+    return TaskRows.from_csv(filepath)
+
+FILE_PARSERS = {'other': read_grading_other, 'tasks': read_grading_tasks, 'text': parse_grading_text}
+
+class TextPrefetcher:
+    """Reads raw evaluation texts in a small thread pool, e.g. while the CSVs are parsed.
+
+    File reads release the GIL, so on network filesystems the per-file latency overlaps
+    with parsing instead of adding up; at most `threads` files are read at a time.
+    Results are taken with result(), which emits the 'file_parsed' event.
+    """
+
+    def __init__(self, files: Dict[str, Path], threads: int = 8):
+        self.files = files
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='text-prefetch')
+        self._futures = {key: self._executor.submit(self._read, filepath) for key, filepath in files.items()}
+
+    @staticmethod
+    def _read(filepath: Path):
+        start = time.perf_counter()
+        text = parse_grading_text(filepath)
+        return text, time.perf_counter() - start
+
+    def result(self, key: str) -> str:
+        """Returns the text read for key, raising the error if reading it failed."""
+        text, seconds = self._futures.pop(key).result()
+        emit('file_parsed', kind='text', path=str(self.files[key]), seconds=seconds, size=len(text))
+        return text
+
+    def close(self):
+        """Stops the threads, dropping texts that were not taken."""
+        self._executor.shutdown(cancel_futures=True)
+
+    def __enter__(self) -> 'TextPrefetcher':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def parse_student_files(found_files: Dict[str, Optional[Path]]) -> Dict[str, Any]:
+    """Parses whichever of a student's grading files were found; missing files map to None.
+    
+    CSVs are read into OtherRows / TaskRows (see records.py), text files into a string.
+    
+    Emits a 'file_parsed' event per file (kind, path, seconds, and rows or characters).
+    """
+    parsed = {'other': None, 'tasks': None, 'text': None}
+    for kind, parse in FILE_PARSERS.items():
+        filepath = found_files.get(kind)
+        if not filepath:
+            continue
+        start = time.perf_counter()
+        parsed[kind] = parse(filepath)
+        emit('file_parsed', kind=kind, path=str(filepath), seconds=time.perf_counter() - start, size=len(parsed[kind]))
+    return parsed
@@ -0,0 +1,373 @@
+import contextlib
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Set, Tuple
+from parser import parse_student_files, name_stem, DirectoryIndex, TextPrefetcher
+from records import TextFile
+from cache import ParseCache, split_cached
+from rubric import resolve_rubric
+from scheme import GradingScheme
+from instrumentation import emit, stage, collect_events, replay
+
+# The stages of a grading run: finding, parsing and collecting the grading files, and writing
+# the snapshot, exports and workbook. main.py runs them once; watch.py and serve.py (and
+# batch.py through main.run) rerun them on warm state. Kept out of main.py so those modules
+# never import the entry point itself. Like main.py, it imports pandas and xlsxwriter only
+# in the stages that use them.
+
+def discover_student_files(students: Iterable[Dict[str, Any]], index: DirectoryIndex, conflicts: Optional[Dict[str, Any]] = None) -> List[Tuple[str, Dict[str, Optional[Path]]]]:
+    """Resolves the grading files of every student in roster order; students without files get all None.
+    
+    students are roster rows as dicts, e.g. read_students() or parse_students().to_dict('records').
+    Files are matched by username first and then by name (see DirectoryIndex.match_name), where
+    a longer file name that is exactly another student's name is never taken. A name matching
+    several files of one kind, or a file matched by several students, is assigned to nobody:
+    a missing file is reported, a wrong one would grade the wrong student. These conflicts
+    are emitted as 'name_conflict' events and, if conflicts is given, stored in it as
+    {'ambiguous': {username: {kind: [paths]}}, 'shared': {path: [usernames]}}.
+    """
+    students = list(students)
+    roster_stems = {name_stem(student['First name'], student['Last name']) for student in students if student.get('First name') and student.get('Last name')}
+    ambiguous = {}
+    jobs = []
+    
+    for student in students:
+        username = student['Username']
+        firstname = student.get('First name', "")
+        lastname = student.get('Last name', "")
+        
+        candidates = {}
+        found_files = index.find(username, firstname, lastname, reserved=roster_stems, ambiguous=candidates)
+        if candidates:
+            ambiguous[username] = candidates
+        
+        other_file = found_files['other']
+        tasks_file = found_files['tasks']
+        text_file = found_files['text']
+        
+        # Override for the purely example files
+        if username == 'jakbrz': 
+            other_file = index.get("example-grading-other.csv") or other_file
+            tasks_file = index.get("example-grading-tasks.csv") or tasks_file
+            text_file = index.get("example-grading-text.txt") or text_file
+        
+        jobs.append((username, {'other': other_file, 'tasks': tasks_file, 'text': text_file}))
+    
+    # Students with the same (transliterated) name resolve to the same files. Every path is
+    # the index's single object for its file, so identity is used instead of hashing paths.
+    claims = {}
+    for username, found_files in jobs:
+        for path in found_files.values():
+            if path is not None:
+                claims.setdefault(id(path), (path, []))[1].append(username)
+    shared = {path: usernames for path, usernames in claims.values() if len(usernames) > 1}
+    shared_ids = {id(path) for path in shared}
+    for username, found_files in jobs:
+        for kind, path in found_files.items():
+            if id(path) in shared_ids:
+                found_files[kind] = None
+        if any(found_files.values()):
+            print(f"Found grading files for {username}")
+    
+    for username, candidates in ambiguous.items():
+        for kind, paths in candidates.items():
+            emit('name_conflict', conflict='ambiguous', username=username, kind=kind, paths=[str(path) for path in paths])
+    for path, usernames in shared.items():
+        emit('name_conflict', conflict='shared', path=str(path), usernames=usernames)
+    if conflicts is not None:
+        conflicts['ambiguous'] = ambiguous
+        conflicts['shared'] = shared
+    return jobs
+
+def report_name_conflicts(conflicts: Dict[str, Any]):
+    """Prints the conflicts collected by discover_student_files."""
+    for username, candidates in conflicts['ambiguous'].items():
+        for kind, paths in candidates.items():
+            print(f"Warning: {username}: name matches several {kind} files, none assigned: {', '.join(path.name for path in paths)}")
+    for path, usernames in conflicts['shared'].items():
+        print(f"Warning: {path.name} matches several students, assigned to none: {', '.join(usernames)}")
+
+def iter_parse_students(jobs: Iterable[Tuple[str, Dict[str, Optional[Path]]]], workers: int = 1) -> Iterator[Tuple[str, Optional[Dict[str, Any]], Optional[str]]]:
+    """Parses (username, found_files) jobs and yields (username, parsed data, error message) in job order.
+    
+    With workers > 1 the files are parsed in a process pool that keeps at most a few jobs per
+    worker in flight, so results never pile up faster than the consumer takes them. The
+    parser's events are forwarded from the workers, followed by a 'student_parsed' event.
+    """
+    if workers <= 1:
+        for username, found_files in jobs:
+            try:
+                data, events, seconds = collect_events(parse_student_files, found_files)
+            except Exception as e:
+                yield username, None, f"{type(e).__name__}: {e}"
+                continue
+            replay(events)
+            emit('student_parsed', username=username, seconds=seconds)
+            yield username, data, None
+        return
+    
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = iter(jobs)
+    # Spawned, not forked: the TextPrefetcher's threads are already running at this point,
+    # and forking a multi-threaded process can deadlock the children
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        in_flight = deque(
+            (username, executor.submit(collect_events, parse_student_files, found_files))
+            for username, found_files in islice(jobs, workers * 4)
+        )
+        while in_flight:
+            username, future = in_flight.popleft()
+            for next_username, found_files in islice(jobs, 1):
+                in_flight.append((next_username, executor.submit(collect_events, parse_student_files, found_files)))
+            try:
+                data, events, seconds = future.result()
+            except Exception as e:
+                yield username, None, f"{type(e).__name__}: {e}"
+                continue
+            replay(events)
+            emit('student_parsed', username=username, seconds=seconds)
+            yield username, data, None
+
+def parse_all_students(jobs: List[Tuple[str, Dict[str, Optional[Path]]]], workers: int = 1) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    """Parses the grading files of every (username, found_files) job, optionally in a process pool.
+    
+    Returns the parsed data and the error message for every student whose files could not be parsed.
+    """
+    results = {}
+    errors = {}
+    
+    for done, (username, data, error) in enumerate(iter_parse_students(jobs, workers), start=1):
+        if error is None:
+            results[username] = data
+        else:
+            errors[username] = error
+        if workers > 1 and (done % 100 == 0 or done == len(jobs)):
+            print(f"Parsed {done}/{len(jobs)} students...")
+    return results, errors
+
+def iter_streamed_records(students_df, jobs: List[Tuple[str, Dict[str, Optional[Path]]]], workers: int, errors: Dict[str, str], lazy_text: bool = False, scheme: Optional[GradingScheme] = None) -> Iterator[Dict[str, Any]]:
+    """Parses students one at a time and yields their write_student_sheet records in roster order.
+    
+    Nothing is retained once a record has been consumed; parse errors are collected in errors.
+    With lazy_text the texts are not parsed; the records hold TextFiles the writer streams.
+    """
+    text_files = {}
+    if lazy_text:
+        text_files = {username: found_files['text'] for username, found_files in jobs if found_files.get('text')}
+        jobs = [(username, {**found_files, 'text': None}) for username, found_files in jobs]
+    students = students_df[['First name', 'Last name']].itertuples(index=False)
+    parsed = iter_parse_students(jobs, workers)
+    for done, ((firstname, lastname), (username, data, error)) in enumerate(zip(students, parsed), start=1):
+        if error is not None:
+            errors[username] = error
+            data = {'other': None, 'tasks': None, 'text': None}
+        elif username in text_files:
+            data['text'] = TextFile(text_files[username])
+        if done % 100 == 0 or done == len(jobs):
+            print(f"Written {done}/{len(jobs)} student sheets...")
+        yield {
+            'username': username,
+            'first_name': firstname,
+            'last_name': lastname,
+            'tasks': data['tasks'],
+            'rubric': resolve_rubric(data['other'], scheme),
+            'text': data['text']
+        }
+
+def report_formula_mismatches(cell_refs: Dict[str, Dict[str, Any]]):
+    """Prints the formula mismatches found by write_excel(..., verify=True)."""
+    mismatches = [mismatch for refs in cell_refs.values() for mismatch in refs.get('mismatches', [])]
+    if mismatches:
+        print(f"Warning: {len(mismatches)} formula(s) disagree with their precomputed values:")
+        for mismatch in mismatches:
+            print(f"  {mismatch}")
+    else:
+        print("Verified: all formulas agree with their precomputed values.")
+
+def report_export_mismatches(table, cell_refs: Dict[str, Dict[str, Any]]):
+    """Prints the students whose --export results differ from the values written to their sheet.
+    
+    cell_refs is the write_excel(..., verify=True) result; students not written are skipped.
+    """
+    from excel_generator import GRADE_VALUES
+    mismatches = []
+    for username, *exported in table[['Username', *GRADE_VALUES]].itertuples(index=False):
+        written = cell_refs.get(username, {}).get('values')
+        if written is None:
+            continue
+        mismatches += [f"{username}: {name} exported as {value!r}, workbook shows {written[name]!r}" for name, value in zip(GRADE_VALUES, exported) if value != written[name]]
+    if mismatches:
+        print(f"Warning: {len(mismatches)} exported value(s) disagree with the workbook:")
+        for mismatch in mismatches:
+            print(f"  {mismatch}")
+    else:
+        print("Verified: the export agrees with the workbook for every student.")
+
+def report_parse_errors(errors: Dict[str, str]):
+    """Prints the students whose grading files could not be parsed."""
+    if errors:
+        print(f"Warning: Could not parse the grading files of {len(errors)} student(s):")
+        for username, message in errors.items():
+            print(f"  {username}: {message}")
+
+def load_student_data(jobs: List[Tuple[str, Dict[str, Optional[Path]]]], workers: int = 1, cache: Optional[ParseCache] = None, io_threads: int = 0, lazy_text: bool = False) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    """Parses the grading files of every job, taking unchanged files from the parse cache if one is given.
+    
+    Returns {username: {'other', 'tasks', 'text'}} in job order for students with grading
+    files, plus the error message of every student whose files could not be parsed.
+    New parse results are put into the cache; saving it is up to the caller.
+    
+    With io_threads, the texts are read by a TextPrefetcher while the CSVs are parsed; with
+    lazy_text they are not read at all and 'text' is a TextFile for the writer to stream.
+    """
+    with stage('cache_lookup'):
+        # Only files without a valid cache entry are handed to the parser
+        cached_data = {}
+        pending = {}
+        fingerprints = {}
+        for username, found_files in jobs:
+            if not any(found_files.values()):
+                continue
+            cached_data[username], pending[username], fingerprints[username] = split_cached(cache, found_files)
+        text_files = {}
+        if lazy_text or io_threads > 0:
+            text_files = {username: to_parse['text'] for username, to_parse in pending.items() if 'text' in to_parse}
+        parse_jobs = []
+        for username, to_parse in pending.items():
+            to_parse = {kind: filepath for kind, filepath in to_parse.items() if not (kind == 'text' and username in text_files)}
+            if to_parse:
+                parse_jobs.append((username, to_parse))
+    
+    if cache is not None:
+        print(f"Parse cache: {cache.hits} file(s) unchanged, {cache.misses} to parse.")
+    
+    # Started before the CSV parsing so that both overlap
+    prefetcher = TextPrefetcher(text_files, io_threads) if text_files and not lazy_text else contextlib.nullcontext()
+    with prefetcher:
+        with stage('parse'):
+            parsed, errors = parse_all_students(parse_jobs, workers)
+        
+        # Assemble in roster order so the output does not depend on worker scheduling
+        student_data = {}
+        with stage('assemble'):
+            for username in pending:
+                if username in errors:
+                    continue
+                data = {'other': None, 'tasks': None, 'text': None}
+                data.update(cached_data[username])
+                try:
+                    for kind, filepath in pending[username].items():
+                        if kind == 'text' and username in text_files:
+                            data[kind] = TextFile(filepath) if lazy_text else prefetcher.result(username)
+                        else:
+                            data[kind] = parsed[username][kind]
+                except Exception as e:
+                    errors[username] = f"{type(e).__name__}: {e}"
+                    continue
+                if cache is not None:
+                    for kind, filepath in pending[username].items():
+                        # A TextFile is only a reference, so it is never cached
+                        if not isinstance(data[kind], TextFile):
+                            cache.put(filepath, fingerprints[username][kind], data[kind])
+                student_data[username] = data
+    return student_data, errors
+
+def collect_grading(student_data: Dict[str, Dict[str, Any]], scheme: Optional[GradingScheme] = None) -> Dict[str, Dict[str, Any]]:
+    """Sorts parsed student data into the {'tasks', 'other', 'texts', 'rubrics'} dicts the writers take."""
+    grading = {'tasks': {}, 'other': {}, 'texts': {}, 'rubrics': {}}
+    for username, data in student_data.items():
+        update_grading(grading, username, data, scheme)
+    return grading
+
+def update_grading(grading: Dict[str, Dict[str, Any]], username: str, data: Optional[Dict[str, Any]], scheme: Optional[GradingScheme] = None):
+    """Replaces a student's entries in a collect_grading result; data None removes them."""
+    for entries in grading.values():
+        entries.pop(username, None)
+    if data is None:
+        return
+    if data['other'] is not None:
+        grading['other'][username] = data['other']
+        grading['rubrics'][username] = resolve_rubric(data['other'], scheme)
+    if data['tasks'] is not None:
+        grading['tasks'][username] = data['tasks']
+    if data['text'] is not None:
+        grading['texts'][username] = data['text']
+
+def import_grader_overrides(args, input_dir: Path, student_data: Dict[str, Dict[str, Any]], grading: Dict[str, Dict[str, Any]], files: Dict[str, Dict[str, Optional[Path]]], scheme: Optional[GradingScheme] = None):
+    """Takes the scores graders changed in the --import-overrides workbook over into the parsed data.
+    
+    Scores changed both in the workbook and in the grading files since it was written are
+    reported as conflicts and keep their grading files' values. With --write-back the changes are also written into the students' grading files.
+    student_data and grading are updated in place.
+    """
+    from overrides import read_workbook_scores, find_overrides, report_overrides, apply_overrides, write_back
+    from excel_generator import sheet_task_scores
+    
+    source = Path(args.import_overrides)
+    if not source.exists():
+        print(f"No workbook at {source}; no grader overrides imported.")
+        return
+    task_counts = {username: len(sheet_task_scores(grading['tasks'].get(username), scheme)) for username in files}
+    with stage('import_overrides'):
+        overrides, conflicts = find_overrides(read_workbook_scores(source, task_counts, scheme), grading, scheme)
+    report_overrides(overrides, source, scheme, conflicts)
+    if args.write_back and overrides:
+        with stage('write_back'):
+            written, errors = write_back(files, overrides, input_dir, scheme)
+        print(f"Wrote the changed scores back to {len(written)} grading file(s).")
+        for username, message in errors.items():
+            print(f"Error: Cannot write the changed scores of {username} back: {message}")
+    for username, data in apply_overrides(student_data, overrides, scheme).items():
+        student_data[username] = data
+        update_grading(grading, username, data, scheme)
+
+def write_report(args, students_df, grading: Dict[str, Dict[str, Any]], changed: Optional[Set[str]] = None, scheme: Optional[GradingScheme] = None, files: Optional[Dict[str, Dict[str, Optional[Path]]]] = None):
+    """Writes the run snapshot, the --export files and the workbook (or the shards and their index) for the parsed grading data.
+    
+    files are the discovered grading files per username, whose hashes go into the snapshot.
+    With shards, changed limits the rewrite to the shards holding those students.
+    """
+    if not args.no_snapshot:
+        from snapshot import build_snapshot, load_snapshot, save_snapshot, default_snapshot_path
+        snapshot_path = default_snapshot_path(args.output)
+        with stage('snapshot'):
+            try:
+                previous = load_snapshot(snapshot_path)
+            except (OSError, ValueError):
+                previous = None
+            save_snapshot(build_snapshot(students_df, grading, files or {}, scheme, previous, rehash=args.hash_inputs), snapshot_path)
+        print(f"Snapshot saved to {snapshot_path}.")
+    table = None
+    if args.export:
+        from export import export_cohort
+        with stage('export'):
+            table = export_cohort(args.export, students_df, grading['tasks'], grading['other'], grading['rubrics'], scheme)
+        print(f"Exported {len(table)} students to {', '.join(args.export)}.")
+    if args.no_workbook:
+        return
+    
+    from excel_generator import write_excel, write_excel_sharded
+    
+    output_path = args.output
+    if args.shards is not None or args.shard_by is not None:
+        print(f"Finished parsing. Building sharded workbooks with index at {output_path}...")
+        with stage('write'):
+            shard_refs = write_excel_sharded(output_path, students_df, grading['tasks'], grading['other'], grading['texts'], grading['rubrics'], shards=args.shards, shard_by=args.shard_by, workers=args.workers, verify=args.verify_formulas, changed=changed, scheme=scheme, appendix=args.appendix, appendix_chunk=args.appendix_chunk, layout=args.layout)
+        print(f"Wrote {len(shard_refs)} shard workbook(s).")
+        if args.verify_formulas:
+            cell_refs = {username: refs for cell_refs in shard_refs.values() for username, refs in cell_refs.items()}
+            report_formula_mismatches(cell_refs)
+            if table is not None:
+                report_export_mismatches(table, cell_refs)
+        return
+    
+    print(f"Finished parsing. Building Excel workbook at {output_path}...")
+    with stage('write'):
+        cell_refs = write_excel(output_path, students_df, grading['tasks'], grading['other'], grading['texts'], grading['rubrics'], verify=args.verify_formulas, scheme=scheme, appendix=args.appendix, appendix_chunk=args.appendix_chunk, layout=args.layout)
+    if args.verify_formulas:
+        report_formula_mismatches(cell_refs)
+        if table is not None:
+            report_export_mismatches(table, cell_refs)
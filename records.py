@@ -0,0 +1,196 @@
+import csv
+import math
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Cells read_csv treats as missing by default; they parse as NaN scores and empty notes
+NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+])
+
+def to_float(value: Optional[str]) -> float:
+    """Converts a cell like pd.to_numeric(errors='coerce'): anything non-numeric becomes NaN.
+    
+    float() alone also accepts digit-group underscores ('1_0'), non-ASCII digits and padded
+    infinities (' inf'), which pandas reads as NaN; these are NaN here too, as is every
+    infinity, since no score can be one.
+    """
+    if value is None or value in NA_VALUES:
+        return math.nan
+    try:
+        number = float(value)
+    except ValueError:
+        return math.nan
+    if not math.isfinite(number) or '_' in value or not value.isascii():
+        return math.nan
+    return number
+
+def text_cell(value: Optional[str]) -> Optional[str]:
+    """Returns a text cell, or None where read_csv would have read NaN."""
+    return None if value is None or value in NA_VALUES else value
+
+def read_csv_rows(filepath) -> Tuple[List[str], List[List[str]]]:
+    """Reads a comma-separated file into (header, rows), skipping blank lines like read_csv."""
+    with open(filepath, 'r', encoding='utf-8-sig', newline='') as f:
+        rows = [row for row in csv.reader(f) if row]
+    if not rows:
+        raise ValueError(f"No columns to parse from {filepath}")
+    return rows[0], rows[1:]
+
+def _column(header: List[str], rows: List[List[str]], name: str) -> List[Optional[str]]:
+    # Missing columns and cells (short rows) read as None, like NaN in read_csv
+    if name not in header:
+        return [None] * len(rows)
+    pos = header.index(name)
+    return [text_cell(row[pos]) if pos < len(row) else None for row in rows]
+
+class OtherRows:
+    """Rows of a parsed *-other.csv, stored column-wise.
+
+    category and item are None where the cell was empty, score is NaN where it was not
+    numeric and notes is None if the file has no Notes column (missing notes are "").
+    """
+
+    __slots__ = ('category', 'item', 'score', 'notes')
+
+    def __init__(self, category: List[Optional[str]], item: List[Optional[str]], score: array, notes: Optional[List[str]] = None):
+        self.category = category
+        self.item = item
+        self.score = score
+        self.notes = notes
+
+    @classmethod
+    def from_csv(cls, filepath) -> 'OtherRows':
+        header, rows = read_csv_rows(filepath)
+        if 'Score' not in header:
+            raise ValueError(f"{filepath} has no Score column")
+        score = array('d', (to_float(value) for value in _column(header, rows, 'Score')))
+        notes = [value or "" for value in _column(header, rows, 'Notes')] if 'Notes' in header else None
+        return cls(_column(header, rows, 'Category'), _column(header, rows, 'Item'), score, notes)
+
+    @classmethod
+    def from_frame(cls, df: 'pd.DataFrame') -> 'OtherRows':
+        notes = df['Notes'].tolist() if 'Notes' in df.columns else None
+        return cls(df['Category'].tolist(), df['Item'].tolist(), array('d', df['Score'].astype(float)), notes)
+
+    def __len__(self) -> int:
+        return len(self.score)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.score) == 0
+
+    def to_frame(self) -> 'pd.DataFrame':
+        """Returns the rows as the DataFrame parse_grading_other would have produced."""
+        import pandas as pd
+        data = {'Category': self.category, 'Item': self.item, 'Score': list(self.score)}
+        if self.notes is not None:
+            data['Notes'] = self.notes
+        return pd.DataFrame(data)
+
+class TaskRows:
+    """Rows of a parsed *-tasks.csv: the task names plus one float array per score column."""
+
+    __slots__ = ('task', 'columns')
+
+    def __init__(self, task: List[Optional[str]], columns: Dict[str, array]):
+        self.task = task
+        self.columns = columns
+
+    @classmethod
+    def from_csv(cls, filepath) -> 'TaskRows':
+        header, rows = read_csv_rows(filepath)
+        columns = {}
+        for pos, name in enumerate(header):
+            if name != 'Task' and name not in columns:
+                columns[name] = array('d', (to_float(row[pos]) if pos < len(row) else math.nan for row in rows))
+        return cls(_column(header, rows, 'Task'), columns)
+
+    @classmethod
+    def from_frame(cls, df: 'pd.DataFrame') -> 'TaskRows':
+        task = df['Task'].tolist() if 'Task' in df.columns else [None] * len(df)
+        return cls(task, {name: array('d', df[name].astype(float)) for name in df.columns if name != 'Task'})
+
+    def __len__(self) -> int:
+        return len(self.task)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.task) == 0
+
+    def column(self, name: str, default: float = 0.0) -> Iterable[float]:
+        """Returns a score column; a column missing from the file reads as default in every row."""
+        values = self.columns.get(name)
+        return values if values is not None else [default] * len(self.task)
+
+    def to_frame(self) -> 'pd.DataFrame':
+        """Returns the rows as the DataFrame parse_grading_tasks would have produced."""
+        import pandas as pd
+        return pd.DataFrame({'Task': self.task, **{name: list(values) for name, values in self.columns.items()}})
+
+class TextFile:
+    """A raw evaluation text that stays on disk and is read line by line when it is written.
+
+    Used instead of the text itself with --lazy-text, so large appendices are never held
+    in memory as a whole.
+    """
+
+    __slots__ = ('path',)
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+
+    def lines(self) -> Iterator[str]:
+        """Yields the lines of the file exactly like str.splitlines() on its content."""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                # Besides newlines, splitlines() also breaks at form feeds and the like
+                yield from line.splitlines()
+
+def text_lines(text) -> Iterable[str]:
+    """Returns the lines of a parsed text, whether it is a string or a TextFile."""
+    return text.lines() if isinstance(text, TextFile) else text.splitlines()
+
+def as_frame(rows) -> Optional['pd.DataFrame']:
+    """Returns parsed grading rows as a DataFrame; DataFrames and None pass through."""
+    if isinstance(rows, (OtherRows, TaskRows)):
+        return rows.to_frame()
+    return rows
+
+def stack_other(all_other: Dict[str, Any]) -> 'pd.DataFrame':
+    """Stacks many students' *-other.csv rows into one DataFrame (Username, Category, Item, Score).
+
+    Built straight from the row records, which is much cheaper than concatenating thousands
+    of tiny DataFrames. DataFrame values are accepted as well.
+    """
+    import pandas as pd
+    usernames, category, item, score = [], [], [], []
+    for username, rows in all_other.items():
+        if not isinstance(rows, OtherRows):
+            rows = OtherRows.from_frame(rows)
+        usernames.extend([username] * len(rows))
+        category.extend(rows.category)
+        item.extend(rows.item)
+        score.extend(rows.score)
+    return pd.DataFrame({'Username': usernames, 'Category': category, 'Item': item, 'Score': score})
+
+def stack_tasks(all_tasks: Dict[str, Any], columns: List[str]) -> 'pd.DataFrame':
+    """Stacks score columns of many students' *-tasks.csv rows into one DataFrame with a Username column.
+
+    Columns missing from a file are NaN. DataFrame values are accepted as well.
+    """
+    import pandas as pd
+    usernames = []
+    data = {name: [] for name in columns}
+    for username, rows in all_tasks.items():
+        if not isinstance(rows, TaskRows):
+            rows = TaskRows.from_frame(rows)
+        usernames.extend([username] * len(rows))
+        for name in columns:
+            data[name].extend(rows.column(name, math.nan))
+    return pd.DataFrame({'Username': usernames, **data})
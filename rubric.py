@@ -0,0 +1,49 @@
+from typing import Dict, NamedTuple, Optional
+
+from records import OtherRows
+from scheme import GradingScheme, default_scheme
+
+# The built-in grading scheme (see scheme.py); a run may compile another one with --scheme.
+# These names keep referring to the built-in scheme for code that does not take a scheme.
+_DEFAULT = default_scheme()
+FORMALITIES = _DEFAULT.formalities
+SOLUTION_REPORT = _DEFAULT.solution_report
+PRACTICAL_TASK = _DEFAULT.practical_task
+SECTION_WEIGHTS = _DEFAULT.section_weights
+RUBRIC_ITEMS = _DEFAULT.rubric_items
+RUBRIC_KEYS = _DEFAULT.rubric_keys
+
+class RubricScore(NamedTuple):
+    """Score (NaN if the cell was not numeric) and notes of a matched *-other.csv row."""
+    score: float
+    notes: str
+
+def match_rubric_item(category: str, item: str, scheme: Optional[GradingScheme] = None) -> Optional[str]:
+    """Returns the key of the first rubric item a (Category, Item) row belongs to, if any.
+
+    This is the only place the matching rule lives (see GradingScheme.match_item); results
+    are cached per scheme, so each distinct pair seen in a cohort is matched once.
+    """
+    return (scheme or _DEFAULT).match_item(category, item)
+
+def resolve_rubric(other_df, scheme: Optional[GradingScheme] = None) -> Dict[str, RubricScore]:
+    """Normalizes a parsed *-other.csv (OtherRows or DataFrame) into {rubric key: RubricScore}.
+
+    The first row matching an item wins; items without a matching row are absent.
+    """
+    resolved = {}
+    if other_df is None or other_df.empty:
+        return resolved
+    if not isinstance(other_df, OtherRows):
+        other_df = OtherRows.from_frame(other_df)
+    notes = other_df.notes if other_df.notes is not None else [""] * len(other_df)
+    for category, item, score, note in zip(other_df.category, other_df.item, other_df.score, notes):
+        key = match_rubric_item(category, item, scheme)
+        if key is not None and key not in resolved:
+            resolved[key] = RubricScore(float(score), str(note))
+    return resolved
+
+def rubric_score(rubric: Dict[str, RubricScore], key: str, default: float = 0.0) -> float:
+    """Returns the raw score of a rubric item, or default if no row matched it."""
+    entry = rubric.get(key)
+    return entry.score if entry is not None else default
@@ -0,0 +1,248 @@
+import json
+import math
+import operator
+import re
+from bisect import bisect_right
+from functools import reduce
+from pathlib import Path
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+# The grading scheme as plain data, in the shape of a scheme file (see grading-scheme.toml).
+# Rubric items graded in *-other.csv are identified by 'category' and 'item': the category
+# must match exactly and 'item' is searched case-insensitively in the Item column. Solution
+# Report items also name the *-tasks.csv column used when a student has no *-other.csv.
+
+def _dimension(key: str, name: str, label: str, weight: float, task_prefix: str) -> Dict[str, Any]:
+    return {'key': key, 'dim': name, 'label': label, 'weight': weight, 'sub': [
+        {'key': f"{key}_corr", 'label': 'Correctness', 'category': 'Solution Report', 'item': f"{name} - Correctness", 'max': 2.0, 'weight': 0.5, 'task_column': f"{task_prefix}Correct"},
+        {'key': f"{key}_conv", 'label': 'Convincingness', 'category': 'Solution Report', 'item': f"{name} - Convincingness", 'max': 2.0, 'weight': 0.35, 'task_column': f"{task_prefix}Convincing"},
+        {'key': f"{key}_ref", 'label': 'References', 'category': 'Solution Report', 'item': f"{name} - References", 'max': 1.0, 'weight': 0.15, 'task_column': f"{task_prefix}References"},
+    ]}
+
+DEFAULT_DEFINITION = {
+    'name': 'ISBPM',
+    # Share of each section in the total percentage
+    'sections': {'formalities': 0.2, 'solution_report': 0.4, 'practical_tasks': 0.4},
+    'formalities': [
+        {'key': 'formatting', 'label': 'Formatting', 'category': 'Overall', 'item': 'Formatting', 'max': 2.0, 'weight': 0.3},
+        {'key': 'structure', 'label': 'Structure', 'category': 'Overall', 'item': 'Structure', 'max': 2.0, 'weight': 0.5},
+        {'key': 'style', 'label': 'Style/Language', 'category': 'Overall', 'item': 'Style/Language', 'max': 2.0, 'weight': 0.2},
+    ],
+    'solution_report': [
+        _dimension('approach', 'Approach', 'Approach', 0.5, 'approach'),
+        _dimension('sit', 'Context & Situationality', 'Context &\nSituationality', 0.25, 'situationality'),
+        _dimension('imp', 'Implications', 'Implications', 0.25, 'implications'),
+    ],
+    # Every row of *-tasks.csv is scored on correctness and detail; a task's percentage is the
+    # weighted sum of both and the section averages all tasks.
+    'practical_task': {
+        'correct_column': 'practicalTaskCorrect', 'correct_max': 2.0, 'correct_weight': 0.65,
+        'details_column': 'practicalTaskDetails', 'details_max': 1.0, 'details_weight': 0.35,
+    },
+    # (lowest percentage, grade), ascending; the first bound must be 0
+    'grade_scale': [
+        [0.00, "5.0"], [0.50, "4.0"], [0.55, "3.7"], [0.60, "3.3"], [0.65, "3.0"], [0.70, "2.7"],
+        [0.75, "2.3"], [0.80, "2.0"], [0.85, "1.7"], [0.90, "1.3"], [0.95, "1.0"],
+    ],
+}
+
+SECTIONS = ('formalities', 'solution_report', 'practical_tasks')
+# Order of the terms of the total, in the Python evaluators as in the sheet formula
+TOTAL_ORDER = ('formalities', 'practical_tasks', 'solution_report')
+
+def _check_weights(items: List[Dict[str, Any]], where: str):
+    total = sum(item['weight'] for item in items)
+    if not math.isclose(total, 1.0, abs_tol=1e-9):
+        raise ValueError(f"Weights of {where} add up to {total:g}, not 1")
+
+def _item(entry: Dict[str, Any], where: str, fields: Tuple[str, ...]) -> Dict[str, Any]:
+    missing = [field for field in fields if field not in entry]
+    if missing:
+        raise ValueError(f"{where} is missing {', '.join(missing)}")
+    item = dict(entry)
+    item['max'] = float(item['max'])
+    item['weight'] = float(item['weight'])
+    if item['max'] <= 0:
+        raise ValueError(f"{where}: max must be positive")
+    return item
+
+class GradingScheme:
+    """A grading scheme compiled once from its definition.
+
+    Keeps the rubric structures (formalities, solution_report, practical_task,
+    section_weights, grade_scale) and compiles them into term lists. The Python evaluators
+    and the Excel formula templates below are both generated from these terms, so the
+    calculator, the sheet formulas and their cached values cannot drift apart. Evaluators
+    take plain floats as well as pandas Series, which makes them vectorized for free.
+    """
+
+    def __init__(self, definition: Dict[str, Any]):
+        self.definition = definition
+        self.name = str(definition.get('name', ''))
+
+        sections = definition['sections']
+        if set(sections) != set(SECTIONS):
+            raise ValueError(f"sections must have exactly the weights {', '.join(SECTIONS)}")
+        self.section_weights = {section: float(sections[section]) for section in sections}
+        _check_weights([{'weight': weight} for weight in self.section_weights.values()], "sections")
+
+        self.formalities = [_item(entry, f"formalities item {i + 1}", ('key', 'label', 'category', 'item', 'max', 'weight')) for i, entry in enumerate(definition['formalities'])]
+        _check_weights(self.formalities, "formalities")
+
+        self.solution_report = []
+        for i, dim in enumerate(definition['solution_report']):
+            missing = [field for field in ('key', 'dim', 'label', 'weight', 'sub') if field not in dim]
+            if missing:
+                raise ValueError(f"solution_report dimension {i + 1} is missing {', '.join(missing)}")
+            dim = {**dim, 'weight': float(dim['weight'])}
+            dim['sub'] = [_item(sub, f"solution_report item {dim['key']}.{j + 1}", ('key', 'label', 'category', 'item', 'max', 'weight')) for j, sub in enumerate(dim['sub'])]
+            _check_weights(dim['sub'], f"solution_report dimension {dim['key']}")
+            self.solution_report.append(dim)
+        _check_weights(self.solution_report, "solution_report")
+
+        task = dict(definition['practical_task'])
+        for field in ('correct_max', 'correct_weight', 'details_max', 'details_weight'):
+            task[field] = float(task[field])
+        _check_weights([{'weight': task['correct_weight']}, {'weight': task['details_weight']}], "practical_task")
+        self.practical_task = task
+
+        self.grade_scale = [(float(bound), str(grade)) for bound, grade in definition['grade_scale']]
+        bounds = [bound for bound, _ in self.grade_scale]
+        if not bounds or bounds[0] != 0.0 or bounds != sorted(set(bounds)):
+            raise ValueError("grade_scale bounds must start at 0 and increase strictly")
+
+        self.rubric_items = self.formalities + [sub for dim in self.solution_report for sub in dim['sub']]
+        self.rubric_keys = [entry['key'] for entry in self.rubric_items]
+        if len(set(self.rubric_keys)) != len(self.rubric_keys):
+            raise ValueError("rubric item keys must be unique")
+
+        # Compiled terms: (key, max, weight) of ratio sums and (key, weight) of weighted sums
+        self.formalities_terms = [(entry['key'], entry['max'], entry['weight']) for entry in self.formalities]
+        self.dimension_terms = {dim['key']: [(sub['key'], sub['max'], sub['weight']) for sub in dim['sub']] for dim in self.solution_report}
+        self.dimension_weights = [(dim['key'], dim['weight']) for dim in self.solution_report]
+        self.dimension_task_columns = {dim['key']: [sub.get('task_column') for sub in dim['sub']] for dim in self.solution_report}
+        self.task_terms = [
+            (task['correct_column'], task['correct_max'], task['correct_weight']),
+            (task['details_column'], task['details_max'], task['details_weight']),
+        ]
+        self.total_terms = [(section, self.section_weights[section]) for section in TOTAL_ORDER]
+        self.task_score_columns = [task['correct_column'], task['details_column']] + [
+            column for columns in self.dimension_task_columns.values() for column in columns if column
+        ]
+        self.grade_bounds = bounds[1:]
+        self.grade_labels = [grade for _, grade in self.grade_scale]
+
+        self._patterns = [(entry['category'], re.compile(entry['item'], re.IGNORECASE), entry['key']) for entry in self.rubric_items]
+        self._matches: Dict[Tuple[Any, Any], Optional[str]] = {}
+
+    # --- Rubric matching ---
+
+    def match_item(self, category: str, item: str) -> Optional[str]:
+        """Returns the key of the first rubric item a (Category, Item) row belongs to, if any.
+
+        Results are cached, so each distinct pair seen in a cohort is matched once.
+        """
+        pair = (category, item)
+        if pair not in self._matches:
+            key = None
+            if isinstance(category, str) and isinstance(item, str):
+                key = next((key for cat, pattern, key in self._patterns if category == cat and pattern.search(item)), None)
+            self._matches[pair] = key
+        return self._matches[pair]
+
+    # --- Python evaluators (scalars or Series) ---
+
+    # Terms are added strictly left to right, as Excel and pandas do; the builtin sum() of
+    # floats compensates rounding errors since Python 3.12 and would drift from both.
+
+    @staticmethod
+    def ratio_sum(terms: List[Tuple[str, float, float]], value: Callable[[str], Any]):
+        """Sum of (value(key) / max) * weight over (key, max, weight) terms."""
+        return reduce(operator.add, ((value(key) / max_score) * weight for key, max_score, weight in terms))
+
+    @staticmethod
+    def weighted_sum(terms: List[Tuple[str, float]], value: Callable[[str], Any]):
+        """Sum of value(key) * weight over (key, weight) terms."""
+        return reduce(operator.add, (value(key) * weight for key, weight in terms))
+
+    def formalities_pct(self, score: Callable[[str], Any]):
+        """Formalities percentage from score(rubric key)."""
+        return self.ratio_sum(self.formalities_terms, score)
+
+    def dimension_pct(self, dim_key: str, score: Callable[[str], Any]):
+        """Percentage of one Solution Report dimension from score(rubric key)."""
+        return self.ratio_sum(self.dimension_terms[dim_key], score)
+
+    def solution_report_pct(self, dim_pct: Callable[[str], Any]):
+        """Solution Report percentage from dim_pct(dimension key)."""
+        return self.weighted_sum(self.dimension_weights, dim_pct)
+
+    def task_pct(self, correct, details):
+        """Percentage of a practical task from its correctness and detail scores."""
+        (_, correct_max, correct_weight), (_, details_max, details_weight) = self.task_terms
+        return (correct / correct_max) * correct_weight + (details / details_max) * details_weight
+
+    def total_pct(self, formalities_pct, practical_tasks_pct, solution_report_pct):
+        """Weights the three section percentages into the total percentage."""
+        pcts = {'formalities': formalities_pct, 'practical_tasks': practical_tasks_pct, 'solution_report': solution_report_pct}
+        return self.weighted_sum(self.total_terms, pcts.__getitem__)
+
+    def grade(self, percentage: float) -> str:
+        """Maps a percentage (0.0 to 1.0) to its grade; NaN and values below 0 get the lowest grade."""
+        if math.isnan(percentage):
+            return self.grade_labels[0]
+        return self.grade_labels[bisect_right(self.grade_bounds, percentage)]
+
+    # --- Excel formula templates ---
+
+    @staticmethod
+    def ratio_sum_formula(terms: List[Tuple[str, float, float]], cells: Callable[[str], Tuple[str, str]]) -> str:
+        """SUM formula of ratio terms; cells(key) gives the (score, max) cells of a term."""
+        return "SUM(" + ",".join(f"(({cells(key)[0]}/{cells(key)[1]})*{weight})" for key, _, weight in terms) + ")"
+
+    @staticmethod
+    def weighted_sum_formula(terms: List[Tuple[str, float]], cell: Callable[[str], str]) -> str:
+        """SUM formula of weighted terms; cell(key) gives the cell of a term."""
+        return "SUM(" + ",".join(f"({cell(key)}*{weight})" for key, weight in terms) + ")"
+
+    def task_formula(self, cells: Callable[[str], Tuple[str, str]]) -> str:
+        """Formula of a task percentage; cells(column) gives the (score, max) cells of a score column."""
+        return "+".join(f"(({cells(column)[0]}/{cells(column)[1]})*{weight})" for column, _, weight in self.task_terms)
+
+    def total_formula(self, cell: Callable[[str], str]) -> str:
+        """Formula of the total percentage; cell(section) gives the cell of a section percentage."""
+        return " + ".join(f"{cell(section)}*{weight}" for section, weight in self.total_terms)
+
+    def mapping_range(self, sheet_name: str = 'GradeMapping') -> str:
+        """Range of the grade scale written by excel_generator.setup_grade_mapping_sheet."""
+        return f"'{sheet_name}'!$A$1:$B${len(self.grade_scale)}"
+
+_default: Optional[GradingScheme] = None
+
+def default_scheme() -> GradingScheme:
+    """Returns the built-in scheme, compiled on first use."""
+    global _default
+    if _default is None:
+        _default = GradingScheme(DEFAULT_DEFINITION)
+    return _default
+
+def load_scheme(path: str | Path) -> GradingScheme:
+    """Loads and compiles a scheme file (.toml or .json).
+
+    Top-level entries missing from the file are taken from the built-in scheme, so a file
+    may e.g. only change the grade_scale. Invalid schemes raise ValueError.
+    """
+    path = Path(path)
+    if path.suffix.lower() == '.toml':
+        import tomllib
+        with open(path, 'rb') as f:
+            definition = tomllib.load(f)
+    elif path.suffix.lower() == '.json':
+        with open(path, 'r', encoding='utf-8') as f:
+            definition = json.load(f)
+    else:
+        raise ValueError(f"Unsupported scheme file: {path} (use .toml or .json)")
+    try:
+        return GradingScheme({**DEFAULT_DEFINITION, **definition})
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid grading scheme {path}: {type(e).__name__}: {e}") from e
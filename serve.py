@@ -0,0 +1,202 @@
+import json
+import os
+import signal
+import socketserver
+import statistics
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from instrumentation import stage
+from watch import WarmState, changed_files, snapshot_directory
+
+# A small local API over the warm state of a run (main.py --serve). Requests are handled one
+# at a time, so they never see a half-updated state. Every request first rescans the input
+# directory and re-parses the students whose files changed, so answers are always current:
+#
+#   GET  /students/<username>  sub-totals, total and grade of one student
+#   GET  /summary              cohort size, grade distribution and total percentages
+#   POST /regenerate           writes the output if inputs changed since the last write
+#                              (?force=1 writes it anyway)
+
+VALUE_COLUMNS = ('formalities_pct', 'practical_tasks_pct', 'solution_report_pct', 'total_pct')
+
+class GradingService:
+    """Answers the API requests from a WarmState and keeps the computed grades with it."""
+
+    def __init__(self, state: WarmState):
+        self.state = state
+        self._grades = None
+        # Students changed since the output was last written; None if everything must be rewritten
+        self._unwritten = set()
+        self.written_at = time.time()
+
+    def sync(self) -> Tuple[set, bool]:
+        """Applies the changes in the input directory since the last request.
+
+        Returns the affected usernames and whether the roster changed.
+        """
+        snapshot = snapshot_directory(self.state.input_dir)
+        changed_names = changed_files(self.state.snapshot, snapshot)
+        if not changed_names:
+            return set(), False
+        affected, roster_changed = self.state.apply(snapshot, changed_names)
+        if affected or roster_changed:
+            self._grades = None
+            if roster_changed or self._unwritten is None:
+                self._unwritten = None
+            else:
+                self._unwritten |= affected
+        return affected, roster_changed
+
+    def grades(self):
+        """The sheet_grades table of the roster (the values the workbook shows), recomputed after changes."""
+        if self._grades is None:
+            from excel_generator import sheet_grades
+            with stage('grades'):
+                state = self.state
+                self._grades = sheet_grades(state.students_df, state.grading['tasks'], state.grading['other'], state.grading['rubrics'], state.scheme)
+        return self._grades
+
+    def student(self, username: str) -> Optional[Dict[str, Any]]:
+        """Returns the results of a roster student, or None if the username is unknown."""
+        self.sync()
+        students_df = self.state.students_df
+        rows = students_df[students_df['Username'] == username]
+        if rows.empty:
+            return None
+        grades = self.grades()
+        values = grades.loc[[username]].iloc[0]
+        files = self.state.files.get(username, {})
+        return {
+            'username': username,
+            'first_name': rows['First name'].iloc[0],
+            'last_name': rows['Last name'].iloc[0],
+            **{name: float(values[name]) for name in VALUE_COLUMNS},
+            'german_grade': values['german_grade'],
+            'files': {kind: path.name if path is not None else None for kind, path in files.items()},
+            'error': self.state.errors.get(username)
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """Returns cohort-wide figures: students, graded students, grade counts and totals."""
+        self.sync()
+        grades = self.grades()
+        totals = grades['total_pct'].tolist()
+        return {
+            'students': len(grades),
+            'graded': sum(1 for files in self.state.files.values() if any(files.values())),
+            'parse_errors': len(self.state.errors),
+            'grades': dict(sorted(Counter(grades['german_grade']).items())),
+            'mean_total_pct': statistics.fmean(totals) if totals else None,
+            'median_total_pct': statistics.median(totals) if totals else None,
+            'output': str(self.state.args.output),
+            'written_at': self.written_at,
+            'pending_changes': self._unwritten is None or bool(self._unwritten)
+        }
+
+    def regenerate(self, force: bool = False) -> Dict[str, Any]:
+        """Writes the output for the changed students (all with force or a changed roster)."""
+        start = time.perf_counter()
+        self.sync()
+        # Shards may regroup when the roster changed, so then all of them are rewritten
+        changed = None if force else self._unwritten
+        written = changed is None or bool(changed)
+        if written:
+            self.state.write(changed=changed)
+            self._unwritten = set()
+            self.written_at = time.time()
+        return {
+            'written': written,
+            'changed_students': None if changed is None else sorted(changed),
+            'output': str(self.state.args.output),
+            'seconds': time.perf_counter() - start
+        }
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Routes the API requests to the server's GradingService and replies with JSON."""
+
+    def do_GET(self):
+        self._dispatch(self._get)
+
+    def do_POST(self):
+        self._dispatch(self._post)
+
+    def _dispatch(self, handler):
+        # A failed request must not stop the service; the state stays as it was
+        try:
+            handler(urlsplit(self.path))
+        except Exception as e:
+            print(f"Error: Request failed: {type(e).__name__}: {e}")
+            self._reply(500, {'error': f"{type(e).__name__}: {e}"})
+
+    def _get(self, url):
+        if url.path == '/summary':
+            self._reply(200, self.server.service.summary())
+        elif url.path.startswith('/students/'):
+            username = unquote(url.path.removeprefix('/students/'))
+            result = self.server.service.student(username)
+            if result is None:
+                self._reply(404, {'error': f"Unknown student '{username}'"})
+            else:
+                self._reply(200, result)
+        else:
+            self._reply(404, {'error': f"Unknown endpoint {url.path}"})
+
+    def _post(self, url):
+        if url.path != '/regenerate':
+            self._reply(404, {'error': f"Unknown endpoint {url.path}"})
+            return
+        force = parse_qs(url.query).get('force', ['0'])[-1] not in ('0', 'false', '')
+        self._reply(200, self.server.service.regenerate(force))
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def _reply(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    """HTTPServer counterpart listening on a Unix socket instead of a TCP port."""
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+def serve_state(state: WarmState) -> int:
+    """Serves the API on 127.0.0.1:--port, or on the Unix socket --socket, until interrupted.
+
+    SIGTERM stops the service like Ctrl+C, so service managers shut it down cleanly.
+    """
+    args = state.args
+    signal.signal(signal.SIGTERM, _stop)
+    if args.socket is not None:
+        server = UnixHTTPServer(args.socket, RequestHandler)
+        address = f"unix socket {args.socket}"
+    else:
+        server = HTTPServer(('127.0.0.1', args.port), RequestHandler)
+        address = f"http://127.0.0.1:{server.server_address[1]}"
+    server.service = GradingService(state)
+    print(f"Serving {state.input_dir} on {address}. Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped serving.")
+    finally:
+        server.server_close()
+        if args.socket is not None:
+            Path(args.socket).unlink(missing_ok=True)
+    return 0
@@ -0,0 +1,191 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from cache import file_digest
+
+# Compact per-run record of every student's computed results and input hashes, so two runs
+# can be compared without opening their workbooks. Comparing needs only the standard
+# library; pandas and excel_generator are imported when a snapshot is built.
+
+SNAPSHOT_VERSION = 1
+VALUE_COLUMNS = ('formalities_pct', 'practical_tasks_pct', 'solution_report_pct', 'total_pct')
+# Percentages closer than this count as unchanged (float noise, not a regrade)
+TOLERANCE = 1e-9
+
+def default_snapshot_path(output_path: str | Path) -> Path:
+    """Returns the snapshot location used for an output workbook (stored next to it)."""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.stem + '.snapshot.json')
+
+def previous_snapshot_path(snapshot_path: str | Path) -> Path:
+    """Returns where save_snapshot keeps the snapshot it replaced."""
+    snapshot_path = Path(snapshot_path)
+    return snapshot_path.with_name(snapshot_path.name.removesuffix('.json') + '.prev.json')
+
+def input_hashes(found_files: Dict[str, Optional[Path]], previous: Optional[Dict[str, Any]] = None, rehash: bool = False) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Returns {kind: {'sha256', 'size', 'mtime_ns'}} of a student's grading files (None if not found).
+
+    Like the parse cache, a digest in previous (the student's 'inputs' in an earlier snapshot)
+    is reused while the file's size and mtime are unchanged, unless rehash is set.
+    """
+    previous = previous or {}
+    inputs = {}
+    for kind, path in found_files.items():
+        if path is None:
+            inputs[kind] = None
+            continue
+        stat = os.stat(path)
+        old = previous.get(kind)
+        if not rehash and old and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+            digest = old['sha256']
+        else:
+            digest = file_digest(path)
+        inputs[kind] = {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return inputs
+
+def build_snapshot(students_df, grading: Dict[str, Dict[str, Any]], files: Dict[str, Dict[str, Optional[Path]]], scheme=None, previous: Optional[Dict[str, Any]] = None, rehash: bool = False) -> Dict[str, Any]:
+    """Returns the snapshot of a run: per roster student the results their workbook sheet shows
+    (sheet_grades) and the input_hashes of their grading files.
+
+    grading is the collect_grading result and files the discovered files per username.
+    Digests of unchanged files are taken from the previous snapshot, if given (see input_hashes).
+    """
+    from excel_generator import sheet_grades
+    from scheme import default_scheme
+    scheme = scheme or default_scheme()
+    grades = sheet_grades(students_df, grading['tasks'], grading['other'], grading['rubrics'], scheme)
+    columns = {name: grades[name].tolist() for name in (*VALUE_COLUMNS, 'german_grade')}
+
+    previous_students = previous['students'] if previous else {}
+    students = {}
+    for pos, (username, firstname, lastname) in enumerate(students_df[['Username', 'First name', 'Last name']].itertuples(index=False)):
+        students[username] = {
+            'name': f"{firstname} {lastname}",
+            'inputs': input_hashes(files.get(username, {}), previous_students.get(username, {}).get('inputs'), rehash),
+            'values': {name: values[pos] for name, values in columns.items()}
+        }
+    return {
+        'version': SNAPSHOT_VERSION,
+        'created': time.time(),
+        'scheme': scheme.name,
+        'students': students
+    }
+
+def save_snapshot(snapshot: Dict[str, Any], path: str | Path):
+    """Writes a snapshot; the one it replaces is kept as the previous_snapshot_path."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+    if path.exists():
+        os.replace(path, previous_snapshot_path(path))
+    os.replace(tmp_path, path)
+
+def load_snapshot(path: str | Path) -> Dict[str, Any]:
+    """Reads a snapshot written by save_snapshot; raises ValueError for other files."""
+    with open(path, 'r', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is not a grading snapshot (version {SNAPSHOT_VERSION})")
+    return snapshot
+
+def _changed(old, new) -> bool:
+    if old is None or new is None:
+        return old is not new
+    return not math.isclose(old, new, rel_tol=0.0, abs_tol=TOLERANCE)
+
+def _digest(inputs: Dict[str, Any], kind: str) -> Optional[str]:
+    return (inputs.get(kind) or {}).get('sha256')
+
+def diff_snapshots(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Compares two snapshots in one pass over their students.
+
+    Returns {'added': [...], 'removed': [...], 'changed': {username: change}, 'unchanged': n}
+    with usernames in the new snapshot's order. A change holds 'grade' ((old, new) if the
+    grade changed, i.e. the total crossed a grade boundary), 'values' ({name: (old, new)} of
+    the changed percentages) and 'inputs' (grading files whose content changed). Students whose
+    inputs changed without any effect on their results are listed as well.
+    """
+    old_students = old['students']
+    new_students = new['students']
+    added = []
+    changed = {}
+    unchanged = 0
+    for username, entry in new_students.items():
+        previous = old_students.get(username)
+        if previous is None:
+            added.append(username)
+            continue
+        old_values, new_values = previous['values'], entry['values']
+        values = {name: (old_values.get(name), new_values.get(name)) for name in VALUE_COLUMNS if _changed(old_values.get(name), new_values.get(name))}
+        grade = (old_values['german_grade'], new_values['german_grade']) if old_values['german_grade'] != new_values['german_grade'] else None
+        inputs = sorted(kind for kind in previous['inputs'].keys() | entry['inputs'].keys() if _digest(previous['inputs'], kind) != _digest(entry['inputs'], kind))
+        if values or grade or inputs:
+            changed[username] = {'name': entry['name'], 'grade': grade, 'values': values, 'inputs': inputs}
+        else:
+            unchanged += 1
+    removed = [username for username in old_students if username not in new_students]
+    return {'added': added, 'removed': removed, 'changed': changed, 'unchanged': unchanged}
+
+def _pct(value) -> str:
+    return "n/a" if value is None else f"{value * 100:.1f}%"
+
+def _inputs(change: Dict[str, Any]) -> str:
+    return f" [changed: {', '.join(change['inputs'])}]" if change['inputs'] else ""
+
+def print_diff(diff: Dict[str, Any]):
+    """Prints a diff_snapshots result, grade changes first."""
+    changed = diff['changed']
+    crossings = {username: change for username, change in changed.items() if change['grade']}
+    components = {username: change for username, change in changed.items() if not change['grade'] and change['values']}
+    inputs_only = {username: change for username, change in changed.items() if not change['grade'] and not change['values']}
+
+    print(f"Grade changes: {len(crossings)}")
+    for username, change in crossings.items():
+        old_total, new_total = change['values'].get('total_pct', (None, None))
+        print(f"  {username} ({change['name']}): {change['grade'][0]} -> {change['grade'][1]} (total {_pct(old_total)} -> {_pct(new_total)}){_inputs(change)}")
+    print(f"Changed results without a grade change: {len(components)}")
+    for username, change in components.items():
+        details = ", ".join(f"{name.removesuffix('_pct')} {_pct(old)} -> {_pct(new)}" for name, (old, new) in change['values'].items())
+        print(f"  {username} ({change['name']}): {details}{_inputs(change)}")
+    print(f"Changed inputs without an effect on the results: {len(inputs_only)}")
+    for username, change in inputs_only.items():
+        print(f"  {username} ({change['name']}): {', '.join(change['inputs'])}")
+    if diff['added']:
+        print(f"Added students: {', '.join(diff['added'])}")
+    if diff['removed']:
+        print(f"Removed students: {', '.join(diff['removed'])}")
+    print(f"Unchanged students: {diff['unchanged']}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compares the snapshots of two grading runs")
+    parser.add_argument('old', type=str, help="Snapshot of the earlier run, e.g. results.snapshot.prev.json; with only one snapshot given, this is the newer one")
+    parser.add_argument('new', type=str, nargs='?', default=None, help="Snapshot of the later run (default: compare OLD with the snapshot it replaced)")
+    parser.add_argument('--json', type=str, default=None, help="Also write the differences as JSON to this file")
+    args = parser.parse_args(argv)
+
+    old_path, new_path = args.old, args.new
+    if new_path is None:
+        old_path, new_path = previous_snapshot_path(args.old), args.old
+    try:
+        old, new = load_snapshot(old_path), load_snapshot(new_path)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 2
+    print(f"Comparing {old_path} with {new_path}")
+    diff = diff_snapshots(old, new)
+    print_diff(diff)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(diff, f, indent=2)
+    # Like diff(1): 1 if anything changed
+    return 1 if diff['changed'] or diff['added'] or diff['removed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
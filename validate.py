@@ -0,0 +1,105 @@
+import math
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from parser import AI_FILE_SUFFIXES, DirectoryIndex, parse_student_files
+from rubric import resolve_rubric
+from scheme import GradingScheme, default_scheme
+
+# Checks for --dry-run. Like the parser's record readers they only need the standard
+# library, so validating a cohort never loads pandas or the Excel stack.
+
+def check_student(found_files: Dict[str, Optional[Path]], scheme: Optional[GradingScheme] = None) -> Tuple[List[str], List[str]]:
+    """Parses a student's grading files and returns (errors, warnings) about their content."""
+    scheme = scheme or default_scheme()
+    errors = []
+    warnings = []
+    if not any(found_files.values()):
+        return errors, ["no grading files found"]
+
+    try:
+        data = parse_student_files(found_files)
+    except Exception as e:
+        return [f"cannot parse grading files: {type(e).__name__}: {e}"], warnings
+
+    if data['other'] is None:
+        warnings.append("no *-other.csv (formalities count as 0)")
+    else:
+        rubric = resolve_rubric(data['other'], scheme)
+        missing = [entry['key'] for entry in scheme.rubric_items if entry['key'] not in rubric]
+        if missing:
+            warnings.append(f"rubric items without a row: {', '.join(missing)}")
+        for entry in scheme.rubric_items:
+            score = rubric.get(entry['key'])
+            if score is None:
+                continue
+            if math.isnan(score.score):
+                warnings.append(f"{entry['key']}: score is not numeric")
+            elif not 0 <= score.score <= entry['max']:
+                errors.append(f"{entry['key']}: score {score.score:g} outside 0-{entry['max']:g}")
+
+    tasks = data['tasks']
+    if tasks is None or tasks.empty:
+        warnings.append("no practical tasks")
+    else:
+        for column, max_score, _ in scheme.task_terms:
+            if column not in tasks.columns:
+                errors.append(f"*-tasks.csv has no {column} column")
+                continue
+            for task, score in zip(tasks.task, tasks.columns[column]):
+                if math.isnan(score):
+                    warnings.append(f"{task}: {column} is not numeric")
+                elif not 0 <= score <= max_score:
+                    errors.append(f"{task}: {column} {score:g} outside 0-{max_score:g}")
+    return errors, warnings
+
+def find_orphan_files(index: DirectoryIndex, jobs: List[Tuple[str, Dict[str, Optional[Path]]]], conflicts: Optional[Dict[str, Any]] = None) -> List[Path]:
+    """Returns the grading files in the input directory that no student resolved to.
+
+    Files left unassigned because of a name conflict (see discover_student_files) are not orphans.
+    """
+    used = {path for _, found_files in jobs for path in found_files.values() if path is not None}
+    if conflicts:
+        used.update(path for candidates in conflicts['ambiguous'].values() for paths in candidates.values() for path in paths)
+        used.update(conflicts['shared'])
+    return sorted(
+        path for name, path in index.files.items()
+        if path not in used and any(name.lower().endswith(suffix) for _, suffix in AI_FILE_SUFFIXES)
+    )
+
+def validate_inputs(index: DirectoryIndex, jobs: List[Tuple[str, Dict[str, Optional[Path]]]], scheme: Optional[GradingScheme] = None, conflicts: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Checks every student's grading files plus the directory as a whole.
+
+    conflicts is the dict filled by discover_student_files; its ambiguous and shared name
+    matches are errors of the students concerned.
+    Returns {'errors': {username: [...]}, 'warnings': {username: [...]}, 'orphans': [...]}.
+    """
+    errors = {}
+    warnings = {}
+    if conflicts:
+        for username, candidates in conflicts['ambiguous'].items():
+            for kind, paths in candidates.items():
+                errors.setdefault(username, []).append(f"name matches several {kind} files, none assigned: {', '.join(path.name for path in paths)}")
+        for path, usernames in conflicts['shared'].items():
+            for username in usernames:
+                others = ', '.join(other for other in usernames if other != username)
+                errors.setdefault(username, []).append(f"{path.name} also matches {others}, assigned to none")
+    for username, found_files in jobs:
+        student_errors, student_warnings = check_student(found_files, scheme)
+        if student_errors:
+            errors.setdefault(username, []).extend(student_errors)
+        if student_warnings:
+            warnings[username] = student_warnings
+    return {'errors': errors, 'warnings': warnings, 'orphans': find_orphan_files(index, jobs, conflicts)}
+
+def print_validation(result: Dict[str, Any]):
+    """Prints a validate_inputs result."""
+    for label, problems in (("Error", result['errors']), ("Warning", result['warnings'])):
+        for username, messages in problems.items():
+            for message in messages:
+                print(f"{label}: {username}: {message}")
+    for path in result['orphans']:
+        print(f"Warning: {path.name} does not belong to any student")
+    warning_count = sum(len(messages) for messages in result['warnings'].values()) + len(result['orphans'])
+    error_count = sum(len(messages) for messages in result['errors'].values())
+    print(f"Validation finished: {error_count} error(s), {warning_count} warning(s).")
@@ -0,0 +1,224 @@
+import contextlib
+import ctypes
+import ctypes.util
+import io
+import os
+import select
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from parser import AI_FILE_SUFFIXES, DirectoryIndex, parse_students
+from cache import ParseCache
+from scheme import GradingScheme
+from instrumentation import stage
+from pipeline import discover_student_files, load_student_data, update_grading, write_report, report_name_conflicts, report_parse_errors
+
+ROSTER_FILES = ('students.csv', 'example-students.csv')
+WATCHED_SUFFIXES = tuple(suffix for _, suffix in AI_FILE_SUFFIXES)
+
+# inotify event mask: content written, files created, deleted or renamed
+IN_WATCH_MASK = 0x002 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+
+def snapshot_directory(input_dir: str | Path) -> Dict[str, Tuple[int, int]]:
+    """Returns {file name: (size, mtime_ns)} for the roster and grading files in input_dir."""
+    snapshot = {}
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            name = entry.name.lower()
+            if name not in ROSTER_FILES and not name.endswith(WATCHED_SUFFIXES):
+                continue
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                # Removed between listing and stat
+                continue
+    return snapshot
+
+def changed_files(old: Dict[str, Tuple[int, int]], new: Dict[str, Tuple[int, int]]) -> Set[str]:
+    """Returns the names of files added, removed or modified between two snapshots."""
+    return {name for name in old.keys() | new.keys() if old.get(name) != new.get(name)}
+
+class DirectoryWatcher:
+    """Sleeps until a directory may have changed.
+
+    On Linux an inotify descriptor (via libc, no extra dependency) wakes the watcher as soon
+    as a file is written; elsewhere, or if inotify is unavailable, it simply sleeps. Callers
+    compare snapshots either way, so missed or irrelevant events only cost a rescan.
+    """
+
+    def __init__(self, directory: str | Path, use_inotify: bool = True):
+        self.fd = None
+        if use_inotify and sys.platform.startswith('linux'):
+            self.fd = self._inotify(Path(directory))
+        self.mode = 'inotify' if self.fd is not None else 'polling'
+
+    @staticmethod
+    def _inotify(directory: Path) -> Optional[int]:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_WATCH_MASK) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def wait(self, timeout: float) -> bool:
+        """Waits up to timeout seconds; returns True if inotify reported activity meanwhile."""
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # Drain the queued events; only the wake-up matters
+        with contextlib.suppress(BlockingIOError):
+            while os.read(self.fd, 65536):
+                pass
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def wait_for_changes(watcher: DirectoryWatcher, input_dir: str | Path, snapshot: Dict[str, Tuple[int, int]], interval: float, debounce: float) -> Tuple[Dict[str, Tuple[int, int]], Set[str]]:
+    """Waits until watched files change and then stay unchanged for `debounce` seconds.
+
+    Editors and sync tools often write a file in several steps, or many files at once, so a
+    burst of changes is handled as one. Returns the new snapshot and every file that changed.
+    """
+    while True:
+        watcher.wait(interval)
+        current = snapshot_directory(input_dir)
+        if current != snapshot:
+            break
+    changed = changed_files(snapshot, current)
+    while True:
+        woke = watcher.wait(debounce)
+        latest = snapshot_directory(input_dir)
+        if latest == current and not woke:
+            return latest, changed
+        changed |= changed_files(current, latest)
+        current = latest
+
+def file_owners(files: Dict[str, Dict[str, Optional[Path]]]) -> Dict[str, Set[str]]:
+    """Maps every grading file name to the students it was resolved for."""
+    owners = {}
+    for username, found_files in files.items():
+        for path in found_files.values():
+            if path is not None:
+                owners.setdefault(path.name, set()).add(username)
+    return owners
+
+class WarmState:
+    """The parsed inputs of a run, kept in memory between regenerations (--watch, --serve).
+
+    Holds the roster, the discovered files, the parsed data and resolved rubrics of every
+    student, the parse errors and the directory snapshot they were read from. apply() brings
+    it up to date with a set of changed files, re-parsing only the students they affect.
+    """
+
+    def __init__(self, args, students_file: Path, students_df, jobs: List[Tuple[str, Dict[str, Optional[Path]]]], student_data: Dict[str, Dict[str, Any]], grading: Dict[str, Dict[str, Any]], cache: Optional[ParseCache] = None, scheme: Optional[GradingScheme] = None, errors: Optional[Dict[str, str]] = None):
+        self.args = args
+        self.students_file = students_file
+        self.input_dir = students_file.parent
+        self.students_df = students_df
+        self.files = dict(jobs)
+        self.owners = file_owners(self.files)
+        self.student_data = student_data
+        self.grading = grading
+        self.cache = cache
+        self.scheme = scheme
+        self.errors = dict(errors or {})
+        self.snapshot = snapshot_directory(self.input_dir)
+
+    def apply(self, snapshot: Dict[str, Tuple[int, int]], changed_names: Set[str]) -> Tuple[Set[str], bool]:
+        """Takes over a new directory snapshot and re-parses what the changed files affect.
+
+        Added or removed files trigger a new discovery; a changed roster is reloaded.
+        Returns the affected usernames and whether the roster changed.
+        """
+        previous, self.snapshot = self.snapshot, snapshot
+        roster_changed = self.students_file.name in changed_names
+        structure_changed = roster_changed or any(name not in previous or name not in snapshot for name in changed_names)
+
+        affected = set()
+        if roster_changed:
+            with stage('load_students'):
+                self.students_df = parse_students(self.students_file)
+        if structure_changed:
+            with stage('scan_directory'):
+                index = DirectoryIndex(self.input_dir)
+            conflicts = {}
+            with stage('discover'), contextlib.redirect_stdout(io.StringIO()):
+                new_files = dict(discover_student_files(self.students_df.to_dict('records'), index, conflicts))
+            report_name_conflicts(conflicts)
+            affected = {username for username in self.files.keys() | new_files.keys() if self.files.get(username) != new_files.get(username)}
+            self.files = new_files
+            self.owners = file_owners(self.files)
+        for name in changed_names:
+            affected |= self.owners.get(name, set())
+        if not affected:
+            return affected, roster_changed
+
+        if self.cache is not None:
+            self.cache.hits = self.cache.misses = 0
+        parse_jobs = [(username, self.files[username]) for username in self.files if username in affected]
+        new_data, errors = load_student_data(parse_jobs, self.args.workers, self.cache, io_threads=self.args.io_threads, lazy_text=self.args.lazy_text)
+        for username in affected:
+            data = new_data.get(username)
+            if data is None:
+                self.student_data.pop(username, None)
+            else:
+                self.student_data[username] = data
+            update_grading(self.grading, username, data, self.scheme)
+            self.errors.pop(username, None)
+        self.errors.update(errors)
+        report_parse_errors(errors)
+        if self.cache is not None:
+            with stage('cache_save'):
+                self.cache.save()
+        return affected, roster_changed
+
+    def write(self, changed: Optional[Set[str]] = None):
+        """Writes the output for the current state; see main.write_report for changed."""
+        write_report(self.args, self.students_df, self.grading, changed=changed, scheme=self.scheme, files=self.files)
+
+def watch_inputs(state: WarmState) -> int:
+    """Regenerates the output whenever the roster or grading files change, until interrupted.
+
+    Starts from the state of the initial run, so only students whose files changed are
+    re-parsed. With shards, only the shard workbooks holding affected students are rewritten.
+    """
+    args = state.args
+    watcher = DirectoryWatcher(state.input_dir)
+    print(f"Watching {state.input_dir} for changes ({watcher.mode}). Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            snapshot, changed_names = wait_for_changes(watcher, state.input_dir, state.snapshot, args.poll_interval, args.debounce)
+            start = time.perf_counter()
+            try:
+                affected, roster_changed = state.apply(snapshot, changed_names)
+                if not affected and not roster_changed:
+                    print(f"Changed file(s) belong to no student: {', '.join(sorted(changed_names))}")
+                    continue
+                # Shards may regroup when the roster changes, so then all of them are rewritten
+                state.write(changed=None if roster_changed else affected)
+            except Exception as e:
+                print(f"Error: Regeneration failed, waiting for the next change: {type(e).__name__}: {e}")
+                continue
+            print(f"Regenerated after changes to {len(changed_names)} file(s) ({len(affected)} student(s)) in {time.perf_counter() - start:.2f}s.")
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        watcher.close()
+    return 0